@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+'''Compares building, writing and reading a document with the xml.etree and
+lxml backends, which write the same text.
+
+Usage: python benchmarks/bench_backends.py [facets ...]'''
+
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from bench_pretty import make_gdml
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run(backend, facets, tmp):
+    'Seconds to build, write plain, write pretty and read back, and the text.'
+    gdml.use_backend(backend)
+    build, mygdml = timed(make_gdml, facets)
+    plain, pretty = Path(tmp) / (backend + '.gdml'), Path(tmp) / (backend + '_pretty.gdml')
+    write, _ = timed(mygdml.to_file, plain)
+    write_pretty, _ = timed(mygdml.to_file, pretty, True)
+    read, _ = timed(gdml.GDML.from_file, plain)
+    return (build, write, write_pretty, read), (plain.read_bytes(), pretty.read_bytes())
+
+
+def main(sizes):
+    if gdml.lxml_etree is None:
+        print('lxml is not installed')
+        return
+    print('{0:>10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'facets', 'backend', 'build [s]', 'write [s]', 'pretty [s]', 'read [s]'))
+    for facets in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            texts = []
+            for backend in ('etree', 'lxml'):
+                times, text = run(backend, facets, tmp)
+                texts.append(text)
+                print('{0:>10} {1:>8} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f}'.format(facets, backend, *times))
+            if texts[0] != texts[1]:
+                print('Outputs differ!')
+
+
+if __name__ == '__main__':
+    main([int(float(arg)) for arg in sys.argv[1:]] or [10**5, 10**6])
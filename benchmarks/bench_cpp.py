@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''Compares the original per-line G4TessellatedSolid formatting with the
+chunked writer, which streams to a file.
+
+Usage: python benchmarks/bench_cpp.py [facets ...]'''
+
+import sys
+import time
+import tempfile
+from pathlib import Path
+from io import StringIO
+
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+from pygdml.cpp import G4TessellatedSolid
+
+
+def make_solid(facets):
+    'A tessellated strip with the given number of triangles.'
+    solid = G4TessellatedSolid('strip')
+    for i in range(facets + 2):
+        solid.add_vert((i * 1e-3, (i % 2) * 1e-3, 0.5))
+    for i in range(facets):
+        solid.add_face([i, i + 1, i + 2])
+    solid.faces
+    return solid
+
+
+def legacy_str(solid):
+    'The code text as the original implementation built it, line by line.'
+    def info():
+        return dict(name=solid._name,
+                    nfaces=len(solid.faces),
+                    nverts=len(solid._vertlist),
+                    solid='solid' + solid._name,
+                    verts=solid._name + '_v',
+                    faces=solid._name + '_f')
+
+    with StringIO() as output:
+        print('// Solid {name} exported from Blender'.format(**info()), file=output)
+        print('G4TessellatedSolid* {solid} = new G4TessellatedSolid("{name}");'.format(**info()), file=output)
+        print('G4VFacet* {faces}[{nfaces}];'.format(**info()), file=output)
+        init = output.getvalue()
+
+    with StringIO() as output:
+        print('G4ThreeVector {verts}[] = {{'.format(**info()), file=output)
+        for vert in solid._vertlist:
+            print('    G4ThreeVector({0[0]:.4f},{0[1]:.4f},{0[2]:.4f})*m,'.format(vert), file=output)
+        print('};', file=output)
+        vertlist = output.getvalue()
+
+    with StringIO() as output:
+        for n, face in enumerate(solid.faces):
+            name = 'Triangular' if len(face) == 3 else 'Quadrangular'
+            print('{faces}[{n}] = (G4VFacet*) new G4{type}Facet ('
+                  .format(n=n, type=name, **info()), end=' ', file=output)
+            str_verts = ', '.join('{verts}[{v}]'.format(v=vertex, **info()) for vertex in face)
+            print(str_verts + ', ABSOLUTE);', file=output)
+        facelist = output.getvalue()
+
+    with StringIO() as output:
+        print('for(int i_{name}=0; i_{name}<{nfaces}; i_{name}++)'.format(**info()), file=output)
+        print('    {solid}->AddFacet({faces}[i_{name}]);'.format(**info()), file=output)
+        print('{solid}->SetSolidClosed(true);'.format(**info()), file=output)
+        finalize = output.getvalue()
+
+    return '\n'.join([init, vertlist, facelist, finalize])
+
+
+def legacy_to_file(solid, f):
+    f.write(legacy_str(solid))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    print('{0:>10} {1:>12} {2:>12} {3:>8}'.format('facets', 'legacy [s]', 'write [s]', 'speedup'))
+    for facets in sizes:
+        solid = make_solid(facets)
+        with tempfile.TemporaryFile('w') as f:
+            old = timed(legacy_to_file, solid, f)
+        with tempfile.TemporaryFile('w') as f:
+            new = timed(solid.write, f)
+        print('{0:>10} {1:>12.2f} {2:>12.2f} {3:>7.1f}x'.format(facets, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main([int(float(arg)) for arg in sys.argv[1:]] or [10**5, 5 * 10**5])
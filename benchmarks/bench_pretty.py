@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''Compares the old minidom pretty printer with gdml.write_pretty.
+
+Usage: python benchmarks/bench_pretty.py [facets ...]'''
+
+import sys
+import time
+from pathlib import Path
+from io import StringIO
+import xml.dom.minidom
+import xml.etree.ElementTree as etree
+
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+
+
+def make_gdml(facets):
+    'A world with one tessellated strip of the given number of triangles.'
+    mygdml = gdml.GDML('bench')
+    mygdml.solids.addBox('world', 10, 10, 10)
+    mygdml.structure.addWorld()
+    nverts = facets + 2
+    mygdml.define.addVerts('strip', ((i * 1e-3, (i % 2) * 1e-3, 0.5) for i in range(nverts)))
+    mygdml.solids.addTessallated('strip', ([i, i + 1, i + 2] for i in range(facets)))
+    mygdml.structure.addVolume('strip', 'G4_Si')
+    return mygdml
+
+
+def minidom_pretty(mygdml):
+    s = etree.tostring(mygdml.getElements(), encoding='unicode')
+    return xml.dom.minidom.parseString(s).toprettyxml(indent='  ')
+
+
+def native_pretty(mygdml):
+    with StringIO() as output:
+        gdml.write_pretty(mygdml.getElements(), output)
+        return output.getvalue()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    print('{0:>10} {1:>12} {2:>12} {3:>8}'.format('facets', 'minidom [s]', 'native [s]', 'speedup'))
+    for facets in sizes:
+        mygdml = make_gdml(facets)
+        old = timed(minidom_pretty, mygdml)
+        new = timed(native_pretty, mygdml)
+        print('{0:>10} {1:>12.2f} {2:>12.2f} {3:>7.1f}x'.format(facets, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main([int(float(arg)) for arg in sys.argv[1:]] or [10**5, 10**6])
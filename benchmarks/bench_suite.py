@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+'''Times the hot paths of building, writing and generating code for large
+geometries, and records the peak memory each one allocates. Results are
+written as JSON, and can be compared with an earlier run.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--repeat N] [--only NAME]
+                                        [--json FILE] [--compare FILE] [--scaling]'''
+
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.cpp import G4TessellatedSolid
+
+FACETS = [10**3, 10**4, 10**5, 10**6]
+VOLUMES = [10**2, 10**3, 10**4, 10**5]
+QUICK_FACETS = [10**3, 10**4]
+QUICK_VOLUMES = [10**2, 10**3]
+
+# A timing slower than the earlier run by more than this is a regression
+SLOWER = 1.2
+# A case whose time grows as size**k with k over this, from its largest size
+# to twice that, does not scale linearly (k is 2 for quadratic code)
+SUPERLINEAR = 1.5
+
+
+def grid_mesh(facets):
+    '''A wavy sheet of about the given number of quads, as a list of vertex
+    tuples and a list of faces. Most quads are not flat, so they are split.'''
+    n = max(1, int(round(facets ** 0.5)))
+    x, y = np.meshgrid(np.arange(n + 1) * 1e-3, np.arange(n + 1) * 1e-3, indexing='ij')
+    z = 1e-4 * np.sin(x * 7e3) * np.cos(y * 5e3)
+    verts = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1).tolist()
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    corner = (i * (n + 1) + j).ravel()
+    faces = np.stack([corner, corner + n + 1, corner + n + 2, corner + 1], axis=1).tolist()
+    return verts, faces
+
+
+def tessellated_gdml(facets, compact=False):
+    'A world holding one tessellated sheet.'
+    return sheet_gdml(grid_mesh(facets), compact)
+
+
+def sheet_gdml(mesh, compact=False):
+    verts, faces = mesh
+    mygdml = gdml.GDML('bench', compact=compact)
+    mygdml.solids.addBox('world', 10, 10, 10)
+    mygdml.structure.addWorld()
+    mygdml.define.addVerts('sheet', verts)
+    mygdml.solids.addTessallated('sheet', gdml.breakup_quads_if_needed(faces, verts))
+    mygdml.structure.addVolume('sheet', 'G4_Si')
+    return mygdml
+
+
+def volume_names(volumes):
+    '''Names of a tree of volumes, ten daughters to a mother, and the name of
+    the mother of each (None for the world).'''
+    names = ['box' + str(i) for i in range(volumes)]
+    parents = [None if i < 10 else names[i // 10 - 1] for i in range(volumes)]
+    return names, parents
+
+
+def add_volumes(mygdml, names, parents):
+    for name, parent in zip(names, parents):
+        mygdml.structure.addVolume(name, 'G4_Si', parent=parent)
+
+
+def volumes_gdml(volumes):
+    mygdml = gdml.GDML('bench')
+    mygdml.solids.addBox('world', 10, 10, 10)
+    mygdml.structure.addWorld()
+    names, parents = volume_names(volumes)
+    for name in names:
+        mygdml.solids.addBox(name, 1e-3, 1e-3, 1e-3)
+    add_volumes(mygdml, names, parents)
+    return mygdml
+
+
+def cpp_solid(facets):
+    verts, faces = grid_mesh(facets)
+    solid = G4TessellatedSolid('sheet')
+    solid.add_verts(verts)
+    solid.add_faces(faces)
+    solid.faces
+    return solid
+
+
+def pretty_string(mygdml):
+    return mygdml.to_string(pretty=True)
+
+
+def write_file(mygdml, pretty):
+    with tempfile.TemporaryDirectory() as tmp:
+        mygdml.to_file(Path(tmp) / 'bench.gdml', pretty)
+
+
+# Each case makes its input from a size outside the timing, then times a call
+CASES = {
+    'addVerts': ('facets', lambda n: (gdml.Define(), grid_mesh(n)[0]),
+                 lambda args: args[0].addVerts('sheet', args[1])),
+    'addTessallated': ('facets', lambda n: (gdml.Solids(), grid_mesh(n)[1]),
+                       lambda args: args[0].addTessallated('sheet', args[1])),
+    'addVolume': ('volumes', lambda n: (volumes_gdml(0), *volume_names(n)),
+                  lambda args: add_volumes(*args)),
+    'addPhysvols': ('volumes', lambda n: (volumes_gdml(1), np.random.default_rng(0).random((n, 3))),
+                    lambda args: args[0].structure.addPhysvols('box0', args[1])),
+    'breakup_quads_if_needed': ('facets', lambda n: grid_mesh(n)[::-1],
+                                lambda args: gdml.breakup_quads_if_needed(*args)),
+    'to_string_pretty': ('facets', tessellated_gdml, pretty_string),
+    'to_file': ('facets', tessellated_gdml, lambda mygdml: write_file(mygdml, False)),
+    'to_file_pretty': ('facets', tessellated_gdml, lambda mygdml: write_file(mygdml, True)),
+    'build': ('facets', grid_mesh, sheet_gdml),
+    'build_compact': ('facets', grid_mesh, lambda mesh: sheet_gdml(mesh, True)),
+    'to_file_compact': ('facets', lambda n: tessellated_gdml(n, True), lambda mygdml: write_file(mygdml, False)),
+    'to_string_pretty_volumes': ('volumes', volumes_gdml, pretty_string),
+    'to_file_volumes': ('volumes', volumes_gdml, lambda mygdml: write_file(mygdml, False)),
+    'G4TessellatedSolid.__str__': ('facets', cpp_solid, str),
+}
+
+
+def measure(make, run, size, repeat):
+    '''Best wall time of repeat runs, each on a fresh input, and the peak
+    memory in bytes of one more run under tracemalloc.'''
+    times = []
+    for _ in range(repeat):
+        args = make(size)
+        gc.collect()
+        start = time.perf_counter()
+        run(args)
+        times.append(time.perf_counter() - start)
+        del args
+    args = make(size)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run_suite(quick=False, repeat=3, only=None):
+    sizes = {'facets': QUICK_FACETS if quick else FACETS,
+             'volumes': QUICK_VOLUMES if quick else VOLUMES}
+    results = []
+    for name, (kind, make, run) in CASES.items():
+        if only and not any(part in name for part in only):
+            continue
+        for size in sizes[kind]:
+            seconds, peak = measure(make, run, size, repeat)
+            results.append({'name': name, kind: size, 'seconds': seconds, 'peak_bytes': peak})
+            print('{0:>28} {1:>9} {2:>8} {3:>10.4f} s {4:>10.1f} MiB'.format(
+                name, size, kind, seconds, peak / 2**20), flush=True)
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat,
+            'results': results}
+
+
+def compare(old, new):
+    'Prints the change of each timing and memory peak; returns the regressions.'
+    def key(result):
+        return (result['name'], result.get('facets'), result.get('volumes'))
+
+    before = {key(result): result for result in old['results']}
+    regressions = []
+    print('{0:>28} {1:>9} {2:>9} {3:>9}'.format('case', 'size', 'time', 'memory'))
+    for result in new['results']:
+        previous = before.get(key(result))
+        if previous is None:
+            continue
+        time_ratio = result['seconds'] / previous['seconds']
+        memory_ratio = result['peak_bytes'] / max(previous['peak_bytes'], 1)
+        print('{0:>28} {1:>9} {2:>8.2f}x {3:>8.2f}x'.format(
+            result['name'], result.get('facets', result.get('volumes')), time_ratio, memory_ratio))
+        if time_ratio > SLOWER or memory_ratio > SLOWER:
+            regressions.append(result)
+    return regressions
+
+
+def scaling(quick=False, repeat=3, only=None):
+    '''Times each case at its largest size and at twice that, and prints the
+    exponent k of time ~ size**k between them. Returns the cases with k over
+    SUPERLINEAR. The cyclic garbage collector is paused while timing, as its
+    full passes over a growing heap would hide how the code itself scales.'''
+    sizes = {'facets': QUICK_FACETS if quick else FACETS,
+             'volumes': QUICK_VOLUMES if quick else VOLUMES}
+    superlinear = []
+    for name, (kind, make, run) in CASES.items():
+        if only and not any(part in name for part in only):
+            continue
+        size = sizes[kind][-1]
+        gc.disable()
+        try:
+            first, _ = measure(make, run, size, repeat)
+            second, _ = measure(make, run, 2 * size, repeat)
+        finally:
+            gc.enable()
+        exponent = np.log2(second / max(first, 1e-9))
+        print('{0:>28} {1:>9} {2:>8} exponent {3:.2f}'.format(name, size, kind, exponent), flush=True)
+        if exponent > SUPERLINEAR:
+            superlinear.append(name)
+    return superlinear
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='only the smaller sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each case')
+    parser.add_argument('--only', action='append', help='run the cases whose name contains this')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with the results in this file')
+    parser.add_argument('--scaling', action='store_true', help='fail if a case does not scale linearly')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick, args.repeat, args.only)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results)
+        if regressions:
+            print(len(regressions), 'regressions over', SLOWER, 'x')
+            return 1
+    if args.scaling:
+        superlinear = scaling(args.quick, args.repeat, args.only)
+        if superlinear:
+            print('Not linear:', ', '.join(superlinear))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,12 +21,107 @@ if "bpy" in locals():
     if 'blendertoGDML' in locals():
         imp.reload(blendertoGDML)
 
+import threading
+from functools import partial
+
 import bpy
-from bpy.props import StringProperty, BoolProperty, FloatVectorProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty, FloatProperty, FloatVectorProperty
 from bpy_extras.io_utils import ExportHelper
 
 
-class EXPORT_OT_geant_cpp(bpy.types.Operator, ExportHelper):
+class ExportCancelled(Exception):
+    'Raised in an export worker at its next progress report once cancelled.'
+
+
+class BackgroundExport(object):
+    '''Runs an export without freezing Blender. execute copies the meshes
+    out of Blender in the main thread with extract(stats), which returns the
+    rest of the export as a function; that runs in a worker thread, while a
+    timer updates the progress bar. Escape cancels the export, and the file
+    being written is dropped. finished(result) is called with what the
+    function returned. Only an export started from the file browser runs in
+    the background; called from a script, or without a window as under
+    blender -b, the file is written by the time execute returns.'''
+
+    def invoke(self, context, event):
+        self._invoked = True
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        from .stats import Stats
+        self._fraction = 0.
+        self._cancel = threading.Event()
+        self._result = self._error = None
+        self._stats = Stats(progress=self._progress)
+        work = self.extract(self._stats)
+        if bpy.app.background or context.window is None or not getattr(self, '_invoked', False):
+            self._run(work)
+            return self._done()
+        self._thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        self._thread.start()
+        return {'RUNNING_MODAL'}
+
+    def _progress(self, fraction, message):
+        if self._cancel.is_set():
+            raise ExportCancelled(message)
+        self._fraction = fraction
+
+    def _run(self, work):
+        try:
+            self._result = work()
+        except BaseException as error:
+            self._error = error
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self._cancel.set()
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        if self._thread.is_alive():
+            context.window_manager.progress_update(int(self._fraction * 100))
+            return {'RUNNING_MODAL'}
+
+        self._finish(context)
+        return self._done()
+
+    def _done(self):
+        'Reports how the export went.'
+        if isinstance(self._error, ExportCancelled):
+            self.report({'WARNING'}, 'Export cancelled')
+            return {'CANCELLED'}
+        if self._error is not None:
+            self.report({'ERROR'}, 'Export failed: {0!r}'.format(self._error))
+            return {'CANCELLED'}
+        print(self._stats.report())
+        counts = self._stats.counts
+        self.report({'INFO'}, 'Exported {0} objects, {1} facets, {2} bytes'.format(
+            counts['objects'], counts['facets'], counts['bytes']))
+        self.finished(self._result)
+        return {'FINISHED'}
+
+    def cancel(self, context):
+        # Blender is closing the window, wait for the file to be dropped
+        self._cancel.set()
+        self._thread.join()
+        self._finish(context)
+
+    def _finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+
+    def finished(self, result):
+        pass
+
+
+class EXPORT_OT_geant_cpp(BackgroundExport, bpy.types.Operator, ExportHelper):
     bl_idname = "io_export_scene.geant_cpp"
     bl_description = 'Export to Geant4 C++ file format (.cc)'
     bl_label = "Export Geant4 C++"
@@ -51,19 +146,30 @@ class EXPORT_OT_geant_cpp(bpy.types.Operator, ExportHelper):
         description="Use global coordinates for points",
         default=True)
 
-    def execute(self, context):
-        from . import blendertoCPP
-        blendertoCPP.export_cpp(self.properties.filepath,
-                                self.properties.only_selected,
-                                self.properties.global_coords)
-        return {'FINISHED'}
+    budget = IntProperty(
+        name="Facet budget",
+        description="Decimate meshes with more facets than this. Off if 0.",
+        default=0, min=0)
 
-    def invoke(self, context, event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
+    simplify = FloatProperty(
+        name="Simplify distance",
+        description="Decimate meshes on a grid of this spacing. Off if 0.",
+        default=0, min=0, precision=4)
+
+    cache_dir = StringProperty(
+        name="Cache directory",
+        description="Reuse the output of meshes that did not change since the last export. Off if empty.",
+        subtype='DIR_PATH', default="")
 
+    def extract(self, stats):
+        from .blendertoGDML import selected_meshes, extract_meshes
+        from .blendertoCPP import build_cpp
+        props = self.properties
+        meshes = extract_meshes(selected_meshes(props.only_selected), props.global_coords, stats=stats)
+        return partial(build_cpp, props.filepath, meshes, props.budget, props.simplify, props.cache_dir, stats)
 
-class EXPORT_OT_geant_gdml(bpy.types.Operator, ExportHelper):
+
+class EXPORT_OT_geant_gdml(BackgroundExport, bpy.types.Operator, ExportHelper):
     bl_idname = "io_export_scene.geant_gdml"
     bl_description = 'Export to Geant4 GDML file format (.gdml)'
     bl_label = "Export Geant4 GDML"
@@ -97,18 +203,53 @@ class EXPORT_OT_geant_gdml(bpy.types.Operator, ExportHelper):
         description="Set the dimensions of the world box. Auto calculated if 0.",
         default=(0, 0, 0))
 
-    def execute(self, context):
-        from .blendertoGDML import export_gdml
-        export_gdml(self.properties.filepath,
-                    self.properties.only_selected,
-                    self.properties.global_coords,
-                    self.properties.world,
-                    self.properties.pretty)
-        return {'FINISHED'}
+    weld = FloatProperty(
+        name="Weld distance",
+        description="Merge vertices closer than this and drop unused ones. Off if 0.",
+        default=0, min=0, precision=6)
 
-    def invoke(self, context, event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
+    shard = IntProperty(
+        name="Shard above",
+        description="Write meshes with more facets than this to their own files, in parallel. Off if 0.",
+        default=0, min=0)
+
+    budget = IntProperty(
+        name="Facet budget",
+        description="Decimate meshes with more facets than this. Off if 0.",
+        default=0, min=0)
+
+    simplify = FloatProperty(
+        name="Simplify distance",
+        description="Decimate meshes on a grid of this spacing. Off if 0.",
+        default=0, min=0, precision=4)
+
+    primitives = BoolProperty(
+        name="Detect primitives",
+        description="Export meshes that are boxes, cylinders or cones as native solids",
+        default=False)
+
+    instances = BoolProperty(
+        name="Share identical meshes",
+        description="Export identical meshes once and place a copy per object (needs global coordinates)",
+        default=False)
+
+    cache_dir = StringProperty(
+        name="Cache directory",
+        description="Reuse the output of meshes that did not change since the last export. Off if empty.",
+        subtype='DIR_PATH', default="")
+
+    def extract(self, stats):
+        from .blendertoGDML import selected_meshes, extract_meshes, build_gdml
+        props = self.properties
+        meshes = extract_meshes(selected_meshes(props.only_selected), props.global_coords, props.instances, stats)
+        return partial(build_gdml, props.filepath, meshes, tuple(props.world), props.pretty, props.weld,
+                       props.shard, props.budget, props.simplify, props.primitives,
+                       props.instances and props.global_coords, props.cache_dir, stats)
+
+    def finished(self, converted):
+        if converted:
+            self.report({'INFO'}, 'Converted to primitives: ' + ', '.join(
+                '{0} ({1})'.format(name, solid) for name, solid in sorted(converted.items())))
 
 
 #    Registration
@@ -1,26 +1,63 @@
 #!/usr/bin/env python3
 # Run from inside Blender
 
-import bpy
-import bpy_types
+from io import StringIO
 
 from .cpp import G4TessellatedSolid as Tess
+from .gdml import atomic_path
+from .mesh import decimate, mesh_hash
+from .cache import FragmentCache
+from .stats import Stats
+from .blendertoGDML import selected_meshes, extract_meshes
 
-def export_cpp(filepath, only_sel, global_coor):
-    with open(filepath, 'w') as out:
-        print('Writing',filepath)
-        for ob in (bpy.context.selected_objects if only_sel else bpy.data.objects):
-            if isinstance(ob.data,bpy_types.Mesh):
-                name = ob.name.replace('.','_')
-                solid = Tess(name)
-                wmatrix = ob.matrix_world
+def export_cpp(filepath, only_sel, global_coor, budget=0, simplify=0, cache_dir='', stats=None):
+    if stats is None:
+        stats = Stats()
+    meshes = extract_meshes(selected_meshes(only_sel), global_coor, stats=stats)
+    build_cpp(filepath, meshes, budget, simplify, cache_dir, stats)
 
-                ob.data.calc_tessface()
+def build_cpp(filepath, meshes, budget=0, simplify=0, cache_dir='', stats=None):
+    '''Writes the code of meshes given as MeshData. Does not use Blender, so
+    it can run in a worker thread; the file is replaced only once complete.'''
+    if stats is None:
+        stats = Stats()
+    cache = FragmentCache(cache_dir) if cache_dir else None
+    print('Writing',filepath)
+    with atomic_path(filepath) as tmp, open(tmp, 'w') as out:
+        for n, mesh in enumerate(meshes):
+            stats.progress(n / len(meshes), mesh.name)
+            name, verts, faces = mesh.name, mesh.verts, mesh.faces
+            solid = Tess(name)
+            stats.add('objects')
 
-                for vert in ob.data.vertices:
-                    solid.add_vert(ob.matrix_world * vert.co if global_coor else vert.co)
+            if cache is not None:
+                with stats.phase('cache'):
+                    key = cache.key(name, mesh_hash(verts, faces), budget, simplify)
+                    code = cache.get(key)
+                if code is not None:
+                    stats.add('cached')
+                    with stats.phase('write'):
+                        out.write(code.decode())
+                    continue
 
-                for face in ob.data.tessfaces:
-                    solid.add_face(face.vertices)
+            if budget or simplify:
+                with stats.phase('decimate'):
+                    verts, faces = decimate(verts, faces, budget or None, simplify or None)
 
-                out.write(str(solid))
+            solid.add_verts(verts)
+            solid.add_faces(faces)
+            with stats.phase('split'):
+                stats.add('facets', len(solid.faces))
+            stats.add('vertices', len(verts))
+
+            with stats.phase('write'):
+                if cache is None:
+                    solid.write(out)
+                else:
+                    with StringIO() as code:
+                        solid.write(code)
+                        out.write(code.getvalue())
+                        cache.put(key, code.getvalue().encode())
+        stats.add('bytes', out.tell())
+        # A cancel while writing drops the file
+        stats.progress(1, 'Wrote ' + str(filepath))
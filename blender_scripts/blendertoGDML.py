@@ -3,53 +3,321 @@
 
 import bpy
 import bpy_types
+import os
 from pathlib import Path
+from collections import namedtuple
+from contextlib import contextmanager
 import numpy as np
 
-from .gdml import GDML, breakup_quads_if_needed
+from .gdml import GDML, breakup_quads_if_needed, atomic_path
+from .mesh import weld_vertices, decimate, mesh_hash
+from .shard import write_sharded
+from .bounds import Bounds
+from .primitives import recognize, add_primitive
+from .cache import FragmentCache, recording, add_fragment
+from .stats import Stats
+from .meshio import write_dump
 
 
-def export_gdml(filepath, only_sel, global_coor, world=(0, 0, 0), pretty=True):
+# The geometry of an object, copied out of Blender so it can be exported in
+# another thread. verts and faces are None for a linked duplicate of an
+# instanced mesh that was already copied.
+MeshData = namedtuple('MeshData', 'name material verts faces placement')
+# Where an instanced object is placed, and the key of its mesh datablock
+Placement = namedtuple('Placement', 'loc axes scale data_key')
+# The volume that objects with the same mesh share, and the Primitive in the
+# frame of the mesh if it was recognised as one, else None
+Instance = namedtuple('Instance', 'volume primitive')
+
+
+@contextmanager
+def _no_recording():
+    'Stands in for recording when there is no cache, as contextlib.nullcontext, new in Python 3.7.'
+    yield None
+
+
+def export_gdml(filepath, only_sel, global_coor, world=(0, 0, 0), pretty=True, weld=0, shard=0,
+                budget=0, simplify=0, primitives=False, instances=False, cache_dir='', stats=None):
+    '''Writes the meshes to filepath. Returns the objects that were recognised
+    as primitives, as a dict of name to solid type. With a cache_dir, the
+    solids of meshes that did not change since the last export are reused.
+    A Stats given as stats is filled in with the time of each phase and the
+    counts of the export, and told of the progress.'''
+    if stats is None:
+        stats = Stats()
+    meshes = extract_meshes(selected_meshes(only_sel), global_coor, instances, stats)
+    return build_gdml(filepath, meshes, world, pretty, weld, shard, budget, simplify, primitives,
+                      instances and global_coor, cache_dir, stats)
+
+
+def selected_meshes(only_sel):
+    objects = bpy.context.selected_objects if only_sel else bpy.data.objects
+    return [ob for ob in objects if isinstance(ob.data, bpy_types.Mesh)]
+
+
+def extract_meshes(objects, global_coor, instances=False, stats=None):
+    '''Copies the geometry of objects out of Blender, as a list of MeshData.
+    This must run in Blender's main thread; the rest of an export need not.'''
+    if stats is None:
+        stats = Stats()
+    seen = set() if instances and global_coor else None
+    meshes = []
+    with stats.phase('extract'):
+        for ob in objects:
+            meshes.append(extract_mesh(ob, global_coor, seen))
+    return meshes
+
+
+def extract_mesh(ob, global_coor, seen=None):
+    '''Copies the geometry of an object as a MeshData. With a set of seen
+    mesh keys, the object is instanced: its vertices are kept in its own
+    frame, and are not copied again for linked duplicates.'''
+    name = ob.name.replace('.', '_')
+    material = ob.data.materials[0].name if ob.data.materials else 'NoMaterial'
+    placement = None
+    if seen is not None:
+        loc, rot, scale = ob.matrix_world.decompose()
+        # Linked duplicates share their mesh datablock
+        data_key = (ob.data.name, tuple(round(s, 9) for s in scale), material)
+        placement = Placement(tuple(loc), np.array(rot.to_matrix(), dtype=np.double), tuple(scale), data_key)
+        if data_key in seen:
+            return MeshData(name, material, None, None, placement)
+        seen.add(data_key)
+
+    verts, faces = mesh_arrays(ob.data)
+    if placement is not None:
+        # The scale stays in the mesh, Geant4 can only place rotated copies
+        verts *= np.array(placement.scale)
+        if np.prod(placement.scale) < 0:
+            faces = reverse_faces(faces)
+    elif global_coor:
+        matrix = np.array(ob.matrix_world, dtype=np.double)
+        verts = np.dot(verts, matrix[:3, :3].T) + matrix[:3, 3]
+    return MeshData(name, material, verts, faces, placement)
+
+
+def mesh_arrays(mesh):
+    '''The vertices of a mesh as an (N,3) array, and its faces as an (M,3)
+    array of triangles, read with foreach_get. Blender before 2.80 has no
+    loop triangles, so its tessellated faces are read instead, as an (M,4)
+    array with triangles padded with -1 if there are quads.'''
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    verts = co.reshape(-1, 3).astype(np.double)
+
+    if hasattr(mesh, 'calc_loop_triangles'):
+        mesh.calc_loop_triangles()
+        faces = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', faces)
+        return verts, faces.reshape(-1, 3).astype(np.int64)
+
+    mesh.calc_tessface()
+    faces = np.empty(len(mesh.tessfaces) * 4, dtype=np.int32)
+    mesh.tessfaces.foreach_get('vertices_raw', faces)
+    faces = faces.reshape(-1, 4).astype(np.int64)
+    # Blender keeps the last vertex of a quad non-zero, so 0 marks a triangle
+    triangles = faces[:, 3] == 0
+    if triangles.all():
+        return verts, faces[:, :3]
+    faces[triangles, 3] = -1
+    return verts, faces
+
+
+def reverse_faces(faces):
+    'Reverses the winding of an array of faces, which may be padded with -1.'
+    if faces.shape[1] == 3:
+        return faces[:, ::-1]
+    return np.where(faces[:, 3:] < 0, faces[:, [2, 1, 0, 3]], faces[:, ::-1])
+
+
+def dump_meshes(meshes, directory):
+    '''Writes each MeshData as a mesh dump in directory, for the pygdml
+    command to convert outside Blender. Returns the file names.'''
+    directory = Path(directory)
+    os.makedirs(str(directory), exist_ok=True)
+    names = []
+    for mesh in meshes:
+        if mesh.verts is not None:
+            names.append(directory / (mesh.name + '.npz'))
+            write_dump(names[-1], mesh.verts, mesh.faces, mesh.material)
+    return names
+
+
+def build_gdml(filepath, meshes, world=(0, 0, 0), pretty=True, weld=0, shard=0, budget=0, simplify=0,
+               primitives=False, instances=False, cache_dir='', stats=None):
+    '''Builds and writes a document of meshes given as MeshData; see export_gdml.
+    Does not use Blender, so it can run in a worker thread. The file is
+    replaced only once it is complete, so an error, or a progress callback
+    raising to cancel, leaves no half written file.'''
     filepath = Path(filepath)
     print('Writing', filepath)
+    if stats is None:
+        stats = Stats()
+    world = list(world)
 
-    mygdml = GDML(filepath.stem)
+    # Cached fragments are cut from built elements, so only go compact without
+    mygdml = GDML(filepath.stem, compact=not cache_dir)
+    mygdml.stats = stats
 
-    objects = bpy.context.selected_objects if only_sel else bpy.data.objects
-    objects = [ob for ob in objects if isinstance(ob.data, bpy_types.Mesh)]
+    mygdml.structure.addWorld()
+    bounds = Bounds(mygdml)
 
-    extents = get_extents(objects)
+    converted = {}
+    shared = {} if instances else None
+    cache = FragmentCache(cache_dir) if cache_dir else None
+    for n, mesh in enumerate(meshes):
+        stats.progress(n / len(meshes), mesh.name)
+        found = add_mesh_data(mygdml, mesh, weld, budget, simplify, bounds, primitives, shared, cache, stats)
+        if found is not None:
+            converted[mesh.name] = found.solid
+
+    if cache is not None:
+        print('Reused', cache.hits, 'cached solids, made', cache.misses)
+
+    if shared:
+        print('Placed', len(meshes), 'meshes using', len({instance.volume for instance in shared.values()}), 'solids')
+
+    contents = bounds.contents()
+    extents = np.abs(contents).max(axis=0) * 2 if contents is not None else np.zeros(3)
     for i in range(3):
         if world[i] == 0:
             print('Setting extents on', i, 'axis to', extents[i])
             world[i] = extents[i]
     mygdml.solids.addBox('world', *world)
-    mygdml.structure.addWorld()
 
-    for ob in objects:
-        add_mesh(mygdml, ob, global_coor)
+    stats.progress(1, 'Writing ' + filepath.name)
+    if shard:
+        with stats.phase('shard'):
+            # Forking Blender, or spawning it, from here can hang
+            shard_files = write_sharded(mygdml, filepath, shard, pretty=pretty, threads=True)
+        for shard_file in shard_files:
+            stats.add('bytes', Path(shard_file).stat().st_size)
+            print('Wrote shard', shard_file)
+    else:
+        with atomic_path(filepath) as tmp:
+            mygdml.to_file(tmp, pretty)
+            # A cancel while writing drops the file
+            stats.progress(1, 'Wrote ' + filepath.name)
 
-    mygdml.to_file(filepath, pretty)
+    for name, solid in sorted(converted.items()):
+        print('Converted', name, 'to a', solid)
+    return converted
 
 
-def add_mesh(mygdml, ob, global_coor):
-    name = ob.name.replace('.', '_')
-    ob.data.calc_tessface()
+def add_mesh(mygdml, ob, global_coor, weld=0, budget=0, simplify=0, bounds=None, primitives=False,
+             instances=None, cache=None, stats=None):
+    '''Adds an object as a tessellated solid; see add_mesh_data.'''
+    if stats is None:
+        stats = Stats()
+    with stats.phase('extract'):
+        mesh = extract_mesh(ob, global_coor, set() if instances is not None and global_coor else None)
+    return add_mesh_data(mygdml, mesh, weld, budget, simplify, bounds, primitives, instances, cache, stats)
+
+
+def add_placement(mygdml, name, loc, axes):
+    '''Defines the position name_pos and rotation name_rot of an instanced
+    object at loc, turned by axes. A mesh recognised as a primitive is placed
+    by add_primitive instead, so these are only added once its path is known.'''
+    mygdml.define.addPosition(name + '_pos', *loc)
+    mygdml.define.addRotationMatrix(name + '_rot', *axes.ravel())
+
+
+def place_instance(mygdml, instance, name, loc, axes):
+    '''Places another copy of a shared Instance for the object name at loc,
+    turned by axes. A primitive is offset by its place in the mesh.'''
+    if instance.primitive is not None:
+        primitive = placed_primitive(instance.primitive, loc, axes)
+        loc, axes = primitive.position, primitive.axes
+    add_placement(mygdml, name, loc, axes)
+    return mygdml.structure.addPhysvol(instance.volume, name + '_pos', name + '_rot')
+
+
+def placed_primitive(primitive, loc, axes):
+    'A Primitive found in the frame of a mesh, placed at loc and turned by axes.'
+    return primitive._replace(position=np.dot(axes, primitive.position) + np.array(loc),
+                              axes=np.dot(axes, primitive.axes))
+
+
+def add_mesh_data(mygdml, mesh, weld=0, budget=0, simplify=0, bounds=None, primitives=False,
+                  instances=None, cache=None, stats=None):
+    '''Adds a MeshData as a tessellated solid; weld > 0 merges vertices closer than weld.
+    budget > 0 or simplify > 0 decimates to that many facets or grid spacing.
+    The extent of the vertices is recorded in bounds, if given. With primitives,
+    a mesh that is a box, tube or cone is added as one, and the Primitive is returned.
+    With an instances dict, meshes with a placement are placed by their object's location
+    and rotation, and objects with the same mesh share one solid and volume. With a
+    FragmentCache, the <define> and <solids> elements of a mesh are reused if its geometry
+    and options are unchanged. Phases and counts are recorded in stats, if given.'''
+    if stats is None:
+        stats = Stats()
+    name, material, vertlocs, solidfaces = mesh.name, mesh.material, mesh.verts, mesh.faces
+
+    placement = ()
+    if instances is not None and mesh.placement is not None:
+        loc, axes, data_key = mesh.placement.loc, mesh.placement.axes, mesh.placement.data_key
+        placement = (name + '_pos', name + '_rot')
+        if data_key in instances:
+            place_instance(mygdml, instances[data_key], name, loc, axes)
+            return None
+    stats.add('objects')
+
+    if placement:
+        key = (mesh_hash(vertlocs, solidfaces), material)
+        if key in instances:
+            instances[data_key] = instances[key]
+            place_instance(mygdml, instances[key], name, loc, axes)
+            return None
+        instances[key] = instances[data_key] = Instance(name, None)
 
-    vertlocs = [(ob.matrix_world * vert.co if global_coor else vert.co) for vert in ob.data.vertices]
-    mygdml.define.addVerts(name, vertlocs)
+    if cache is not None:
+        # Global coordinates are in the vertices; placements are not cached
+        with stats.phase('cache'):
+            fragment_key = cache.key(name, mesh_hash(vertlocs, solidfaces), weld, budget, simplify, primitives)
+            fragment = cache.get_fragment(fragment_key)
+        if fragment is not None:
+            stats.add('cached')
+            add_fragment(mygdml, fragment)
+            if placement:
+                add_placement(mygdml, name, loc, axes)
+            mygdml.structure.addVolume(name, material, *placement)
+            return None
 
-    solidfaces = [face.vertices for face in ob.data.tessfaces]
-    mygdml.solids.addTessallated(name, breakup_quads_if_needed(solidfaces, vertlocs))
+    with stats.phase('split'):
+        solidfaces = breakup_quads_if_needed(solidfaces, vertlocs)
 
-    mygdml.structure.addVolume(name, ob.data.materials[0].name if ob.data.materials else 'NoMaterial')
+    if weld:
+        with stats.phase('weld'):
+            vertlocs, solidfaces, removed = weld_vertices(vertlocs, solidfaces, weld)
+        print('Welding removed', removed, 'vertices from', name)
 
+    if primitives:
+        with stats.phase('primitives'):
+            found = recognize(vertlocs, solidfaces)
+        if found is not None:
+            if placement:
+                # Linked duplicates arrive without vertices, so keep sharing it
+                instances[key] = instances[data_key] = Instance(name, found)
+                found = placed_primitive(found, loc, axes)
+            add_primitive(mygdml, name, found, material)
+            return found
 
-def get_extent(ob):
-    arr = np.array([ob.matrix_world * v.co for v in ob.data.vertices], dtype=np.double)
-    return arr.max(axis=0), arr.min(axis=0)
+    if budget or simplify:
+        before = len(solidfaces)
+        with stats.phase('decimate'):
+            vertlocs, solidfaces = decimate(vertlocs, solidfaces, budget or None, simplify or None)
+        print('Decimated', name, 'from', before, 'to', len(solidfaces), 'facets')
 
+    with stats.phase('build'), recording(mygdml) if cache is not None else _no_recording() as fragment:
+        mygdml.define.addVerts(name, vertlocs)
+        mygdml.solids.addTessallated(name, solidfaces)
+    stats.add('vertices', len(vertlocs))
+    stats.add('facets', len(solidfaces))
+    if cache is not None:
+        with stats.phase('cache'):
+            cache.put_fragment(fragment_key, fragment)
+    if bounds is not None:
+        bounds.add_points(name, vertlocs)
 
-def get_extents(objects):
-    extents = np.array([get_extent(ob) for ob in objects], dtype=np.double)
-    return abs(extents).max(axis=0).max(axis=0)*2
+    if placement:
+        add_placement(mygdml, name, loc, axes)
+    mygdml.structure.addVolume(name, material, *placement)
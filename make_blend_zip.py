@@ -17,6 +17,14 @@ with zipfile.ZipFile('blender_gdml.zip', 'w', zipfile.ZIP_DEFLATED) as myzip:
     write(blender_scripts, 'blendertoCPP.py')
     write(pygdml, 'cpp.py')
     write(pygdml, 'gdml.py')
+    write(pygdml, 'mesh.py')
+    write(pygdml, 'shard.py')
+    write(pygdml, 'bounds.py')
+    write(pygdml, 'overlaps.py')
+    write(pygdml, 'primitives.py')
+    write(pygdml, 'cache.py')
+    write(pygdml, 'stats.py')
+    write(pygdml, 'meshio.py')
     write(blender_scripts, 'pygdml.wiki')
     write(curdir, 'LICENSE.txt')
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+from itertools import chain
+import ast
+import math
+import operator
+import sys
+
+import numpy as np
+
+__all__ = ['Bounds']
+
+# Length units in mm, angle units in rad, as Geant4 reads them
+LENGTHS = {'nm': 1e-6, 'um': 1e-3, 'mm': 1., 'cm': 10., 'm': 1e3, 'km': 1e6}
+ANGLES = {'rad': 1., 'mrad': 1e-3, 'deg': math.pi / 180}
+# Names an expression can use besides <define> constants, variables and quantities
+EXPRESSION_NAMES = dict(LENGTHS, pi=math.pi, **ANGLES)
+EXPRESSION_FUNCTIONS = {name: getattr(math, name) for name in (
+    'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'sqrt', 'exp', 'log', 'log10', 'pow')}
+EXPRESSION_FUNCTIONS.update(abs=abs, min=min, max=max)
+_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+              ast.Div: operator.truediv, ast.Pow: operator.pow,
+              ast.USub: operator.neg, ast.UAdd: operator.pos}
+# Numbers are parsed as ast.Num before Python 3.8
+_NUMBER, _NUMBER_FIELD = (ast.Constant, 'value') if sys.version_info >= (3, 8) else (ast.Num, 'n')
+
+
+class Bounds(object):
+    '''Axis aligned bounding boxes of the solids and volumes of a GDML
+    document, as (low, high) arrays in unit. Results are cached, so call
+    forget after changing a solid or volume.'''
+
+    def __init__(self, mygdml, unit='m'):
+        self.gdml = mygdml
+        self.unit = unit
+        self._solids = {}
+        self._volumes = {}
+
+    def forget(self, name=None):
+        'Drops the cached bounds of a solid or volume, or all of them.'
+        if name is None:
+            self._solids.clear()
+            self._volumes.clear()
+        else:
+            self._solids.pop(name, None)
+            self._volumes.pop(name, None)
+
+    def add_points(self, solid_name, points, unit=None):
+        '''Sets the bounds of a solid from its (N,3) vertices, so a tessellated
+        solid does not have to be read back from its <define> positions.'''
+        points = np.asarray(points, dtype=np.double).reshape(-1, 3)
+        scale = LENGTHS[unit or self.unit] / LENGTHS[self.unit]
+        self._solids[solid_name] = (points.min(axis=0) * scale, points.max(axis=0) * scale)
+
+    def solid(self, name):
+        'Bounds of a solid, in its own frame.'
+        if name not in self._solids:
+            el = self.gdml.solids.find(name)
+            if el is None:
+                raise ValueError('No solid named ' + name)
+            reader = getattr(self, '_' + el.tag, None)
+            if reader is None:
+                raise ValueError('Bounds of {0} solids are not known'.format(el.tag))
+            self._solids[name] = reader(el)
+        return self._solids[name]
+
+    def volume(self, name):
+        'Bounds of a logical volume and its daughters, in its own frame.'
+        if name not in self._volumes:
+            el = self.gdml.structure.find(name)
+            if el is None:
+                raise ValueError('No volume named ' + name)
+            low, high = self.solid(el.find('solidref').get('ref'))
+            contents = self._contents(el)
+            if contents is not None:
+                low, high = np.minimum(low, contents[0]), np.maximum(high, contents[1])
+            self._volumes[name] = (low, high)
+        return self._volumes[name]
+
+    def contents(self, name='World'):
+        '''Bounds of the daughters of a volume, in its frame, or None if it
+        has none. Use this to size the world box.'''
+        el = self.gdml.structure.find(name)
+        if el is None:
+            raise ValueError('No volume named ' + name)
+        return self._contents(el)
+
+    def _contents(self, el):
+        # Replicas lie inside their mother, and loops are not evaluated
+        boxes = [self._physvol(physvol) for physvol in el.findall('physvol')]
+        for paramvol in el.findall('paramvol'):
+            low, high = self.volume(paramvol.find('volumeref').get('ref'))
+            boxes.extend(self._placed(low, high, copy) for copy in paramvol.iter('parameters'))
+        if not boxes:
+            return None
+        boxes = np.array(boxes)
+        return boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)
+
+    def _physvol(self, physvol):
+        'Bounds of a placed daughter in its mother frame.'
+        ref = physvol.find('volumeref')
+        if ref is not None:
+            low, high = self.volume(ref.get('ref'))
+        else:
+            from .gdml import GDML
+            daughter = GDML.from_file(physvol.find('file').get('name'), lazy=True)
+            world = daughter.setup.getElements().find('world').get('ref')
+            low, high = Bounds(daughter, self.unit).volume(world)
+        return self._placed(low, high, physvol)
+
+    def _placed(self, low, high, physvol):
+        'Bounds of a box from low to high placed by a physvol or parameters.'
+        corners = np.array(np.meshgrid(*zip(low, high), indexing='ij')).reshape(3, -1).T
+        scale = self._vector(physvol, 'scale', (1, 1, 1), None)
+        angles = self._vector(physvol, 'rotation', (0, 0, 0), ANGLES)
+        position = self._vector(physvol, 'position', (0, 0, 0), LENGTHS)
+        # Geant4 places daughters with the inverse of R = Rz Ry Rx
+        placed = np.dot(corners * scale, _rotation(*angles)) + position
+        return placed.min(axis=0), placed.max(axis=0)
+
+    def _vector(self, physvol, tag, default, units):
+        'Reads an inline or referenced position, rotation or scale of a physvol.'
+        el = physvol.find(tag)
+        if el is None:
+            ref = physvol.find(tag + 'ref')
+            if ref is None:
+                return np.array(default, dtype=np.double)
+            el = self.gdml.define.find(ref.get('ref'))
+        values = np.array([self._number(el, axis, 0 if units else 1) for axis in 'xyz'], dtype=np.double)
+        if units is LENGTHS:
+            values *= self._length(el)
+        elif units is ANGLES:
+            values *= ANGLES[el.get('unit', 'rad')]
+        return values
+
+    def _length(self, el, key='lunit'):
+        'Factor from the length unit of an element to self.unit.'
+        return LENGTHS[el.get(key, el.get('unit', 'mm'))] / LENGTHS[self.unit]
+
+    def _number(self, el, key, default=None):
+        '''Reads a number attribute of an element, which may be an expression of
+        <define> constants, variables and quantities, units and pi. Units are
+        in mm and rad, as in Geant4, so 'length/m' is a length in metres.'''
+        text = el.get(key)
+        if text is None:
+            if default is None:
+                raise ValueError('{0} {1} has no {2}'.format(el.tag, el.get('name'), key))
+            return default
+        try:
+            return float(text)
+        except ValueError:
+            pass
+        try:
+            return float(self._evaluate(text, ()))
+        except (ValueError, SyntaxError, TypeError, ArithmeticError) as error:
+            raise ValueError('{0} {1}: unsupported expression {2!r} for {3} ({4})'.format(
+                el.tag, el.get('name'), text, key, error))
+
+    def _evaluate(self, text, seen):
+        'Evaluates an expression; seen holds the names being evaluated.'
+        # Geant4 writes powers with ^
+        tree = ast.parse(text.strip().replace('^', '**'), mode='eval')
+        return self._node(tree.body, seen)
+
+    def _node(self, node, seen):
+        if isinstance(node, _NUMBER):
+            value = getattr(node, _NUMBER_FIELD)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+        elif isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](self._node(node.left, seen), self._node(node.right, seen))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](self._node(node.operand, seen))
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+              and node.func.id in EXPRESSION_FUNCTIONS and not node.keywords):
+            return EXPRESSION_FUNCTIONS[node.func.id](*(self._node(arg, seen) for arg in node.args))
+        elif isinstance(node, ast.Name):
+            return self._name(node.id, seen)
+        raise ValueError('cannot evaluate ' + type(node).__name__)
+
+    def _name(self, name, seen):
+        'The value of a name in an expression, in mm and rad.'
+        if name in seen:
+            raise ValueError(name + ' is defined in terms of itself')
+        el = self.gdml.define.find(name)
+        if el is not None and el.tag in ('constant', 'variable', 'quantity'):
+            value = self._evaluate(el.get('value'), seen + (name,))
+            if el.tag == 'quantity':
+                value *= self._evaluate(el.get('unit', '1'), seen + (name,))
+            return value
+        if name in EXPRESSION_NAMES:
+            return EXPRESSION_NAMES[name]
+        raise ValueError('unknown name ' + name)
+
+    def _box(self, el):
+        half = np.array([self._number(el, axis) for axis in 'xyz']) * self._length(el) / 2
+        return -half, half
+
+    def _trd(self, el):
+        x = max(self._number(el, 'x1'), self._number(el, 'x2'))
+        y = max(self._number(el, 'y1'), self._number(el, 'y2'))
+        half = np.array([x, y, self._number(el, 'z')]) * self._length(el) / 2
+        return -half, half
+
+    def _tube(self, el):
+        return self._round(el, self._number(el, 'rmin', 0), self._number(el, 'rmax'))
+
+    def _cone(self, el):
+        rmin = min(self._number(el, 'rmin1', 0), self._number(el, 'rmin2', 0))
+        rmax = max(self._number(el, 'rmax1'), self._number(el, 'rmax2'))
+        return self._round(el, rmin, rmax)
+
+    def _round(self, el, rmin, rmax):
+        'Bounds of a tube or cone segment with the given radii.'
+        aunit = ANGLES[el.get('aunit', 'rad')]
+        start = self._number(el, 'startphi', 0) * aunit
+        delta = self._number(el, 'deltaphi', 2 * math.pi / aunit) * aunit
+        low, high = _arc(rmin, rmax, start, delta)
+        half_z = self._number(el, 'z') / 2
+        scale = self._length(el)
+        return np.array([low[0], low[1], -half_z]) * scale, np.array([high[0], high[1], half_z]) * scale
+
+    def _tessellated(self, el):
+        points, _ = self.vertices(el)
+        return points.min(axis=0), points.max(axis=0)
+
+    def vertices(self, el):
+        '''Reads the vertices of a tessellated solid element from <define>.
+        Returns an (N,3) array of them in unit, and an (M,4) array of the
+        vertices of each facet, padded with -1 for triangles.'''
+        rows = [(a['vertex1'], a['vertex2'], a['vertex3'], a.get('vertex4'))
+                for a in (facet.attrib for facet in el)]
+        flat = list(chain.from_iterable(rows))
+        index = {name: i for i, name in enumerate(dict.fromkeys(flat))}
+        pad = index.pop(None, None)
+        if pad is not None:
+            # Number the vertices after the padding down by one
+            index = {name: i - (i > pad) for name, i in index.items()}
+            index[None] = -1
+        faces = np.fromiter(map(index.__getitem__, flat), np.int64, len(flat)).reshape(-1, 4)
+
+        index.pop(None, None)
+        define = self.gdml.define
+        positions = list(map(define._names.get, index))
+        if None in positions and define._pending:
+            # Build the positions of a compact document
+            define._materialize()
+            positions = list(map(define._names.get, index))
+        if None in positions:
+            raise ValueError('No position named ' + next(name for name, p in zip(index, positions) if p is None))
+        points = np.array([(p.get('x', 0), p.get('y', 0), p.get('z', 0)) for p in positions], dtype=np.double)
+        units = {p.get('unit', 'mm') for p in positions}
+        if len(units) > 1:
+            points *= np.array([[self._length(p)] for p in positions])
+        else:
+            points *= LENGTHS[units.pop()] / LENGTHS[self.unit]
+        return points, faces
+
+
+def _rotation(x, y, z):
+    'The matrix Rz Ry Rx Geant4 builds from GDML rotation angles.'
+    cx, sx, cy, sy, cz, sz = math.cos(x), math.sin(x), math.cos(y), math.sin(y), math.cos(z), math.sin(z)
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return np.dot(np.dot(rz, ry), rx)
+
+
+def _arc(rmin, rmax, start, delta):
+    '''Bounds in x and y of the ring segment between radii rmin and rmax and
+    angles start and start + delta.'''
+    if delta >= 2 * math.pi - 1e-9:
+        return np.array([-rmax, -rmax]), np.array([rmax, rmax])
+    # The ends of the segment, and wherever the outer edge crosses an axis
+    angles = [start, start + delta]
+    angles += [k * math.pi / 2 for k in range(math.ceil(start / (math.pi / 2)),
+                                              math.floor((start + delta) / (math.pi / 2)) + 1)]
+    angles = np.array(angles)
+    points = np.concatenate([np.stack([np.cos(angles), np.sin(angles)], axis=1) * rmax,
+                             np.stack([np.cos(angles[:2]), np.sin(angles[:2])], axis=1) * rmin])
+    return points.min(axis=0), points.max(axis=0)
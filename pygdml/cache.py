@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import pathlib
+import zlib
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+from . import gdml
+
+__all__ = ['FragmentCache', 'recording', 'add_fragment']
+
+# Part of every key, change when the output for the same input changes
+CACHE_VERSION = b'pygdml-fragment-2'
+
+
+class FragmentCache(object):
+    '''An on-disk cache of exported fragments, such as the <define> and
+    <solids> elements of one mesh or the C++ of one G4TessellatedSolid,
+    keyed by a hash of everything they were made from. Entries are stored
+    compressed and the least recently used are removed once the cache holds
+    more than max_bytes.'''
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = pathlib.Path(directory)
+        os.makedirs(str(self.directory), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._sizes = {path: path.stat().st_size for path in self.directory.glob('*.z')}
+
+    @staticmethod
+    def key(*parts):
+        '''Hashes the parts of a key: arrays by their bytes, anything else by
+        its repr.'''
+        digest = hashlib.sha1(CACHE_VERSION)
+        for part in parts:
+            if hasattr(part, 'tobytes'):
+                digest.update(repr((part.dtype.str, part.shape)).encode())
+                part = part.tobytes()
+            elif not isinstance(part, bytes):
+                part = repr(part).encode()
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.directory / (key + '.z')
+
+    def get(self, key):
+        'Returns the bytes stored for key, or None.'
+        path = self._path(key)
+        try:
+            with path.open('rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            self.misses += 1
+            return None
+        # Mark as recently used
+        os.utime(str(path))
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        'Stores bytes for key, then evicts the oldest entries if over size.'
+        path = self._path(key)
+        with NamedTemporaryFile('wb', dir=str(self.directory), suffix='.tmp', delete=False) as f:
+            f.write(zlib.compress(data, 1))
+        os.replace(f.name, str(path))
+        self._sizes[path] = path.stat().st_size
+        self._evict()
+
+    def get_fragment(self, key):
+        'Returns the fragment element stored for key, or None.'
+        data = self.get(key)
+        return None if data is None else gdml.etree.fromstring(data)
+
+    def put_fragment(self, key, fragment):
+        self.put(key, gdml.etree.tostring(fragment))
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        used = {}
+        for path in list(self._sizes):
+            try:
+                used[path] = path.stat().st_mtime
+            except OSError:
+                # Removed by someone else
+                del self._sizes[path]
+        for path in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(path)
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        for path in list(self._sizes):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        self._sizes.clear()
+
+
+@contextmanager
+def recording(mygdml):
+    '''Collects the elements added to <define> and <solids> inside the with
+    block into the fragment element it yields, for FragmentCache.put_fragment.
+    Not for documents that are being streamed.'''
+    sections = (mygdml.define, mygdml.solids)
+    starts = [len(section.getElements()) for section in sections]
+    fragment = gdml.etree.Element('fragment')
+    yield fragment
+    for section, start in zip(sections, starts):
+        part = gdml.etree.SubElement(fragment, section.getElements().tag)
+        for el in section.getElements()[start:]:
+            gdml._adopt(part, el)
+
+
+def add_fragment(mygdml, fragment):
+    'Adds the elements of a cached fragment to the sections of mygdml.'
+    for part in fragment:
+        section = getattr(mygdml, part.tag)
+        elements = list(part)
+        section.getElements().extend(elements)
+        for el in elements:
+            section._register(el)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''Converts mesh files to GDML or Geant4 C++, without Blender.
+
+Usage: pygdml [-f gdml|cpp] [-o DIR] [-j N] [--force] FILE_OR_DIR ...'''
+
+import argparse
+import os
+import pathlib
+import sys
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .gdml import GDML, breakup_quads_if_needed, atomic_path
+from .cpp import G4TessellatedSolid
+from .mesh import weld_vertices, decimate
+from .bounds import LENGTHS
+from . import meshio
+
+__all__ = ['Options', 'convert_file', 'output_path', 'main']
+
+SUFFIXES = {'gdml': '.gdml', 'cpp': '.cc'}
+
+Options = namedtuple('Options', 'format unit material weld budget simplify pretty compress')
+Options.__new__.__defaults__ = ('gdml', 'm', 'G4_AIR', 0, 0, 0, False, None)
+
+# What converting one file did; error is None if it worked
+Result = namedtuple('Result', 'source target facets bytes seconds error')
+
+
+def output_path(source, out_dir, options):
+    'The file a mesh file is converted to.'
+    source = pathlib.Path(source)
+    name = source.stem + SUFFIXES[options.format]
+    if options.compress and options.format == 'gdml':
+        name += '.' + options.compress
+    return pathlib.Path(out_dir or source.parent) / name
+
+
+def up_to_date(source, target):
+    'Whether target exists and is no older than source.'
+    try:
+        return pathlib.Path(target).stat().st_mtime >= pathlib.Path(source).stat().st_mtime
+    except OSError:
+        return False
+
+
+def convert_file(source, target, options=Options()):
+    '''Converts one mesh file to target as the options say, replacing target
+    only once it is complete. Returns a Result, with the error as text if the
+    conversion failed.'''
+    start = time.perf_counter()
+    try:
+        facets = _convert(pathlib.Path(source), pathlib.Path(target), options)
+        size = pathlib.Path(target).stat().st_size
+    except Exception:
+        return Result(str(source), str(target), 0, 0, time.perf_counter() - start, traceback.format_exc())
+    return Result(str(source), str(target), facets, size, time.perf_counter() - start, None)
+
+
+def _convert(source, target, options):
+    mesh = meshio.read_mesh(source)
+    name = source.stem.replace('.', '_')
+    verts, faces = mesh.verts, breakup_quads_if_needed(mesh.faces, mesh.verts)
+    if options.weld:
+        verts, faces, _ = weld_vertices(verts, faces, options.weld)
+    if options.budget or options.simplify:
+        verts, faces = decimate(verts, faces, options.budget or None, options.simplify or None)
+
+    with atomic_path(target) as tmp:
+        if options.format == 'cpp':
+            solid = G4TessellatedSolid(name)
+            # The generated code is in m
+            solid.add_verts(np.asarray(verts, dtype=np.double) * (LENGTHS[options.unit] / LENGTHS['m']))
+            solid.add_faces(faces)
+            with open(tmp, 'w') as out:
+                solid.write(out)
+            return len(solid.faces)
+
+        mygdml = GDML(name, compact=True)
+        extent = np.abs(np.asarray(verts, dtype=np.double)).max(axis=0) * 2 if len(verts) else np.zeros(3)
+        mygdml.solids.addBox('world', *extent, lunit=options.unit)
+        mygdml.structure.addWorld()
+        mygdml.define.addVerts(name, verts, options.unit)
+        mygdml.solids.addTessallated(name, faces)
+        mygdml.structure.addVolume(name, mesh.material or options.material)
+        mygdml.to_file(tmp, options.pretty)
+        return len(faces)
+
+
+def _convert_job(job):
+    return convert_file(*job)
+
+
+def find_inputs(paths):
+    'The mesh files named, and those in the directories named, in order.'
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.iterdir() if p.suffix.lower() in meshio.READERS)
+        else:
+            yield path
+
+
+def convert_all(jobs, processes=None, report=print):
+    '''Converts (source, target, options) jobs in a pool of processes (None
+    uses every core; with one, in this process), reporting each Result as it
+    finishes. Returns the Results in the order they finished.'''
+    if processes is None:
+        processes = os.cpu_count() or 1
+    results = []
+    if processes == 1 or len(jobs) < 2:
+        for job in jobs:
+            results.append(convert_file(*job))
+            report(results[-1])
+        return results
+    with ProcessPoolExecutor(min(processes, len(jobs))) as pool:
+        for future in as_completed([pool.submit(_convert_job, job) for job in jobs]):
+            results.append(future.result())
+            report(results[-1])
+    return results
+
+
+def _report(result):
+    if result.error is None:
+        print('{0} -> {1}: {2} facets, {3:.1f} MiB in {4:.2f} s'.format(
+            result.source, result.target, result.facets, result.bytes / 2**20, result.seconds), flush=True)
+    else:
+        print('{0}: failed\n{1}'.format(result.source, result.error), file=sys.stderr, flush=True)
+
+
+def summary(results, skipped, seconds):
+    'A line of how many files were converted, and how fast.'
+    done = [result for result in results if result.error is None]
+    facets = sum(result.facets for result in done)
+    size = sum(result.bytes for result in done)
+    rate = 1 / seconds if seconds > 0 else 0.
+    return ('Converted {0} files ({1} failed, {2} up to date) in {3:.2f} s: '
+            '{4:.1f} files/s, {5:.0f} facets/s, {6:.1f} MiB/s').format(
+                len(done), len(results) - len(done), skipped, seconds,
+                len(done) * rate, facets * rate, size / 2**20 * rate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pygdml', description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='mesh files, or directories of them')
+    parser.add_argument('-f', '--format', choices=sorted(SUFFIXES), default='gdml', help='output format')
+    parser.add_argument('-o', '--output', help='directory to write to (default: next to each input)')
+    parser.add_argument('-j', '--jobs', type=int, help='processes to use (default: every core)')
+    parser.add_argument('--force', action='store_true', help='convert inputs whose output is up to date')
+    parser.add_argument('--unit', choices=sorted(LENGTHS, key=LENGTHS.get), default='m',
+                        help='length unit of the mesh files')
+    parser.add_argument('--material', default='G4_AIR', help='material of meshes that do not name one')
+    parser.add_argument('--weld', type=float, default=0, help='merge vertices closer than this')
+    parser.add_argument('--budget', type=int, default=0, help='decimate meshes to this many facets')
+    parser.add_argument('--simplify', type=float, default=0, help='decimate meshes on a grid of this spacing')
+    parser.add_argument('--pretty', action='store_true', help='indent GDML output')
+    parser.add_argument('--compress', choices=('gz', 'xz', 'zst'), help='compress GDML output')
+    args = parser.parse_args(argv)
+
+    options = Options(args.format, args.unit, args.material, args.weld, args.budget, args.simplify,
+                      args.pretty, args.compress)
+    if args.output:
+        pathlib.Path(args.output).mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    skipped = 0
+    for source in find_inputs(args.inputs):
+        target = output_path(source, args.output, options)
+        if not args.force and up_to_date(source, target):
+            skipped += 1
+        else:
+            jobs.append((source, target, options))
+
+    start = time.perf_counter()
+    results = convert_all(jobs, args.jobs, _report)
+    print(summary(results, skipped, time.perf_counter() - start))
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
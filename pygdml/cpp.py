@@ -2,27 +2,50 @@
 
 from io import StringIO
 from . import gdml
+from .mesh import face_list
+
+# Number of vertices or faces formatted per write
+CHUNK = 4096
+
+VERT_LINE = '    G4ThreeVector(%.4f,%.4f,%.4f)*m,\n'
 
 class G4TessellatedSolid:
     def __init__(self, name):
         name = name.replace('.','_')
         self._name = name
         self._facelist = []
+        self._newfaces = []
         self._vertlist = []
 
     def add_face(self,face):
         'Triangulates face if not flat, follows geant ordering convention'
-        face = list(reversed(face))
-        for realface in gdml.breakup_quads_if_needed([face],self._vertlist):
-            self._facelist.append(realface)
+        self._newfaces.append(list(reversed(face)))
 
     def add_vert(self,vert):
         self._vertlist.append(vert)
 
+    def add_verts(self,verts):
+        'Adds many vertices at once, such as an (N,3) array'
+        self._vertlist += verts.tolist() if hasattr(verts, 'tolist') else verts
+
+    def add_faces(self,faces):
+        'Adds many faces at once, such as an (M,3) or (M,4) array padded with -1'
+        if hasattr(faces, 'tolist'):
+            faces = face_list(faces)
+        self._newfaces += (face[::-1] for face in faces)
+
+    @property
+    def faces(self):
+        'Faces added so far, split in one batch the first time they are needed'
+        if self._newfaces:
+            self._facelist += gdml.breakup_quads_if_needed(self._newfaces, self._vertlist)
+            self._newfaces = []
+        return self._facelist
+
     @property
     def info(self):
         return dict(name = self._name,
-                    nfaces = len(self._facelist),
+                    nfaces = len(self.faces),
                     nverts = len(self._vertlist),
                     solid = 'solid' + self._name,
                     verts = self._name + '_v',
@@ -39,20 +62,12 @@ class G4TessellatedSolid:
 
     def str_vertlist(self):
         with StringIO() as output:
-            print('G4ThreeVector {verts}[] = {{'.format(**self.info), file=output)
-            for vert in self._vertlist:
-                print('    G4ThreeVector({0[0]:.4f},{0[1]:.4f},{0[2]:.4f})*m,'.format(vert), file=output)
-            print('};', file=output)
+            self.write_vertlist(output)
             return output.getvalue()
 
     def str_facelist(self):
         with StringIO() as output:
-            for n,face in enumerate(self._facelist):
-                name = 'Triangular' if len(face) == 3 else 'Quadrangular'
-                print('{faces}[{n}] = (G4VFacet*) new G4{type}Facet ('
-                      .format(n=n,type=name,**self.info), end=' ', file=output)
-                str_verts = ', '.join('{verts}[{v}]'.format(v=vertex,**self.info) for vertex in face)
-                print(str_verts + ', ABSOLUTE);', file=output)
+            self.write_facelist(output)
             return output.getvalue()
 
     def str_finalize(self):
@@ -62,6 +77,38 @@ class G4TessellatedSolid:
             print('{solid}->SetSolidClosed(true);'.format(**self.info), file=output)
             return output.getvalue()
 
+    def write_vertlist(self,f):
+        'Writes the vertex array, formatting CHUNK vertices at a time'
+        f.write('G4ThreeVector {verts}[] = {{\n'.format(**self.info))
+        verts = self._vertlist
+        for start in range(0, len(verts), CHUNK):
+            chunk = verts[start:start+CHUNK]
+            f.write((VERT_LINE * len(chunk)) % tuple(c for vert in chunk for c in vert[:3]))
+        f.write('};\n')
+
+    def write_facelist(self,f):
+        'Writes the facet definitions, formatting CHUNK faces at a time'
+        faces = self.faces
+        info = {key: str(value).replace('%', '%%') for key, value in self.info.items()}
+        prefix = '{faces}[%d] = (G4VFacet*) new G4'.format(**info)
+        vert = '{verts}[%d], '.format(**info)
+        templates = {3: prefix + 'TriangularFacet ( ' + vert * 3 + 'ABSOLUTE);\n',
+                     4: prefix + 'QuadrangularFacet ( ' + vert * 4 + 'ABSOLUTE);\n'}
+        for start in range(0, len(faces), CHUNK):
+            f.write(''.join(templates[len(face)] % ((n,) + tuple(face))
+                            for n, face in enumerate(faces[start:start+CHUNK], start)))
+
+    def write(self,f):
+        'Writes the C++ code for this solid to a text file; same text as str()'
+        f.write(self.str_init())
+        f.write('\n')
+        self.write_vertlist(f)
+        f.write('\n')
+        self.write_facelist(f)
+        f.write('\n')
+        f.write(self.str_finalize())
 
     def __str__(self):
-        return '\n'.join([self.str_init(), self.str_vertlist(), self.str_facelist(), self.str_finalize()])
+        with StringIO() as output:
+            self.write(output)
+            return output.getvalue()
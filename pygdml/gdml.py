@@ -1,53 +1,308 @@
 #!/usr/bin/env python3
 
+import os
+import copy
+import gzip
+import lzma
 import math
+import shutil
+import uuid
+import warnings
 from functools import partial
+from itertools import islice, chain
 import xml.etree.ElementTree as etree
-import xml.dom.minidom
-from contextlib import contextmanager
+from io import StringIO, TextIOWrapper
+from contextlib import contextmanager, ExitStack
+from tempfile import TemporaryFile, NamedTemporaryFile
 import pathlib
 
-__all__ = ['Define', 'Materials', 'Solids', 'Structure', 'Setup', 'GDML']
+import numpy as np
+
+from .mesh import split_faces, as_face_array
+
+__all__ = ['Define', 'Materials', 'Solids', 'Structure', 'Setup', 'GDML',
+           'DuplicateNameWarning', 'use_backend', 'decompressed', 'atomic_path']
 
 MY_NAMESPACES = {'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}
 SCHEMA_LOC = 'http://service-spi.web.cern.ch/service-spi/app/releases/GDML/GDML_3_0_0/schema/gdml.xsd'
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+PRETTY_DECLARATION = '<?xml version="1.0" ?>\n'
+NAMESPACE_PREFIXES = {uri: prefix for prefix, uri in MY_NAMESPACES.items()}
+
+# Number of elements a section collects before they are written out when streaming
+STREAM_BATCH = 4096
+
+# Elements of a volume that place daughters in it
+DAUGHTER_TAGS = ('physvol', 'replicavol', 'paramvol', 'loop')
+REPLICA_AXES = ('x', 'y', 'z', 'rho', 'phi')
+# Solids whose copies in a <paramvol> can be sized, as <tag_dimensions>
+PARAMETERISED_SOLIDS = ('box', 'trd')
+
+# Suffixes of compressed files, and the bytes each kind starts with
+COMPRESSIONS = {'.gz': b'\x1f\x8b', '.xz': b'\xfd7zXZ\x00', '.zst': b'\x28\xb5\x2f\xfd'}
+# Levels used when none is given, the defaults of the gzip, xz and zstd tools
+DEFAULT_LEVELS = {'.gz': 6, '.xz': 6, '.zst': 3}
+
+try:
+    import lxml.etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+BACKENDS = {'etree': etree, 'lxml': lxml_etree}
+
+
+def use_backend(name=None):
+    '''Selects the XML library documents are built, written and read with:
+    'etree' for the standard library (the default), 'lxml', or None for lxml
+    if it is installed. Both write the same text; lxml writes plain files
+    faster, but builds, pretty prints and reads slower, see
+    benchmarks/bench_backends.py. Select it before building documents, as
+    elements of the two cannot be mixed. Returns the name.'''
+    global etree
+    if name is None:
+        name = 'lxml' if lxml_etree is not None else 'etree'
+    if BACKENDS.get(name) is None:
+        raise ValueError('No XML backend ' + repr(name))
+    etree = BACKENDS[name]
+    return name
+
+
+def _lxml():
+    return etree is lxml_etree
+
+
+def _tostring(el):
+    'Serializes an element the way xml.etree does, with either backend.'
+    s = etree.tostring(el, encoding='unicode')
+    if not _lxml():
+        return s
+    if el.nsmap and el.getparent() is not None:
+        # lxml declares the namespaces of the ancestors again
+        end = s.index('>')
+        head = s[:end]
+        for prefix, uri in el.nsmap.items():
+            head = head.replace(' xmlns:{0}="{1}"'.format(prefix, uri), '', 1)
+        s = head + s[end:]
+    # libxml2 writes <a/>, and tag ends are the only place /> can appear
+    return s.replace('/>', ' />')
+
+
+def _iterparse(f):
+    if _lxml():
+        return etree.iterparse(f, events=('start', 'end'), huge_tree=True)
+    return etree.iterparse(f, events=('start', 'end'))
+
+
+def _adopt(parent, el):
+    '''Appends el to parent and returns it. An lxml element has one parent
+    and would be moved, so parent gets a copy of it instead.'''
+    if _lxml() and el.getparent() is not None:
+        el = copy.deepcopy(el)
+    parent.append(el)
+    return el
+
+
+def _root_element():
+    el = etree.Element('gdml', nsmap=MY_NAMESPACES)
+    if _lxml():
+        # xml.etree keeps nsmap as a plain attribute, and written files have it
+        el.set('nsmap', str(MY_NAMESPACES))
+    return el
+
+
+use_backend('etree')
 
 
 @contextmanager
-def accept_path_or_file(path_or_file):
-    if isinstance(path_or_file, (bytes, str)):
-        f = file_to_close = open(path_or_file, 'w', encoding='utf-8')
+def accept_path_or_file(path_or_file, mode='w', level=None):
+    '''Opens a path, or passes an open file through. Paths ending in .gz,
+    .xz or .zst are compressed as they are written, at level or the default
+    level of the format. Compressed paths, and compressed binary files opened
+    for reading, are decompressed as they are read.'''
+    encoding = None if 'b' in mode else 'utf-8'
+    compression = None
+    if isinstance(path_or_file, (bytes, str, pathlib.PurePath)):
+        compression = _compression(path_or_file, mode)
+    elif 'r' in mode and 'b' in mode and hasattr(path_or_file, 'peek'):
+        compression = _sniff(path_or_file.peek(6))
+    if compression is not None:
+        f = file_to_close = _open_compressed(path_or_file, compression, mode, level)
+    elif isinstance(path_or_file, (bytes, str)):
+        f = file_to_close = open(path_or_file, mode, encoding=encoding)
     elif isinstance(path_or_file, pathlib.PurePath):
-        f = file_to_close = path_or_file.open('w', encoding='utf-8')
+        f = file_to_close = path_or_file.open(mode, encoding=encoding)
     else:
         f = path_or_file
         file_to_close = None
-    yield f
-    if file_to_close:
-        file_to_close.close()
+    try:
+        yield f
+    finally:
+        if file_to_close:
+            file_to_close.close()
+
+
+def _sniff(start):
+    'The suffix of the compression a file starting with these bytes has, or None.'
+    for suffix, magic in COMPRESSIONS.items():
+        if start.startswith(magic):
+            return suffix
+
+
+def _compression(path, mode):
+    '''The compression of a path: from its first bytes when it is read, and
+    from its suffix when it is written. None for plain files.'''
+    if 'r' in mode:
+        with open(path, 'rb') as f:
+            return _sniff(f.read(6))
+    suffix = pathlib.Path(os.fsdecode(path)).suffix.lower()
+    return suffix if suffix in COMPRESSIONS else None
+
+
+def _open_compressed(path_or_file, compression, mode, level=None):
+    '''Opens a path or binary file to stream through a compressor or
+    decompressor, as UTF-8 text unless mode has 'b'.'''
+    if isinstance(path_or_file, pathlib.PurePath):
+        path_or_file = str(path_or_file)
+    raw_mode = mode.replace('t', '').replace('b', '') + 'b'
+    writing = 'r' not in mode
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == '.gz':
+        # Without a timestamp, a document always compresses to the same bytes
+        if isinstance(path_or_file, (bytes, str)):
+            f = gzip.GzipFile(path_or_file, raw_mode, compresslevel=level, mtime=0)
+        else:
+            f = gzip.GzipFile(fileobj=path_or_file, mode=raw_mode, compresslevel=level, mtime=0)
+    elif compression == '.xz':
+        f = lzma.LZMAFile(path_or_file, raw_mode, preset=level if writing else None)
+    elif zstd is None:
+        raise ImportError('.zst files need Python 3.14 or the zstandard package')
+    elif hasattr(zstd, 'ZstdFile'):
+        f = zstd.ZstdFile(path_or_file, raw_mode, level=level if writing else None)
+    else:
+        f = zstd.open(path_or_file, raw_mode, cctx=zstd.ZstdCompressor(level=level) if writing else None)
+    return f if 'b' in mode else TextIOWrapper(f, encoding='utf-8')
+
+
+@contextmanager
+def decompressed(filename, directory=None):
+    '''Yields the path of a plain copy of a compressed GDML file, for
+    programs such as Geant4 that only read plain text; the copy is removed
+    on exit. A file that is not compressed is yielded as it is.'''
+    compression = _compression(filename, 'r')
+    if compression is None:
+        yield str(filename)
+        return
+    with NamedTemporaryFile('wb', suffix='.gdml', dir=directory, delete=False) as out:
+        try:
+            with _open_compressed(filename, compression, 'rb') as f:
+                shutil.copyfileobj(f, out, 2**20)
+        except BaseException:
+            out.close()
+            os.remove(out.name)
+            raise
+    try:
+        yield out.name
+    finally:
+        os.remove(out.name)
+
+
+@contextmanager
+def atomic_path(filename):
+    '''Yields a temporary path next to filename, with the same suffix, that
+    is moved over filename when the block ends and removed if it raises, so
+    filename is never left half written.'''
+    path = pathlib.Path(filename)
+    tmp = path.with_name('.{0}.{1}.tmp{2}'.format(path.name, uuid.uuid4().hex[:8], path.suffix))
+    try:
+        yield str(tmp)
+        os.replace(str(tmp), str(path))
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+
+class DuplicateNameWarning(UserWarning):
+    'Issued when a name is added to a section that already contains it.'
 
 
 class GDMLbase(object):
+    _stream = None
+    _compact = False
 
     def getElements(self):
+        self._materialize()
         return self._core
 
+    def _materialize(self):
+        'Builds any content that has been deferred; nothing by default.'
+
+    def _prepare(self):
+        '''Readies the content for writing. Returns a function giving the
+        children of an element that are built as they are written, or None.'''
+        self._materialize()
+        return None
+
+    def find(self, name):
+        'Returns the element with this name in this section, or None.'
+        return self._names.get(validify_name(name))
+
+    def __contains__(self, name):
+        return validify_name(name) in self._names
+
+    def _register(self, el):
+        'Adds a named element to the index, warns if the name is taken.'
+        name = el.get('name')
+        if name in self._names:
+            warnings.warn('{0} is already defined in <{1}>'.format(
+                name, self._core.tag), DuplicateNameWarning, stacklevel=3)
+        self._names[name] = el
+        return el
+
+    def _flush(self, force=False):
+        'Hands finished children to the stream writer, if there is one.'
+        if self._stream is not None and (force or len(self._core) >= STREAM_BATCH):
+            self._stream.flush(self)
+
     def __repr__(self):
         return self.__class__.__name__ + '()'
 
     def to_string(self, pretty=True):
-        s = etree.tostring(self._core, encoding='unicode')
-        return xml.dom.minidom.parseString(s).toprettyxml(
-            indent="  ") if pretty else s
-
-    def to_file(self, filename, pretty=False):
+        expand = self._prepare()
+        if pretty:
+            with StringIO() as output:
+                write_pretty(self._core, output, expand=expand)
+                return output.getvalue()
+        if expand is not None:
+            with StringIO() as output:
+                write_plain(self._core, output, expand)
+                return output.getvalue()
+        return _tostring(self._core)
+
+    def to_file(self, filename, pretty=False, level=None):
+        '''Writes the element to a path or text file. A path ending in .gz,
+        .xz or .zst is compressed as it is written, at level if given.'''
+        expand = self._prepare()
         if pretty:
-            s = self.to_string(pretty)
-            with accept_path_or_file(filename) as f:
-                f.write(s)
+            with accept_path_or_file(filename, level=level) as f:
+                write_pretty(self._core, f, expand=expand)
         else:
-            with accept_path_or_file(filename) as f:
-                etree.ElementTree(self._core).write(f, xml_declaration=True, encoding='unicode')
+            with accept_path_or_file(filename, level=level) as f:
+                f.write(XML_DECLARATION)
+                if expand is None and not _lxml():
+                    etree.ElementTree(self._core).write(f, encoding='unicode')
+                elif expand is None:
+                    f.write(_tostring(self._core))
+                else:
+                    write_plain(self._core, f, expand)
 
     def __str__(self):
         return self.to_string()
@@ -60,6 +315,8 @@ class GDMLbase(object):
             del kargs['self']
         for name in kargs:
             el.set(name, str(kargs[name]))
+        local_self._register(el)
+        local_self._flush()
         return el
 
 
@@ -67,6 +324,37 @@ class Define(GDMLbase):
 
     def __init__(self):
         self._core = etree.Element('define')
+        self._names = {}
+        self._pending = []
+
+    def find(self, name):
+        el = super(Define, self).find(name)
+        if el is None and self._pending:
+            name = validify_name(name)
+            if any(block.holds(name) for block in self._pending):
+                self._materialize()
+                el = self._names.get(name)
+        return el
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def _materialize(self):
+        if self._pending:
+            children = list(self._expand())
+            self._pending = []
+            self._core[:] = children
+            self._names.update((el.get('name'), el) for el in children)
+
+    def _expand(self):
+        'Children with the positions of pending vertex blocks built in place.'
+        children = self._core
+        last = 0
+        for block in self._pending:
+            yield from children[last:block.index]
+            yield from block.elements()
+            last = block.index
+        yield from children[last:]
 
     def setDefault(self):
         self.addPosition('center')
@@ -96,6 +384,8 @@ class Define(GDMLbase):
         if z:
             el.set('z', str(z))
         el.set('unit', unit)
+        self._register(el)
+        self._flush()
         return el
 
     def addRotationMatrix(self, name, x0, y0, z0, x1, y1, z1, x2, y2, z2):
@@ -112,15 +402,85 @@ class Define(GDMLbase):
         return self.addGeneric('matrix', **locals())
 
     def addVerts(self, name, verts, unit='m'):
-        for i, vert in enumerate(verts):
-            self.addPosition(
-                name +
-                '_v' +
-                str(i),
-                vert[0],
-                vert[1],
-                vert[2],
-                unit)
+        '''Adds a position name_v<i> for each vertex. verts can be any iterable
+        of (x, y, z), such as an (N,3) array; it is converted in batches.
+        In a compact document, the vertices are kept as one array and the
+        positions are only built when needed.'''
+        prefix = name + '_v'
+        names = self._names
+        if self._compact and self._stream is None:
+            block = _VertexBlock(len(self._core), prefix, verts, unit)
+            if not len(block.coords):
+                return
+            if prefix + '0' in names or any(other.prefix == prefix for other in self._pending):
+                warnings.warn('{0} vertices are already defined in <define>'.format(name),
+                              DuplicateNameWarning, stacklevel=2)
+            self._pending.append(block)
+            return
+        start = 0
+        for batch in _position_batches(prefix, verts, unit):
+            vnames = [prefix + str(i) for i in range(start, start + len(batch))]
+            start += len(batch)
+            if not names.keys().isdisjoint(vnames):
+                warnings.warn('{0} vertices are already defined in <define>'.format(name),
+                              DuplicateNameWarning, stacklevel=2)
+            self._core.extend(batch)
+            names.update(zip(vnames, batch))
+            self._flush()
+
+
+def _position_batches(prefix, verts, unit):
+    'Yields lists of the position elements of vertices, STREAM_BATCH at a time.'
+    if hasattr(verts, 'tolist'):
+        arr = verts
+        chunks = (arr[start:start + STREAM_BATCH] for start in range(0, len(arr), STREAM_BATCH))
+        if arr.dtype.kind == 'f' and arr.dtype.itemsize != 8:
+            # Keep the shortest repr of the original precision
+            chunks = (chunk.astype(str) for chunk in chunks)
+        verts = chain.from_iterable(chunk.tolist() for chunk in chunks)
+    verts = iter(verts)
+    start = 0
+    while True:
+        batch = list(islice(verts, STREAM_BATCH))
+        if not batch:
+            break
+        xs, ys, zs = (map(str, coords) for coords in list(zip(*batch))[:3])
+        yield [etree.Element('position', {'name': prefix + str(i), 'x': x, 'y': y, 'z': z, 'unit': unit})
+               for i, x, y, z in zip(range(start, start + len(batch)), xs, ys, zs)]
+        start += len(batch)
+
+
+class _VertexBlock(object):
+    'Vertices added to a compact Define, to be built as positions at index.'
+    __slots__ = ('index', 'prefix', 'coords', 'unit')
+
+    def __init__(self, index, prefix, verts, unit):
+        if not hasattr(verts, 'dtype'):
+            verts = _vertex_array(verts if hasattr(verts, '__len__') else list(verts))
+        self.index = index
+        self.prefix = prefix
+        self.coords = verts.reshape(len(verts), -1)[:, :3] if len(verts) else verts
+        self.unit = unit
+
+    def holds(self, name):
+        number = name[len(self.prefix):]
+        return name.startswith(self.prefix) and number.isdigit() and int(number) < len(self.coords)
+
+    def elements(self):
+        for batch in _position_batches(self.prefix, self.coords, self.unit):
+            yield from batch
+
+
+def _vertex_array(verts):
+    '''Vertices given as a list as an array whose values print as the ones
+    given do. Only if all are floats, or all ints, is it a numeric array; a
+    mix of 1 and 1.5 would print 1 as 1.0, so it is kept as objects.'''
+    objects = np.array(verts, dtype=object)
+    types = set(map(type, objects.ravel().tolist()))
+    for kind in (float, int):
+        if types == {kind}:
+            return objects.astype(kind)
+    return objects
 
 
 class Materials(GDMLbase):
@@ -128,6 +488,7 @@ class Materials(GDMLbase):
 
     def __init__(self):
         self._core = etree.Element('materials')
+        self._names = {}
 
     def addIsotope(self, name, Z, N, atomtype, atomvalue):
         el = etree.SubElement(self._core, 'isotope')
@@ -137,7 +498,7 @@ class Materials(GDMLbase):
         at = etree.SubElement(el, 'atom')
         at.set('type', atomtype)
         at.set('value', atomvalue)
-        return el
+        return self._register(el)
 
     def addElement(self, name, Z, formula, atomvalue):
         el = etree.SubElement(self._core, 'element')
@@ -146,7 +507,7 @@ class Materials(GDMLbase):
         el.set('formula', formula)
         at = etree.SubElement(el, 'atom')
         at.set('value', atomvalue)
-        return el
+        return self._register(el)
 
     def addElementByFrac(self, name, fracdict):
         'Use a dictionary of the form element:fraction.'
@@ -156,6 +517,7 @@ class Materials(GDMLbase):
             at = etree.SubElement(el, 'fraction')
             at.set('ref', frac)
             at.set('n', str(fracdict[frac]))
+        return self._register(el)
 
     def addMaterialSingleElement(self, name, Z, D, atomvalue):
         el = etree.SubElement(self._core, 'material')
@@ -165,7 +527,7 @@ class Materials(GDMLbase):
         den.set('value', str(D))
         at = etree.SubElement(el, 'atom')
         at.set('value', atomvalue)
-        return el
+        return self._register(el)
 
     def addMaterialComposite(self, name, formula, D, compdict):
         'Use a dictionary of the form element:n.'
@@ -178,7 +540,7 @@ class Materials(GDMLbase):
             at = etree.SubElement(el, 'composite')
             at.set('ref', comp)
             at.set('n', str(compdict[comp]))
-        return el
+        return self._register(el)
 
     def addMaterialFractions(self, name, formula, D, fracdict):
         'Use a dictionary of the form element:fraction. You can also use previously defined materials.'
@@ -191,13 +553,63 @@ class Materials(GDMLbase):
             at = etree.SubElement(el, 'fraction')
             at.set('ref', frac)
             at.set('n', str(fracdict[frac]))
-        return el
+        return self._register(el)
 
 
 class Solids(GDMLbase):
 
     def __init__(self):
         self._core = etree.Element('solids')
+        self._names = {}
+        self._lazy = {}
+        self._source = None
+        self._deferred = {}
+
+    def find(self, name):
+        el = super(Solids, self).find(name)
+        if el is not None:
+            if el in self._deferred:
+                el.extend(self._deferred.pop(el).elements())
+            elif el.get('name') in self._lazy:
+                self._load_lazy([el.get('name')])
+        return el
+
+    def _materialize(self):
+        while self._deferred:
+            el, block = self._deferred.popitem()
+            el.extend(block.elements())
+        if self._lazy:
+            self._load_lazy(list(self._lazy))
+
+    def _load_lazy(self, names):
+        'Reads the facets of solids skipped by GDML.from_file(lazy=True).'
+        wanted = {name: self._lazy.pop(name) for name in names}
+        loaded = list(wanted.values())
+        target = None
+        parents = {}
+        depth = 0
+        with accept_path_or_file(self._source, 'rb') as f:
+            for event, el in _iterparse(f):
+                if event == 'start':
+                    depth += 1
+                    parents[depth] = el
+                    if depth == 3 and el.tag == 'tessellated':
+                        target = wanted.pop(el.get('name'), None)
+                    continue
+                if depth == 4:
+                    if target is not None:
+                        target.append(el)
+                    del parents[3][:]
+                elif depth == 3:
+                    del parents[2][:]
+                    if el.tag == 'tessellated':
+                        target = None
+                        if not wanted:
+                            break
+                depth -= 1
+        for el in loaded:
+            for facet in el:
+                facet.tail = None
 
     def addBox(self, name, x, y, z, lunit='m'):
         return self.addGeneric('box', **locals())
@@ -240,25 +652,158 @@ class Solids(GDMLbase):
         return self.addGeneric('tube', **locals())
 
     def addTessallated(self, name, listoffaces, type='ABSOLUTE'):
+        '''Adds a tessellated solid using the vertices added by Define.addVerts
+        under the same name. listoffaces can be any iterable of index lists,
+        such as an (M,3) or (M,4) integer array, where -1 pads triangles.
+        In a compact document, the faces are kept as one array and the facets
+        are only built when needed.'''
         try:
             name = name.get('name')
         except AttributeError:
             pass
+        if self._compact and self._stream is None:
+            block = _FacetBlock(name + '_v', listoffaces, type)
+            el = etree.SubElement(self._core, 'tessellated')
+            el.set('name', name)
+            self._register(el)
+            if len(block.faces):
+                self._deferred[el] = block
+            return el
+        if hasattr(listoffaces, 'tolist'):
+            listoffaces = chain.from_iterable(_face_lists(listoffaces))
+        vnames = _VertexNames(name + '_v')
+        stream = self._stream
+        if stream is not None:
+            self._flush(force=True)
         el = etree.SubElement(self._core, 'tessellated')
         el.set('name', name)
-        for face in listoffaces:
-            fc = etree.SubElement(
-                el,
-                'triangular' if len(face) == 3 else 'quadrangular')
-            for i, vert in enumerate(reversed(face)):
-                fc.set('vertex{0}'.format(i+1), name + '_v' + str(vert))
-            fc.set('type', type)
+        self._register(el)
+        for facet in _facet_elements(listoffaces, vnames, type):
+            el.append(facet)
+            if stream is not None and len(el) >= STREAM_BATCH:
+                stream.flush_partial(self, el)
+        if stream is not None:
+            stream.finish(self, el)
+        return el
+
+
+_VERTEX_KEYS = ('vertex1', 'vertex2', 'vertex3', 'vertex4')
+
+
+def _facet_elements(listoffaces, vnames, type):
+    'Yields the facet elements of faces, with the vertex order Geant4 expects.'
+    Element = etree.Element
+    for face in listoffaces:
+        if len(face) == 3:
+            yield Element('triangular', {
+                'vertex1': vnames[face[2]], 'vertex2': vnames[face[1]],
+                'vertex3': vnames[face[0]], 'type': type})
+        elif len(face) == 4:
+            attrib = dict(zip(_VERTEX_KEYS, map(vnames.__getitem__, reversed(face))))
+            attrib['type'] = type
+            yield Element('quadrangular', attrib)
+        else:
+            raise _face_error(vnames.prefix, face)
+
+
+def _face_error(prefix, face):
+    'The error for a face of a tessellated solid that is not a triangle or a quad.'
+    return ValueError('A face of tessellated solid {0} has {1} vertices {2}, facets have 3 or 4; '
+                      'split larger faces with mesh.split_faces'.format(
+                          prefix[:-len('_v')], len(face), list(face)))
+
+
+class _FacetBlock(object):
+    'Faces added to a compact Solids, to be built as facets of a tessellated solid.'
+    __slots__ = ('prefix', 'faces', 'type')
+
+    def __init__(self, prefix, faces, type):
+        faces = as_face_array(faces)
+        lengths = (faces >= 0).sum(axis=1)
+        bad = np.flatnonzero((lengths < 3) | (lengths > 4))
+        if len(bad):
+            face = faces[bad[0]]
+            raise _face_error(prefix, face[face >= 0].tolist())
+        if len(faces) and faces.max() < 2**31:
+            faces = faces.astype(np.int32)
+        self.prefix = prefix
+        self.faces = faces
+        self.type = type
+
+    def elements(self):
+        vnames = _VertexNames(self.prefix)
+        for faces in _face_lists(self.faces):
+            yield from _facet_elements(faces, vnames, self.type)
+
+
+def _face_lists(faces):
+    'Yields an array of faces as lists of index lists, STREAM_BATCH faces at a time.'
+    for start in range(0, len(faces), STREAM_BATCH):
+        chunk = faces[start:start + STREAM_BATCH]
+        if chunk.min() < 0:
+            # Padded array from mesh.split_faces, -1 marks a missing vertex
+            yield [[v for v in face if v >= 0] for face in chunk.tolist()]
+        else:
+            yield chunk.tolist()
+
+
+# Number of vertex names a _VertexNames keeps; faces close in a list mostly
+# share vertices, so a few batches are enough and memory stays bounded
+VERTEX_NAMES_CACHED = 4 * STREAM_BATCH
+
+
+class _VertexNames(dict):
+    '''Builds and caches the define names of vertex indices. The cache is
+    emptied once it holds VERTEX_NAMES_CACHED names.'''
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __missing__(self, index):
+        if len(self) >= VERTEX_NAMES_CACHED:
+            self.clear()
+        vname = self[index] = self.prefix + str(index)
+        return vname
+
+
+def _rotation_angles(rotations, aunit):
+    '''An (N,3) array of rotation angles and their unit, from angles in aunit
+    or from (N,3,3) matrices, which are read as by Define.addRotationMatrix.'''
+    rotations = np.asarray(rotations, dtype=np.double)
+    if rotations.ndim == 3:
+        # Rows of each matrix are (x0, y0, z0), (x1, y1, z1) and (x2, y2, z2)
+        m = rotations
+        x = np.arctan2(m[:, 1, 2], m[:, 2, 2])
+        y = np.arctan2(-m[:, 0, 2], np.hypot(m[:, 1, 2], m[:, 2, 2]))
+        z = np.arctan2(m[:, 0, 1], m[:, 0, 0])
+        return np.degrees(np.stack([x, y, z], axis=1)).tolist(), 'deg'
+    return rotations.reshape(-1, 3).tolist(), aunit
 
 
 class Structure(GDMLbase):
 
     def __init__(self):
         self._core = etree.Element('structure')
+        self._names = {}
+        # Volumes go before the existing children, newest first; they are
+        # kept here in the order added and put in place all at once
+        self._volumes = []
+
+    def _materialize(self):
+        if self._volumes:
+            self._core[0:0] = self._volumes[::-1]
+            self._volumes = []
+
+    def _parent_volume(self, parent):
+        'Resolves a parent given as None (the world), a name or an element.'
+        if parent is None:
+            return self._world
+        if isinstance(parent, str):
+            el = self._names.get(parent)
+            if el is None:
+                raise ValueError('No volume named ' + parent)
+            return el
+        return parent
 
     def addWorld(self, name='World', material='G4_AIR', solid_name='world'):
         'Must be a predefinied box!'
@@ -268,7 +813,8 @@ class Structure(GDMLbase):
         mat.set('ref', material)
         sol = etree.SubElement(el, 'solidref')
         sol.set('ref', solid_name)
-        self._world = el
+        self._world = self._register(el)
+        return el
 
     def addVolume(self, name, material,
                   volume_position='center',
@@ -284,33 +830,139 @@ class Structure(GDMLbase):
         else:
             logical_name = validify_name(logical_name)
 
-        if parent is None:
-            parent = self._world
-        elif isinstance(parent, str):
-            parent = find_element_with_name(self._world, parent)
+        parent = self._parent_volume(parent)
 
         el = etree.Element('volume')
-        self._core.insert(0, el)
+        self._volumes.append(el)
         el.set('name', logical_name)
+        self._register(el)
         mat = etree.SubElement(el, 'materialref')
         mat.set('ref', material)
         sol = etree.SubElement(el, 'solidref')
         sol.set('ref', name)
 
-        nel = etree.SubElement(parent, 'physvol')
-        volname = etree.SubElement(nel, 'volumeref')
-        volname.set('ref', logical_name)
-        volpos = etree.SubElement(nel, 'positionref')
-        volpos.set('ref', volume_position)
-        volrot = etree.SubElement(nel, 'rotationref')
-        volrot.set('ref', volume_rotation)
-        if volume_scale:
-            volscale = etree.SubElement(nel, 'scaleref')
-            volscale.set('ref', volume_scale)
-        if aux:
-            naux = etree.SubElement(nel, 'auxiliary')
-            naux.set('auxtype', aux[0])
-            naux.set('auxval', aux[1])
+        self._place(parent, 'volumeref', 'ref', logical_name,
+                    volume_position, volume_rotation, volume_scale, aux)
+        return el
+
+    def addPhysvol(self, logical_name,
+                   volume_position='center',
+                   volume_rotation='identity', volume_scale=None,
+                   parent=None,
+                   aux=None):
+        '''Places another copy of a volume made by addVolume, sharing its
+        solid and logical volume. Returns the physvol.'''
+        if logical_name not in self._names:
+            raise ValueError('No volume named ' + logical_name)
+        parent = self._parent_volume(parent)
+        return self._place(parent, 'volumeref', 'ref', logical_name,
+                           volume_position, volume_rotation, volume_scale, aux)
+
+    def addPhysvols(self, logical_name, positions, rotations=None,
+                    parent=None, unit='m', aunit='deg', copynumbers=False):
+        '''Places a copy of a volume made by addVolume at each of an (N,3)
+        array of positions, in one batch. rotations are an (N,3) array of
+        angles in aunit, or an (N,3,3) array of matrices as for
+        Define.addRotationMatrix. The positions and rotations are written in
+        each physvol, so nothing is added to <define>. With copynumbers=True,
+        the copies are numbered from 0. Returns the physvols.'''
+        if logical_name not in self._names:
+            raise ValueError('No volume named ' + logical_name)
+        parent = self._parent_volume(parent)
+        positions = np.asarray(positions, dtype=np.double).reshape(-1, 3)
+        if rotations is not None:
+            rotations, aunit = _rotation_angles(rotations, aunit)
+            if len(rotations) != len(positions):
+                raise ValueError('{0} rotations for {1} positions'.format(len(rotations), len(positions)))
+
+        SubElement = etree.SubElement
+        ref = {'ref': logical_name}
+        physvols = []
+        for i, (x, y, z) in enumerate(positions.tolist()):
+            nel = SubElement(parent, 'physvol', {'copynumber': str(i)} if copynumbers else {})
+            SubElement(nel, 'volumeref', ref)
+            SubElement(nel, 'position', {'x': str(x), 'y': str(y), 'z': str(z), 'unit': unit})
+            if rotations is not None:
+                x, y, z = rotations[i]
+                SubElement(nel, 'rotation', {'x': str(x), 'y': str(y), 'z': str(z), 'unit': aunit})
+            physvols.append(nel)
+        return physvols
+
+    def addReplica(self, logical_name, number, width, axis='x', offset=0,
+                   parent=None, unit='m'):
+        '''Fills parent with number copies of a volume side by side along
+        axis, which is x, y, z, rho or phi, width apart, as one <replicavol>.
+        For phi, width and offset are in deg. Geant4 needs a replica to be the
+        only daughter of its mother. Returns the replicavol.'''
+        if logical_name not in self._names:
+            raise ValueError('No volume named ' + logical_name)
+        if axis not in REPLICA_AXES:
+            raise ValueError('Cannot replicate along ' + axis)
+        parent = self._parent_volume(parent)
+        if any(child.tag in DAUGHTER_TAGS for child in parent):
+            raise ValueError('A replica must be the only daughter of ' + parent.get('name'))
+        if axis == 'phi':
+            unit = 'deg'
+        nel = etree.SubElement(parent, 'replicavol', {'number': str(number)})
+        etree.SubElement(nel, 'volumeref', {'ref': logical_name})
+        along = etree.SubElement(nel, 'replicate_along_axis')
+        etree.SubElement(along, 'direction', {axis: '1'})
+        etree.SubElement(along, 'width', {'value': str(width), 'unit': unit})
+        etree.SubElement(along, 'offset', {'value': str(offset), 'unit': unit})
+        return nel
+
+    def addParamvol(self, logical_name, solid, positions, rotations=None,
+                    parent=None, unit='m', aunit='deg'):
+        '''Places a copy of a volume at each of an (N,3) array of positions
+        as one <paramvol>, which Geant4 holds as a single parameterised
+        volume. solid is the box or trapezoid element of the volume, which
+        gives the size of each copy. rotations are as for addPhysvols.
+        Returns the paramvol.'''
+        if logical_name not in self._names:
+            raise ValueError('No volume named ' + logical_name)
+        if solid.tag not in PARAMETERISED_SOLIDS:
+            raise ValueError('Cannot parameterise a ' + solid.tag)
+        parent = self._parent_volume(parent)
+        positions = np.asarray(positions, dtype=np.double).reshape(-1, 3)
+        if rotations is not None:
+            rotations, aunit = _rotation_angles(rotations, aunit)
+            if len(rotations) != len(positions):
+                raise ValueError('{0} rotations for {1} positions'.format(len(rotations), len(positions)))
+        dimensions = {key: value for key, value in solid.attrib.items() if key != 'name'}
+
+        SubElement = etree.SubElement
+        nel = SubElement(parent, 'paramvol', {'ncopies': str(len(positions))})
+        SubElement(nel, 'volumeref', {'ref': logical_name})
+        copies = SubElement(nel, 'parameterised_position_size')
+        for i, (x, y, z) in enumerate(positions.tolist()):
+            parameters = SubElement(copies, 'parameters', {'number': str(i + 1)})
+            SubElement(parameters, 'position', {'name': '{0}_copy{1}_pos'.format(logical_name, i),
+                                          'x': str(x), 'y': str(y), 'z': str(z), 'unit': unit})
+            if rotations is not None:
+                x, y, z = rotations[i]
+                SubElement(parameters, 'rotation', {'name': '{0}_copy{1}_rot'.format(logical_name, i),
+                                              'x': str(x), 'y': str(y), 'z': str(z), 'unit': aunit})
+            SubElement(parameters, solid.tag + '_dimensions', dimensions)
+        return nel
+
+    def addLoop(self, logical_name, number, step, start=(0, 0, 0), variable='i',
+                parent=None, unit='m'):
+        '''Places number copies of a volume at start + i * step, for i from 0,
+        as one <loop> over variable. The variable must be defined, with
+        Define.addVariable(variable, 0). Geant4 makes the copies when it reads
+        the file. Returns the loop.'''
+        if logical_name not in self._names:
+            raise ValueError('No volume named ' + logical_name)
+        parent = self._parent_volume(parent)
+        nel = etree.SubElement(parent, 'loop', {'for': variable, 'from': '0',
+                                                'to': str(number - 1), 'step': '1'})
+        physvol = etree.SubElement(nel, 'physvol')
+        etree.SubElement(physvol, 'volumeref', {'ref': logical_name})
+        position = {axis: '{0}+{1}*({2})'.format(float(x0), variable, float(dx))
+                    for axis, x0, dx in zip('xyz', start, step)}
+        position['unit'] = unit
+        etree.SubElement(physvol, 'position', position)
+        return nel
 
     def addVolumeFile(self,
                       filename,
@@ -319,14 +971,17 @@ class Structure(GDMLbase):
                       parent=None,
                       aux=None):
 
-        if parent is None:
-            parent = self._world
-        elif isinstance(parent, str):
-            parent = find_element_with_name(self._world, parent)
+        parent = self._parent_volume(parent)
 
+        self._place(parent, 'file', 'name', filename,
+                    volume_position, volume_rotation, volume_scale, aux)
+
+    @staticmethod
+    def _place(parent, tag, key, value, volume_position, volume_rotation, volume_scale, aux):
+        'Adds a physvol for a volume reference or file to parent.'
         nel = etree.SubElement(parent, 'physvol')
-        volname = etree.SubElement(nel, 'file')
-        volname.set('name', filename)
+        volname = etree.SubElement(nel, tag)
+        volname.set(key, value)
         volpos = etree.SubElement(nel, 'positionref')
         volpos.set('ref', volume_position)
         volrot = etree.SubElement(nel, 'rotationref')
@@ -338,12 +993,14 @@ class Structure(GDMLbase):
             naux = etree.SubElement(nel, 'auxiliary')
             naux.set('auxtype', aux[0])
             naux.set('auxval', aux[1])
+        return nel
 
 
 class Setup(GDMLbase):
 
     def __init__(self, name='Default', world='World', version='1.0'):
         self._core = etree.Element('setup')
+        self._names = {}
         self._core.set('name', name)
         self._core.set('version', str(version))
         el = etree.SubElement(self._core, 'world')
@@ -351,11 +1008,16 @@ class Setup(GDMLbase):
 
 
 class GDML(GDMLbase):
+    # A stats.Stats to time writing and count elements and bytes, if set
+    stats = None
 
-    def __init__(self, name='Default'):
+    def __init__(self, name='Default', compact=False):
+        '''With compact=True, the vertices and faces of tessellated solids are
+        kept as arrays, and their positions and facets are built only as they
+        are written, or when an element is asked for.'''
         self._main_name = name
 
-        self._core = etree.Element('gdml', nsmap=MY_NAMESPACES)
+        self._core = _root_element()
         self._core.set(
             '{%s}noNamespaceSchemaLocation' %
             MY_NAMESPACES['xsi'],
@@ -367,24 +1029,259 @@ class GDML(GDMLbase):
         self.structure = Structure()
         self.setup = Setup(name)
 
-        self._core.append(self.define._core)
-        self._core.append(self.materials._core)
-        self._core.append(self.solids._core)
-        self._core.append(self.structure._core)
-        self._core.append(self.setup._core)
+        for section in self.sections:
+            self._core.append(section._core)
+        self.define._compact = self.solids._compact = compact
 
         self.define.setDefault()
 
+    @classmethod
+    def from_file(cls, filename, lazy=False):
+        '''Reads a GDML file back in, so it can be changed and written out again.
+        The file is parsed incrementally, and decompressed as it is read if it
+        is gzip, xz or zstd compressed. With lazy=True, the facets of
+        tessellated solids are skipped and only read from the file (which must
+        be given by path) when the solid is looked up or the document is
+        written.'''
+        if lazy and not isinstance(filename, (str, bytes, pathlib.PurePath)):
+            raise ValueError('Lazy loading needs a path to read from')
+
+        mygdml = cls.__new__(cls)
+        mygdml.define = Define()
+        mygdml.materials = Materials()
+        mygdml.solids = Solids()
+        mygdml.structure = Structure()
+        mygdml.setup = Setup()
+        by_tag = {section._core.tag: section for section in mygdml.sections}
+
+        section = None
+        lazy_solid = None
+        depth = 0
+        with accept_path_or_file(filename, 'rb') as f:
+            for event, el in _iterparse(f):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1:
+                        mygdml._core = el
+                    elif depth == 2:
+                        section = by_tag.get(el.tag)
+                        if section is not None:
+                            section._core = el
+                    elif depth == 3 and lazy and el.tag == 'tessellated' and section is mygdml.solids:
+                        lazy_solid = el
+                    continue
+
+                # Drop the whitespace of indented files
+                if el.text is not None and not el.text.strip():
+                    el.text = None
+                for child in el:
+                    if child.tail is not None and not child.tail.strip():
+                        child.tail = None
+
+                if depth == 3 and section is not None and el.get('name') is not None:
+                    section._register(el)
+                    if el is lazy_solid:
+                        section._lazy[el.get('name')] = el
+                        lazy_solid = None
+                elif depth == 4 and lazy_solid is not None:
+                    del lazy_solid[:]
+                depth -= 1
+
+        # Sections missing from the file are added empty, in order
+        for i, section in enumerate(mygdml.sections):
+            if section._core not in mygdml._core:
+                mygdml._core.insert(i, section._core)
+
+        mygdml.solids._source = filename
+        mygdml._main_name = mygdml.setup._core.get('name', 'Default')
+        world = mygdml.setup._core.find('world')
+        if world is not None:
+            mygdml.structure._world = mygdml.structure.find(world.get('ref'))
+        return mygdml
+
+    @property
+    def sections(self):
+        return (self.define, self.materials, self.solids,
+                self.structure, self.setup)
+
+    def _materialize(self):
+        for section in self.sections:
+            section._materialize()
+
+    def _prepare(self):
+        if not self.define._pending and not self.solids._deferred:
+            return super(GDML, self)._prepare()
+        self.structure._materialize()
+        if self.solids._lazy:
+            self.solids._load_lazy(list(self.solids._lazy))
+        return self._expand
+
+    def _expand(self, el):
+        '''Children of el that are built as they are written, or of the
+        elements that hold them; None for the rest.'''
+        if el is self._core or el is self.solids._core:
+            # An empty section is written as <solids />, as it is without expand
+            return iter(el) if len(el) else None
+        if el is self.define._core:
+            return self.define._expand() if self.define._pending else None
+        block = self.solids._deferred.get(el)
+        return None if block is None else block.elements()
+
+    def find(self, name):
+        'Returns the element with this name in any section, or None.'
+        for section in self.sections:
+            el = section.find(name)
+            if el is not None:
+                return el
+
+    def __contains__(self, name):
+        return any(name in section for section in self.sections)
+
     def validate(self, required):
-        return all(map(partial(check_if_contains, self._core), required))
+        return all(map(partial(check_if_contains, self), required))
+
+    def check_overlaps(self, processes=None, segments=48):
+        '''Returns the volumes that overlap a sibling or stick out of their
+        mother, as a list of (mother, first, second) tuples; see
+        overlaps.find_overlaps.'''
+        from .overlaps import find_overlaps
+        return find_overlaps(self, processes, segments)
 
-    def to_file(self, filename=None, pretty=False):
+    def to_file(self, filename=None, pretty=False, level=None):
+        if filename is None:
+            filename = self._main_name + '.gdml'
+        if self.stats is None:
+            super(GDML, self).to_file(filename, pretty, level)
+            return
+        with self.stats.phase('write'):
+            super(GDML, self).to_file(filename, pretty, level)
+        self.stats.count_elements(self)
+        if isinstance(filename, (str, pathlib.PurePath)):
+            self.stats.add('bytes', pathlib.Path(filename).stat().st_size)
+
+    def stream_to(self, filename=None, level=None):
+        '''Starts writing this document to a file as it is built; see GDMLStream.
+        Use as a context manager, the file is completed on exit.'''
         if filename is None:
             filename = self._main_name + '.gdml'
-        super(GDML, self).to_file(filename, pretty)
+        return GDMLStream(self, filename, level)
+
+
+class GDMLStream(object):
+    '''Writes a GDML document to disk while it is being built.
+
+    Defines and solids are written out in batches of STREAM_BATCH elements
+    as they are added; solids go through a temporary file so both sections
+    can grow at the same time. Materials, structure and setup are small and
+    are written on close. The result is identical to GDML.to_file with
+    pretty=False. Written elements are dropped from the GDML object and its
+    name index, so only the unwritten tail is held in memory.'''
+
+    def __init__(self, gdml, filename, level=None):
+        gdml._materialize()
+        self._gdml = gdml
+        self._exit_stack = ExitStack()
+        self._file = self._exit_stack.enter_context(accept_path_or_file(filename, level=level))
+        self._spool = self._exit_stack.enter_context(TemporaryFile('w+', encoding='utf-8'))
+        self._outputs = {gdml.define: self._file, gdml.solids: self._spool}
+        self._open = set()
+
+        self._file.write(XML_DECLARATION)
+        self._file.write(_start_tag(gdml._core))
+        for section in self._outputs:
+            section._stream = self
+            self.flush(section)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._detach()
+            self._exit_stack.close()
+
+    def _detach(self):
+        for section in self._outputs:
+            section._stream = None
+
+    def _write_children(self, out, el):
+        'Writes out and removes all children of an open element.'
+        if el not in self._open:
+            out.write(_start_tag(el))
+            self._open.add(el)
+        s = _tostring(el)
+        out.write(s[s.index('>') + 1:s.rindex('<')])
+        del el[:]
+
+    def flush(self, section):
+        'Writes out the finished children of a section.'
+        core = section._core
+        if len(core):
+            names = section._names
+            for child in core:
+                name = child.get('name')
+                if names.get(name) is child:
+                    del names[name]
+            self._write_children(self._outputs[section], core)
+
+    def flush_partial(self, section, el):
+        'Writes out the children of el, the last child of section, which is still being built.'
+        out = self._outputs[section]
+        if section._core not in self._open:
+            out.write(_start_tag(section._core))
+            self._open.add(section._core)
+        self._write_children(out, el)
+
+    def finish(self, section, el):
+        'Completes an element that was written with flush_partial.'
+        if el in self._open:
+            self.flush_partial(section, el)
+            self._outputs[section].write('</{0}>'.format(el.tag))
+            self._open.discard(el)
+            section._core.remove(el)
+            name = el.get('name')
+            if section._names.get(name) is el:
+                del section._names[name]
+
+    def close(self):
+        'Writes the remaining sections and closes the document.'
+        f = self._file
+        for section in self._gdml.sections:
+            out = self._outputs.get(section)
+            if out is None:
+                section._materialize()
+                f.write(_tostring(section._core))
+                continue
+            self.flush(section)
+            if section._core in self._open:
+                out.write('</{0}>'.format(section._core.tag))
+                self._open.discard(section._core)
+            else:
+                out.write(_tostring(section._core))
+            if out is not f:
+                out.seek(0)
+                shutil.copyfileobj(out, f)
+        f.write('</{0}>'.format(self._gdml._core.tag))
+        self._detach()
+        self._exit_stack.close()
+
+
+def _start_tag(el):
+    'Serializes the start tag of an element on its own.'
+    if _lxml():
+        nsmap = el.nsmap if el.getparent() is None else None
+        s = _tostring(etree.Element(el.tag, dict(el.attrib), nsmap=nsmap))
+    else:
+        s = _tostring(etree.Element(el.tag, el.attrib))
+    return s[:-len(' />')] + '>'
 
 
 def find_element_with_name(tree, name):
+    'Searches a section or GDML by its name index, or an element recursively.'
+    if isinstance(tree, GDMLbase):
+        return tree.find(name)
     for element in tree:
         if element.get('name') == name:
             return element
@@ -409,20 +1306,111 @@ def validify_name(name):
         return name
 
 
-def breakup_quads_if_needed(facelist, vertlist):
-    for face in facelist:
-        if len(face) != 4:
-            yield face
+def breakup_quads_if_needed(facelist, vertlist, tolerance=1e-6, ngons='fan'):
+    '''Splits non-planar or concave quads and n-gons into triangles, see
+    mesh.split_faces. Returns an array if facelist is one, a list otherwise.'''
+    return split_faces(facelist, vertlist, tolerance, ngons)
+
+
+def write_pretty(element, f, indent='  ', expand=None):
+    '''Writes an indented document for element to a text file in one pass.
+    The layout is the one minidom's toprettyxml produces, with attributes
+    sorted by name. expand(el), if given, returns the children of elements
+    that are built as they are written, or None.'''
+    f.write(PRETTY_DECLARATION)
+    pieces = []
+    _pretty_element(element, pieces, f, '', indent, {}, expand)
+    pieces.append('')
+    f.write('\n'.join(pieces))
+
+
+def write_plain(element, f, expand):
+    '''Writes element to a text file as ElementTree does, with the children
+    expand(el) returns for elements that are built as they are written.'''
+    children = expand(element)
+    if children is None:
+        f.write(_tostring(element))
+        return
+    f.write(_start_tag(element))
+    # lxml would move the children into a container, so it gets a list
+    batch = [] if _lxml() else etree.Element(element.tag)
+
+    def write_batch():
+        if _lxml():
+            f.write(''.join(map(_tostring, batch)))
         else:
-            v1 = vertlist[face[1]] - vertlist[face[0]]
-            v2 = vertlist[face[2]] - vertlist[face[1]]
-            v3 = vertlist[face[3]] - vertlist[face[2]]
-            v12 = v1.cross(v2)
-            plane_factor = v12.dot(v3)
-            if plane_factor == 0:
-                yield face
-            else:
-                face1 = [face[0], face[1], face[2]]
-                face2 = [face[0], face[2], face[3]]
-                yield face1
-                yield face2
+            s = _tostring(batch)
+            f.write(s[s.index('>') + 1:s.rindex('<')])
+        del batch[:]
+
+    for child in children:
+        if expand(child) is None:
+            batch.append(child)
+            if len(batch) >= STREAM_BATCH:
+                write_batch()
+        else:
+            if len(batch):
+                write_batch()
+            write_plain(child, f, expand)
+    if len(batch):
+        write_batch()
+    f.write('</{0}>'.format(element.tag))
+
+
+def _escape(text):
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def _qualify(name, prefixes, declare):
+    'Turns an {uri}name into prefix:name, declaring the prefix if needed.'
+    if name[:1] != '{':
+        return name
+    uri, name = name[1:].split('}', 1)
+    if uri not in prefixes:
+        prefix = NAMESPACE_PREFIXES.get(uri, 'ns{0}'.format(len(prefixes)))
+        prefixes[uri] = prefix
+        declare.append(('xmlns:' + prefix, uri))
+    return prefixes[uri] + ':' + name
+
+
+def _pretty_element(el, pieces, f, indent, addindent, prefixes, expand=None):
+    tag = el.tag
+    items = el.items()
+    if tag[:1] == '{' or any(key[:1] == '{' for key, _ in items):
+        prefixes = dict(prefixes)
+        declare = []
+        tag = _qualify(tag, prefixes, declare)
+        items = [(_qualify(key, prefixes, declare), value) for key, value in items] + declare
+    attrs = ''.join(' {0}="{1}"'.format(key, _escape(value)) for key, value in sorted(items))
+
+    children = None if expand is None else expand(el)
+    if children is None:
+        children = el
+    if children is el and not len(el):
+        if el.text:
+            pieces.append('{0}<{1}{2}>{3}</{1}>'.format(indent, tag, attrs, _escape(el.text)))
+        else:
+            pieces.append('{0}<{1}{2}/>'.format(indent, tag, attrs))
+        return
+
+    pieces.append('{0}<{1}{2}>'.format(indent, tag, attrs))
+    inner = indent + addindent
+    if el.text:
+        pieces.append(inner + _escape(el.text))
+    for child in children:
+        _pretty_element(child, pieces, f, inner, addindent, prefixes, expand)
+        if child.tail:
+            pieces.append(inner + _escape(child.tail))
+        if len(pieces) > STREAM_BATCH:
+            pieces.append('')
+            f.write('\n'.join(pieces))
+            del pieces[:]
+    pieces.append('{0}</{1}>'.format(indent, tag))
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+
+import hashlib
+from itertools import chain, product
+
+import numpy as np
+
+__all__ = ['weld_vertices', 'split_faces', 'decimate', 'mesh_hash']
+
+
+def as_face_array(faces):
+    '''Returns faces as an (M,n) integer array. Faces with fewer than n
+    vertices are padded with -1.'''
+    if isinstance(faces, np.ndarray):
+        if not len(faces):
+            return np.empty((0, faces.shape[-1] if faces.ndim == 2 else 3), np.int64)
+        return faces.astype(np.int64, copy=False).reshape(len(faces), -1)
+    faces = list(faces)
+    lengths = np.fromiter(map(len, faces), np.int64, len(faces))
+    width = int(lengths.max()) if len(faces) else 3
+    arr = np.full((len(faces), width), -1, dtype=np.int64)
+    arr[np.arange(width) < lengths[:, None]] = np.fromiter(
+        chain.from_iterable(faces), np.int64, int(lengths.sum()))
+    return arr
+
+
+def face_list(arr):
+    'Turns a padded face array back into a list of index lists.'
+    if not len(arr) or arr.min() >= 0:
+        return arr.tolist()
+    lengths = (arr >= 0).sum(axis=1).tolist()
+    return [face[:n] for face, n in zip(arr.tolist(), lengths)]
+
+
+def _like(arr, faces):
+    'Returns arr in the same form (array or list) as faces was given.'
+    return arr if isinstance(faces, np.ndarray) else face_list(arr)
+
+
+def mesh_hash(verts, faces, tolerance=0):
+    '''Returns a hex digest of the geometry of a mesh, equal for meshes with
+    the same vertices and faces in the same order, so they can share one
+    solid. With tolerance > 0, vertices are compared on a grid of that
+    spacing.'''
+    # Adding 0 turns -0.0 into 0.0
+    verts = np.asarray(verts, dtype=np.double).reshape(-1, 3) + 0.
+    if tolerance > 0:
+        verts = np.floor(verts / tolerance + 0.5).astype(np.int64)
+    arr = as_face_array(faces)
+    digest = hashlib.sha1()
+    for part in (verts, arr):
+        digest.update(str(part.shape).encode())
+        digest.update(np.ascontiguousarray(part).tobytes())
+    return digest.hexdigest()
+
+
+def weld_vertices(verts, faces, tolerance=1e-6):
+    '''Merges vertices closer than tolerance, along with the vertices those
+    are merged with. Repeated vertices are removed from faces, which turns
+    a quad with two merged corners into a triangle, and faces left with
+    fewer than 3 vertices are removed, then vertices no face uses.
+
+    Returns (verts, faces, removed) where removed is the number of
+    vertices dropped. Vertices keep their original order and the first
+    vertex of each cluster is kept.'''
+    verts = np.asarray(verts, dtype=np.double).reshape(-1, 3)
+    arr = as_face_array(faces)
+    nverts = len(verts)
+
+    if tolerance > 0 and nverts:
+        first, group = _close_groups(verts, tolerance)
+        verts = verts[first]
+        arr = np.where(arr >= 0, group[arr], -1)
+        arr = _drop_repeats(arr)
+
+    used = np.zeros(len(verts), dtype=bool)
+    used[arr[arr >= 0]] = True
+    newindex = np.cumsum(used) - 1
+    verts = verts[used]
+    arr = np.where(arr >= 0, newindex[arr], -1)
+
+    return verts, _like(arr, faces), nverts - len(verts)
+
+
+# Offsets from a grid cell to the neighbouring cells after it, so each
+# pair of neighbouring cells is compared once
+_NEXT_CELLS = np.array([offset for offset in product((-1, 0, 1), repeat=3)
+                        if offset > (0, 0, 0)], dtype=np.int64)
+_CELL = np.dtype([('x', np.int64), ('y', np.int64), ('z', np.int64)])
+# Number of vertex pairs weld_vertices compares at once
+WELD_PAIRS = 1 << 20
+
+
+def _close_groups(verts, tolerance):
+    '''Groups vertices closer than tolerance, directly or through other
+    vertices of the group. Returns the first vertex of each group, in
+    order, and the group of every vertex.'''
+    # Vertices closer than tolerance are in the same or in neighbouring cells
+    cells = np.floor(verts / tolerance).astype(np.int64)
+    cell_first, cell = _unique_rows(cells)
+    by_cell = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell)
+    starts = np.cumsum(counts) - counts
+    cells = cells[cell_first]
+    for row_keys in (_row_keys, _cell_rows):
+        keys = row_keys(cells)
+        key_order = np.argsort(keys)
+        keys = keys[key_order]
+        # On a hash collision between different cells, compare whole rows
+        if not np.any(keys[1:] == keys[:-1]):
+            break
+
+    own = np.arange(len(cells))
+    neighbours = [(own, own)]
+    for offset in _NEXT_CELLS:
+        # A missing cell can share the key of another, whose vertices are
+        # then too far to pass the distance test
+        wanted = row_keys(cells + offset)
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        found = keys[pos] == wanted
+        neighbours.append((own[found], key_order[pos[found]]))
+
+    labels = np.arange(len(verts))
+    for a, b in neighbours:
+        for i, j in _vertex_pairs(by_cell, starts, counts, a, b):
+            close = ((verts[i] - verts[j]) ** 2).sum(axis=1) <= tolerance ** 2
+            labels = _join(labels, i[close], j[close])
+    is_first = labels == np.arange(len(verts))
+    return np.flatnonzero(is_first), (np.cumsum(is_first) - 1)[labels]
+
+
+def _vertex_pairs(by_cell, starts, counts, a, b):
+    '''Yields every pair of vertices from the cells a[k] and b[k], about
+    WELD_PAIRS pairs at a time. by_cell lists the vertices sorted by cell,
+    where cell c starts at starts[c] and has counts[c] vertices.'''
+    sizes = counts[a] * counts[b]
+    total = np.cumsum(sizes)
+    lo = 0
+    while lo < len(sizes):
+        hi = max(int(np.searchsorted(total, total[lo] - sizes[lo] + WELD_PAIRS, 'right')), lo + 1)
+        n = sizes[lo:hi]
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        width = np.repeat(counts[b[lo:hi]], n)
+        yield (by_cell[np.repeat(starts[a[lo:hi]], n) + k // width],
+               by_cell[np.repeat(starts[b[lo:hi]], n) + k % width])
+        lo = hi
+
+
+def _join(labels, i, j):
+    '''Joins the groups of the vertices i[k] and j[k], where every vertex
+    is labelled with the first vertex of its group.'''
+    while len(i):
+        li, lj = labels[i], labels[j]
+        apart = li != lj
+        i, j, li, lj = i[apart], j[apart], li[apart], lj[apart]
+        low = np.minimum(li, lj)
+        np.minimum.at(labels, li, low)
+        np.minimum.at(labels, lj, low)
+        # Point every label straight at the first vertex of its group
+        while True:
+            root = labels[labels]
+            if np.array_equal(root, labels):
+                break
+            labels = root
+    return labels
+
+
+def _row_keys(cells):
+    'Hashes each row of an (N,3) integer array into one 64 bit key.'
+    with np.errstate(over='ignore'):
+        return (cells[:, 0] * np.int64(73856093)
+                ^ cells[:, 1] * np.int64(19349663)
+                ^ cells[:, 2] * np.int64(83492791))
+
+
+def _cell_rows(cells):
+    'The rows of an (N,3) integer array as records that sort and compare whole.'
+    return np.ascontiguousarray(cells).view(_CELL).ravel()
+
+
+def _unique_rows(cells):
+    '''Groups identical rows of an (N,3) integer array by hashing them into
+    one 64 bit key. Returns the first row of each group and the group of
+    every row.'''
+    keys = _row_keys(cells)
+    # Group by sorting the keys once, as np.unique would but without its stable sort
+    order = np.argsort(keys)
+    ordered = keys[order]
+    starts = np.empty(len(keys), dtype=bool)
+    starts[:1] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=starts[1:])
+    group = np.empty_like(order)
+    group[order] = np.cumsum(starts) - 1
+    first = np.minimum.reduceat(order, np.flatnonzero(starts)) if len(keys) else order
+    if not np.array_equal(cells[first][group], cells):
+        # Hash collision between different cells, fall back to comparing rows
+        _, first, group = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    return first, group.reshape(-1)
+
+
+def _drop_repeats(arr):
+    '''Removes repeated vertices from padded faces, keeping the first of
+    each, and then the faces with fewer than 3 vertices left.'''
+    repeats = np.zeros(arr.shape, dtype=bool)
+    for j in range(1, arr.shape[1]):
+        for i in range(j):
+            repeats[:, j] |= (arr[:, j] == arr[:, i]) & (arr[:, j] >= 0)
+    if not repeats.any():
+        return arr
+    arr = np.where(repeats, -1, arr)
+    # Move the padding after the vertices left, keeping their order
+    arr = np.take_along_axis(arr, np.argsort(arr < 0, axis=1, kind='stable'), axis=1)
+    return arr[(arr >= 0).sum(axis=1) >= 3]
+
+
+def _has_repeats(arr):
+    'Marks faces that use a vertex more than once.'
+    repeats = np.zeros(len(arr), dtype=bool)
+    width = arr.shape[1]
+    for i in range(width):
+        for j in range(i + 1, width):
+            repeats |= (arr[:, i] == arr[:, j]) & (arr[:, i] >= 0)
+    return repeats
+
+
+def split_faces(faces, verts, tolerance=1e-6, ngons='fan'):
+    '''Splits faces into ones Geant4 accepts, keeping their winding.
+
+    Triangles are kept. Quads are kept if they are convex and planar, meaning
+    |(v1 x v2) . v3| <= tolerance * |v1| |v2| |v3| for their first three edges,
+    otherwise they are split into two triangles along a diagonal inside the
+    quad. Faces with more vertices are triangulated with a fan from their
+    first vertex (ngons='fan', fine for convex faces) or by ear clipping
+    (ngons='ear'). Faces are returned in their original order, as an array if
+    they were given as one (triangles padded with -1 if quads remain). A
+    face with fewer than 3 vertices raises a ValueError.'''
+    if ngons not in ('fan', 'ear'):
+        raise ValueError('ngons must be fan or ear, not ' + str(ngons))
+    verts = np.asarray(verts, dtype=np.double).reshape(-1, 3)
+    arr = as_face_array(faces)
+    lengths = (arr >= 0).sum(axis=1)
+    short = np.flatnonzero(lengths < 3)
+    if len(short):
+        raise ValueError('Face {0} has {1} vertices, faces need at least 3'.format(
+            short[0], lengths[short[0]]))
+
+    quads = np.flatnonzero(lengths == 4)
+    flat, other_diagonal = _check_quads(verts, arr[quads], tolerance)
+    keep = np.zeros(len(arr), dtype=bool)
+    keep[quads[flat]] = True
+    rotate = np.zeros(len(arr), dtype=bool)
+    rotate[quads[other_diagonal & ~flat]] = True
+
+    counts = np.clip(lengths - 2, 0, None)
+    counts[keep] = 1
+    offsets = np.cumsum(counts) - counts
+    out = np.full((int(counts.sum()), 4 if keep.any() else 3), -1, dtype=np.int64)
+
+    triangles = lengths == 3
+    out[offsets[triangles], :3] = arr[triangles, :3]
+    if keep.any():
+        out[offsets[keep], :4] = arr[keep, :4]
+
+    for n in np.unique(lengths[lengths > 3]).tolist():
+        todo = (lengths == n) & ~keep
+        if n == 4:
+            # Split concave quads along the diagonal through their reflex corner
+            for rotated, shift in ((False, 0), (True, 1)):
+                idx = np.flatnonzero(todo & (rotate == rotated))
+                pattern = (_fan(4) + shift) % 4
+                out[offsets[idx][:, None] + np.arange(2), :3] = arr[idx][:, pattern]
+        elif ngons == 'fan':
+            idx = np.flatnonzero(todo)
+            out[offsets[idx][:, None] + np.arange(n - 2), :3] = arr[idx][:, _fan(n)]
+        else:
+            for i in np.flatnonzero(todo).tolist():
+                face = arr[i, :n]
+                out[offsets[i]:offsets[i] + n - 2, :3] = face[_ear_clip(verts[face])]
+
+    return _like(out, faces)
+
+
+def _fan(n):
+    'Triangle corners of a fan over an n-gon, as an (n-2,3) array.'
+    k = np.arange(1, n - 1)
+    return np.stack([np.zeros_like(k), k, k + 1], axis=1)
+
+
+def _check_quads(verts, quads, tolerance):
+    '''Returns which quads are flat and convex, and which have a reflex
+    corner at their second or fourth vertex. quads may be padded to any width,
+    or have fewer columns if there are none.'''
+    if not len(quads):
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+    p = verts[quads[:, :4]]
+    edges = np.roll(p, -1, axis=1) - p
+    triple = np.einsum('ij,ij->i', np.cross(edges[:, 0], edges[:, 1]), edges[:, 2])
+    norms = np.prod(np.linalg.norm(edges[:, :3], axis=2), axis=1)
+    planar = np.abs(triple) <= tolerance * norms
+
+    normal = np.cross(p[:, 2] - p[:, 0], p[:, 3] - p[:, 1])
+    turns = np.einsum('ikj,ij->ik', np.cross(np.roll(edges, 1, axis=1), edges), normal)
+    reflex = turns <= 0
+    return planar & ~reflex.any(axis=1), reflex[:, 1] | reflex[:, 3]
+
+
+def _ear_clip(points):
+    '''Triangulates a simple polygon given by its (n,3) points by ear
+    clipping. Returns (n-2,3) corner indices with the winding of the polygon.'''
+    # Newell's method gives the polygon normal; drop its largest axis
+    normal = np.sum(np.cross(points, np.roll(points, -1, axis=0)), axis=0)
+    axis = int(np.argmax(np.abs(normal)))
+    uv = np.delete(points, axis, axis=1)
+    if normal[axis] * (1 if axis != 1 else -1) < 0:
+        uv = uv[:, ::-1]
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    def inside(p, a, b, c):
+        return cross(a, b, p) >= 0 and cross(b, c, p) >= 0 and cross(c, a, p) >= 0
+
+    uv = uv.tolist()
+    remaining = list(range(len(uv)))
+    triangles = []
+    while len(remaining) > 3:
+        n = len(remaining)
+        for k in range(n):
+            a, b, c = remaining[k - 1], remaining[k], remaining[(k + 1) % n]
+            if cross(uv[a], uv[b], uv[c]) <= 0:
+                continue
+            if any(inside(uv[p], uv[a], uv[b], uv[c]) for p in remaining if p not in (a, b, c)):
+                continue
+            triangles.append([a, b, c])
+            del remaining[k]
+            break
+        else:
+            # No ear found (degenerate or self-intersecting), fall back to a fan
+            triangles.extend([remaining[0], remaining[k], remaining[k + 1]] for k in range(1, n - 1))
+            remaining = []
+    if remaining:
+        triangles.append(remaining)
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def decimate(verts, faces, budget=None, tolerance=None):
+    '''Simplifies a mesh by quadric vertex clustering: vertices are grouped
+    in a grid and each group is replaced by the point that best keeps the
+    planes of its faces (the quadric error minimum). Faces are triangulated
+    first, and faces that collapse are removed.
+
+    Give tolerance for the grid spacing, which bounds how far the surface can
+    move, or budget for the largest number of faces wanted; the spacing is
+    then searched for; if nothing survives within it, the coarsest mesh that
+    still has faces is returned. Returns (verts, faces).'''
+    if budget is None and tolerance is None:
+        raise ValueError('decimate needs a budget or a tolerance')
+    verts = np.asarray(verts, dtype=np.double).reshape(-1, 3)
+    tris = _triangulate(as_face_array(faces))
+    if budget is not None and len(tris) <= budget and tolerance is None:
+        return verts, _like(tris, faces)
+
+    quadrics, area = _vertex_quadrics(verts, tris)
+    if tolerance is not None:
+        new_verts, new_tris = _cluster(verts, tris, quadrics, tolerance)
+    else:
+        new_verts, new_tris = _search_budget(verts, tris, quadrics, area, budget)
+    return new_verts, _like(new_tris, faces)
+
+
+# Passes allowed when searching for the grid spacing of a facet budget
+_BUDGET_STEPS = 12
+
+
+def _search_budget(verts, tris, quadrics, area, budget):
+    '''Finds the finest grid whose clustering keeps at most budget faces,
+    settling for one within 10% of it. A surface cut by a grid of spacing h
+    keeps about 2 area / h**2 triangles, which gives the first guess and the
+    size of each step; steps are bisections once the answer is bracketed.'''
+    spacing = np.sqrt(2 * area / max(budget, 1))
+    fine, coarse = 0, np.inf
+    best = fewest = None
+    for _ in range(_BUDGET_STEPS):
+        result = _cluster(verts, tris, quadrics, spacing)
+        count = len(result[1])
+        if count and (fewest is None or count < len(fewest[1])):
+            fewest = result
+        if count <= budget:
+            coarse = spacing
+            if count:
+                best = result
+            if count >= 0.9 * budget:
+                break
+        else:
+            fine = spacing
+        guess = spacing * np.sqrt(max(count, 1) / (0.95 * budget))
+        if not fine < guess < coarse:
+            guess = np.sqrt(fine * coarse) if fine and coarse < np.inf else guess * (2 if count > budget else 0.5)
+        spacing = guess
+    # The budget may be too small for anything to survive
+    if best is not None:
+        return best
+    return fewest if fewest is not None else result
+
+
+def _triangulate(arr):
+    'Fans every face of a padded face array into triangles.'
+    if arr.shape[1] == 3:
+        return arr
+    lengths = (arr >= 0).sum(axis=1)
+    pieces = [arr[lengths == 3, :3]]
+    for n in np.unique(lengths[lengths > 3]).tolist():
+        pieces.append(arr[lengths == n][:, _fan(n)].reshape(-1, 3))
+    return np.concatenate(pieces)
+
+
+def _vertex_quadrics(verts, tris):
+    '''Sums the area weighted plane quadric of each triangle onto its
+    corners, as the 10 unique entries of the symmetric 4x4 matrix.'''
+    p = verts[tris]
+    normal = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]) / 2
+    area = np.linalg.norm(normal, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit = np.where(area[:, None] > 0, normal / area[:, None], 0)
+    plane = np.column_stack([unit, -np.einsum('ij,ij->i', unit, p[:, 0])])
+    rows, cols = np.triu_indices(4)
+    face_q = plane[:, rows] * plane[:, cols] * area[:, None]
+    corners = tris.reshape(-1)
+    quadrics = np.stack([np.bincount(corners, np.repeat(q, 3), len(verts)) for q in face_q.T], axis=1)
+    return quadrics, area.sum()
+
+
+def _cluster(verts, tris, quadrics, spacing):
+    'Collapses the vertices in each grid cell of the given spacing.'
+    if spacing <= 0 or not len(verts):
+        return verts, tris
+    origin = verts.min(axis=0)
+    cells = np.floor((verts - origin) / spacing).astype(np.int64)
+    first, group = _unique_rows(cells)
+    ngroups = len(first)
+
+    summed = np.stack([np.bincount(group, q, ngroups) for q in quadrics.T], axis=1)
+    mean = np.stack([np.bincount(group, v, ngroups) for v in verts.T], axis=1)
+    mean /= np.bincount(group, minlength=ngroups)[:, None]
+
+    # Solve A x = -b for the quadric minimum; keep it if it stays in the cell
+    full = np.zeros((ngroups, 4, 4))
+    rows, cols = np.triu_indices(4)
+    full[:, rows, cols] = summed
+    full[:, cols, rows] = summed
+    a, b = full[:, :3, :3], full[:, :3, 3]
+    solvable = np.abs(np.linalg.det(a)) > 1e-12 * np.abs(a).max(axis=(1, 2)) ** 3
+    new_verts = mean.copy()
+    if solvable.any():
+        best = np.linalg.solve(a[solvable], -b[solvable][:, :, None])[:, :, 0]
+        inside = np.all(np.abs(best - origin - (cells[first[solvable]] + 0.5) * spacing) <= spacing, axis=1)
+        new_verts[np.flatnonzero(solvable)[inside]] = best[inside]
+
+    new_tris = group[tris]
+    new_tris = new_tris[~_has_repeats(new_tris)]
+    # Remove faces that now repeat another one
+    keep, _ = _unique_rows(np.sort(new_tris, axis=1))
+    new_tris = new_tris[np.sort(keep)]
+
+    used = np.zeros(ngroups, dtype=bool)
+    used[new_tris] = True
+    return new_verts[used], (np.cumsum(used) - 1)[new_tris]
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+from itertools import islice
+import os
+import pathlib
+import re
+
+import numpy as np
+
+from .mesh import as_face_array, _unique_rows
+
+__all__ = ['Mesh', 'read_mesh', 'read_dump', 'write_dump', 'read_stl', 'read_ply', 'read_obj',
+           'index_triangles', 'READERS']
+
+# Bytes of text files parsed at a time
+CHUNK_BYTES = 1 << 24
+
+STL_RECORD = np.dtype([('normal', '<f4', 3), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+PLY_TYPES = {'char': 'i1', 'uchar': 'u1', 'short': 'i2', 'ushort': 'u2', 'int': 'i4', 'uint': 'u4',
+             'float': 'f4', 'double': 'f8', 'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2',
+             'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8'}
+
+# Vertices as an (N,3) array, faces as an (M,3) or (M,4) array padded with
+# -1, and the material of the mesh if its file names one
+Mesh = namedtuple('Mesh', 'verts faces material')
+
+
+def read_dump(filename):
+    '''Reads a mesh dump written by write_dump, such as the ones
+    blendertoGDML.dump_meshes writes from Blender.'''
+    with np.load(str(filename)) as dump:
+        material = str(dump['material']) if 'material' in dump else None
+        return Mesh(dump['verts'], dump['faces'], material)
+
+
+def write_dump(filename, verts, faces, material=None):
+    '''Writes a mesh as an .npz file of its vertex and face arrays, which
+    read_dump and the pygdml command read back.'''
+    arrays = {'verts': np.asarray(verts, dtype=np.double).reshape(-1, 3),
+              'faces': as_face_array(faces)}
+    if material is not None:
+        arrays['material'] = np.array(material)
+    with open(str(filename), 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def index_triangles(corners):
+    '''Turns an (M,3,3) array of triangle corners, as STL files hold them,
+    into an (N,3) array of distinct vertices in order of first use and an
+    (M,3) array of faces. Equal vertices are found by hashing their bits in
+    one vectorized pass, see mesh._unique_rows.'''
+    # Adding 0 turns -0.0 into 0.0, which has other bits
+    points = np.ascontiguousarray(corners).reshape(-1, 3) + corners.dtype.type(0)
+    if not len(points):
+        return points, np.empty((0, 3), dtype=np.int64)
+    bits = points.view('i{0}'.format(points.dtype.itemsize)).astype(np.int64)
+    first, group = _unique_rows(bits)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return points[first[order]], rank[group].reshape(-1, 3)
+
+
+def read_stl(filename):
+    '''Reads a binary or ASCII STL file. Binary files are memory mapped, and
+    their triangles are read without a copy.'''
+    size = os.path.getsize(str(filename))
+    with open(str(filename), 'rb') as f:
+        head = f.read(84)
+        if len(head) == 84 and 84 + STL_RECORD.itemsize * int.from_bytes(head[80:], 'little') == size:
+            count = int.from_bytes(head[80:], 'little')
+            if not count:
+                return Mesh(np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int64), None)
+            records = np.memmap(str(filename), STL_RECORD, 'r', offset=84, shape=(count,))
+            return Mesh(*index_triangles(records['corners']), None)
+        if not head.lstrip().startswith(b'solid'):
+            raise ValueError('{0} is not an STL file'.format(filename))
+        f.seek(0)
+        chunks = []
+        for lines in iter(lambda: f.readlines(CHUNK_BYTES), []):
+            corners = [line.split(None, 1)[1] for line in lines if line.lstrip().startswith(b'vertex')]
+            chunks.append(np.fromstring(b' '.join(corners), sep=' '))
+    return Mesh(*index_triangles(np.concatenate(chunks).reshape(-1, 3, 3)), None)
+
+
+def _padded(lines, counts, width=None, fill=-1):
+    '''Parses lines of numbers into an array with a row per line, padded
+    with fill where a line has fewer than the widest one.'''
+    counts = np.array(counts, dtype=np.int64)
+    width = width or (int(counts.max()) if len(counts) else 0)
+    values = np.fromstring(b' '.join(lines), sep=' ')
+    if len(values) != counts.sum():
+        raise ValueError('Cannot read a line of numbers')
+    if np.all(counts == width):
+        return values.reshape(-1, width)
+    arr = np.full((len(counts), width), fill, dtype=values.dtype)
+    arr[np.arange(width) < counts[:, None]] = values
+    return arr
+
+
+def _ply_header(f):
+    '''Reads the header of a PLY file. Returns its format and its elements,
+    as (name, count, properties) with a property as (name, type), or as
+    (name, (count type, item type)) for a list.'''
+    if f.readline().strip() != b'ply':
+        raise ValueError('Not a PLY file')
+    form = None
+    elements = []
+    for line in f:
+        words = line.decode('ascii').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'format':
+            form = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property' and words[1] == 'list':
+            elements[-1][2].append((words[4], (PLY_TYPES[words[2]], PLY_TYPES[words[3]])))
+        elif words[0] == 'property':
+            elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+        elif words[0] == 'end_header':
+            return form, elements
+    raise ValueError('PLY header has no end_header')
+
+
+def read_ply(filename):
+    '''Reads the vertices and faces of a binary or ASCII PLY file. Binary
+    files are memory mapped; their vertices, and faces if they all have as
+    many vertices, are read from the map in one go.'''
+    with open(str(filename), 'rb') as f:
+        form, elements = _ply_header(f)
+        if form == 'ascii':
+            return _read_ply_ascii(f, elements)
+        offset = f.tell()
+    if form not in ('binary_little_endian', 'binary_big_endian'):
+        raise ValueError('Unknown PLY format ' + str(form))
+    order = '<' if form == 'binary_little_endian' else '>'
+    data = np.memmap(str(filename), np.uint8, 'r')
+
+    verts = faces = None
+    for name, count, props in elements:
+        if verts is not None and faces is not None:
+            break
+        if all(isinstance(kind, str) for _, kind in props):
+            records = np.frombuffer(data, np.dtype([(p, order + kind) for p, kind in props]), count, offset)
+            offset += records.itemsize * count
+        else:
+            records, offset = _ply_lists(data, offset, count, props, order)
+        if name == 'vertex':
+            verts = np.stack([records['x'], records['y'], records['z']], axis=1)
+        elif name == 'face':
+            faces = records[next(p for p, kind in props if not isinstance(kind, str))]
+    return _ply_mesh(verts, faces)
+
+
+def _ply_lists(data, offset, count, props, order):
+    '''Reads count records with list properties from data at offset. Returns
+    the records, with each list as an array padded with -1, and the offset
+    after them.'''
+    first = props[0][1]
+    if count and not isinstance(first, str):
+        # Try every list having as many items as the first one
+        width = int(np.frombuffer(data, order + first[0], 1, offset)[0])
+        fields = []
+        for p, kind in props:
+            if isinstance(kind, str):
+                fields.append((p, order + kind))
+            else:
+                fields += [(p + '_count', order + kind[0]), (p, order + kind[1], (width,))]
+        dtype = np.dtype(fields)
+        if len(data) >= offset + dtype.itemsize * count:
+            records = np.frombuffer(data, dtype, count, offset)
+            if all(np.all(records[p + '_count'] == width) for p, kind in props if not isinstance(kind, str)):
+                return records, offset + dtype.itemsize * count
+
+    # Lists of different lengths, walk the records one at a time
+    columns = {p: [] for p, _ in props}
+    for _ in range(count):
+        for p, kind in props:
+            if isinstance(kind, str):
+                value = np.frombuffer(data, order + kind, 1, offset)
+                columns[p].append(value[0])
+                offset += value.itemsize
+            else:
+                n = int(np.frombuffer(data, order + kind[0], 1, offset)[0])
+                offset += np.dtype(kind[0]).itemsize
+                columns[p].append(np.frombuffer(data, order + kind[1], n, offset))
+                offset += np.dtype(kind[1]).itemsize * n
+    records = {}
+    for p, kind in props:
+        if isinstance(kind, str):
+            records[p] = np.array(columns[p])
+        else:
+            counts = [len(items) for items in columns[p]]
+            records[p] = np.full((count, max(counts, default=0)), -1, dtype=np.int64)
+            records[p][np.arange(records[p].shape[1]) < np.array(counts)[:, None]] = np.concatenate(
+                columns[p] or [np.empty(0)])
+    return records, offset
+
+
+def _read_ply_ascii(f, elements):
+    verts = faces = None
+    for name, count, props in elements:
+        if verts is not None and faces is not None:
+            break
+        lines = list(islice(f, count))
+        if len(lines) != count:
+            raise ValueError('PLY file ends in its {0} elements'.format(name))
+        if name == 'vertex':
+            columns = [p for p, _ in props]
+            values = _padded(lines, [len(columns)] * count, len(columns))
+            verts = values[:, [columns.index(axis) for axis in 'xyz']]
+        elif name == 'face':
+            # Each line starts with the number of vertices of the face
+            values = _padded(lines, [len(line.split()) for line in lines])
+            faces = values[:, 1:]
+    return _ply_mesh(verts, faces)
+
+
+def _ply_mesh(verts, faces):
+    if verts is None or faces is None:
+        raise ValueError('PLY file has no vertex or face elements')
+    return Mesh(np.ascontiguousarray(verts), np.asarray(faces).astype(np.int64), None)
+
+
+# Face corners as in f 1/2/3, of which only the vertex is kept
+_OBJ_CORNER = re.compile(rb'/\S*')
+
+
+def read_obj(filename):
+    '''Reads the vertices and faces of an OBJ file in chunks, each parsed in
+    one pass. Face indices may be negative, counting back from the last
+    vertex. The material is the first one used, if any.'''
+    verts, faces = [], []
+    nverts = 0
+    material = None
+    with open(str(filename), 'rb') as f:
+        for lines in iter(lambda: f.readlines(CHUNK_BYTES), []):
+            vlines, flines, before = [], [], []
+            for line in lines:
+                kind = line[:2]
+                if kind == b'v ' or kind == b'v\t':
+                    vlines.append(line[2:])
+                elif kind == b'f ' or kind == b'f\t':
+                    flines.append(_OBJ_CORNER.sub(b'', line[2:]))
+                    before.append(nverts + len(vlines))
+                elif material is None and line.startswith(b'usemtl'):
+                    material = line.split()[1].decode()
+            if vlines:
+                # Drop the w or colours some files have after x, y and z
+                verts.append(_padded(vlines, [len(line.split()) for line in vlines])[:, :3])
+                nverts += len(vlines)
+            if flines:
+                # Indices count from 1, so 0 pads faces with fewer vertices
+                arr = _padded(flines, [len(line.split()) for line in flines], fill=0).astype(np.int64)
+                arr = np.where(arr > 0, arr - 1, np.where(arr < 0, np.array(before)[:, None] + arr, -1))
+                faces.append(arr)
+    verts = np.concatenate(verts) if verts else np.empty((0, 3))
+    width = max((arr.shape[1] for arr in faces), default=3)
+    faces = np.concatenate([np.pad(arr, ((0, 0), (0, width - arr.shape[1])), constant_values=-1)
+                            for arr in faces]) if faces else np.empty((0, 3), dtype=np.int64)
+    return Mesh(verts, faces, material)
+
+
+# Readers of each file suffix, returning a Mesh
+READERS = {'.npz': read_dump, '.stl': read_stl, '.ply': read_ply, '.obj': read_obj}
+
+
+def read_mesh(filename):
+    'Reads a mesh file with the reader of its suffix.'
+    suffix = pathlib.Path(filename).suffix.lower()
+    reader = READERS.get(suffix)
+    if reader is None:
+        raise ValueError('Cannot read {0} files'.format(suffix or 'these'))
+    return reader(filename)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+
+import numpy as np
+
+from .bounds import Bounds, LENGTHS, ANGLES, _rotation
+from .mesh import _triangulate
+
+__all__ = ['Overlap', 'find_overlaps']
+
+Overlap = namedtuple('Overlap', 'mother first second')
+Overlap.__doc__ = '''Volumes that overlap inside mother. second is None when
+first sticks out of the mother instead.'''
+
+# Largest number of triangle pairs tested at once
+PAIR_CHUNK = 1 << 16
+
+
+def find_overlaps(mygdml, processes=None, segments=48):
+    '''Checks the daughters of every volume for overlaps with each other and
+    with their mother, and returns a list of Overlap, the first volume of a
+    pair being the one placed first.
+
+    Bounding boxes of the daughters of each mother prune the pairs of volumes,
+    and boxes of their triangles prune the pairs of triangles that are tested
+    exactly, in a pool of processes (None uses every core). Tubes and cones
+    are approximated by segments sides. Touching surfaces do not count, and
+    volumes placed from other files are not checked.'''
+    mygdml._materialize()
+    checker = _Meshes(mygdml, segments)
+
+    jobs = []
+    for mother in mygdml.structure.getElements():
+        placed = [(physvol.find('volumeref').get('ref'), physvol)
+                  for physvol in mother.findall('physvol') if physvol.find('volumeref') is not None]
+        if not placed:
+            continue
+        name = mother.get('name')
+        meshes = [checker.placed(*daughter) for daughter in placed]
+        low = np.array([mesh.min(axis=(0, 1)) for mesh in meshes])
+        high = np.array([mesh.max(axis=(0, 1)) for mesh in meshes])
+
+        mother_mesh = checker.solid(mother.find('solidref').get('ref'))
+        for (daughter, _), mesh in zip(placed, meshes):
+            jobs.append((name, daughter, None, mesh, mother_mesh))
+
+        # Sweep along x over the boxes, sorted by their low edge
+        order = np.argsort(low[:, 0], kind='stable')
+        for k, i in enumerate(order.tolist()):
+            for j in order[k + 1:].tolist():
+                if low[j, 0] >= high[i, 0]:
+                    break
+                if np.all(low[j] < high[i]) and np.all(low[i] < high[j]):
+                    first, second = min(i, j), max(i, j)
+                    jobs.append((name, placed[first][0], placed[second][0], meshes[first], meshes[second]))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(jobs) < 2:
+        results = map(_check, jobs)
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_check, jobs, chunksize=max(1, len(jobs) // (4 * processes))))
+    return [Overlap(*job[:3]) for job, hit in zip(jobs, results) if hit]
+
+
+class _Meshes(object):
+    'Triangle meshes of solids in mm, in their own frame and placed.'
+
+    def __init__(self, mygdml, segments):
+        self.gdml = mygdml
+        self.bounds = Bounds(mygdml, 'mm')
+        self.segments = segments
+        self._solids = {}
+
+    def solid(self, name):
+        if name not in self._solids:
+            el = self.gdml.solids.find(name)
+            if el is None:
+                raise ValueError('No solid named ' + name)
+            maker = getattr(self, '_' + el.tag, None)
+            if maker is None:
+                raise ValueError('Overlaps of {0} solids cannot be checked'.format(el.tag))
+            self._solids[name] = maker(el)
+        return self._solids[name]
+
+    def placed(self, volume, physvol):
+        'Triangles of a daughter volume in the frame of its mother.'
+        solid = self.gdml.structure.find(volume).find('solidref').get('ref')
+        scale = self.bounds._vector(physvol, 'scale', (1, 1, 1), None)
+        angles = self.bounds._vector(physvol, 'rotation', (0, 0, 0), ANGLES)
+        position = self.bounds._vector(physvol, 'position', (0, 0, 0), LENGTHS)
+        return np.dot(self.solid(solid) * scale, _rotation(*angles)) + position
+
+    def _box(self, el):
+        half = np.array([self.bounds._number(el, axis) for axis in 'xyz']) / 2
+        return _hexahedron(half[0], half[1], half[0], half[1], half[2]) * self.bounds._length(el)
+
+    def _trd(self, el):
+        x1, x2, y1, y2, z = (self.bounds._number(el, key) / 2 for key in ('x1', 'x2', 'y1', 'y2', 'z'))
+        return _hexahedron(x1, y1, x2, y2, z) * self.bounds._length(el)
+
+    def _tube(self, el):
+        rmin, rmax = self.bounds._number(el, 'rmin', 0), self.bounds._number(el, 'rmax')
+        return self._revolve(el, rmin, rmax, rmin, rmax)
+
+    def _cone(self, el):
+        return self._revolve(el, *(self.bounds._number(el, key, 0)
+                                   for key in ('rmin1', 'rmax1', 'rmin2', 'rmax2')))
+
+    def _revolve(self, el, rmin1, rmax1, rmin2, rmax2):
+        'Triangles of a tube or cone segment, inscribed in the real surface.'
+        aunit = ANGLES[el.get('aunit', 'rad')]
+        start = self.bounds._number(el, 'startphi', 0) * aunit
+        delta = min(self.bounds._number(el, 'deltaphi', 2 * math.pi / aunit) * aunit, 2 * math.pi)
+        closed = delta >= 2 * math.pi - 1e-9
+        n = max(3, int(math.ceil(self.segments * delta / (2 * math.pi))))
+        phi = start + delta * np.arange(n + 1) / n
+        half_z = self.bounds._number(el, 'z') / 2
+        circle = np.stack([np.cos(phi), np.sin(phi)], axis=1)
+
+        def ring(r, z):
+            return np.column_stack([circle * r, np.full(len(phi), z)])
+
+        outer_low, outer_high = ring(rmax1, -half_z), ring(rmax2, half_z)
+        inner_low, inner_high = ring(rmin1, -half_z), ring(rmin2, half_z)
+        quads = [_strip(outer_low, outer_high), _strip(outer_high, inner_high),
+                 _strip(inner_high, inner_low), _strip(inner_low, outer_low)]
+        if not closed:
+            for k in (0, -1):
+                quads.append(np.array([[outer_low[k], outer_high[k], inner_high[k], inner_low[k]]]))
+        quads = np.concatenate(quads)
+        triangles = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+        return triangles * self.bounds._length(el)
+
+    def _tessellated(self, el):
+        points, faces = self.bounds.vertices(el)
+        return points[_triangulate(faces)]
+
+
+def _hexahedron(x1, y1, x2, y2, z):
+    'Triangles of a trd with half lengths x1, y1 at -z and x2, y2 at +z.'
+    low = np.array([(-x1, -y1, -z), (x1, -y1, -z), (x1, y1, -z), (-x1, y1, -z)])
+    high = np.array([(-x2, -y2, z), (x2, -y2, z), (x2, y2, z), (-x2, y2, z)])
+    quads = np.concatenate([_strip(np.vstack([low, low[:1]]), np.vstack([high, high[:1]])),
+                            [low[::-1], high]])
+    return np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+
+
+def _strip(first, second):
+    'Quads between two rows of points.'
+    return np.stack([first[:-1], first[1:], second[1:], second[:-1]], axis=1)
+
+
+def _check(job):
+    '''Narrow phase: do the surfaces cross, does one volume contain the other,
+    or, for faces in the same planes, where crossings are not seen, is there
+    a point well inside both?'''
+    mother, first, second, a, b = job
+    if _surfaces_cross(a, b):
+        return True
+    centre = a.reshape(-1, 3).mean(axis=0)
+    a_low, a_high = a.reshape(-1, 3).min(axis=0), a.reshape(-1, 3).max(axis=0)
+    eps = 1e-6 * (a_high - a_low).max()
+    if second is None:
+        if not _inside(centre, b):
+            return True
+        return any(_strictly_inside(point, a, eps) and _strictly_outside(point, b, eps)
+                   for point in _probes(a_low, a_high))
+    b_low, b_high = b.reshape(-1, 3).min(axis=0), b.reshape(-1, 3).max(axis=0)
+    if np.all(b_low <= a_low) and np.all(a_high <= b_high) and _inside(centre, b):
+        return True
+    if np.all(a_low <= b_low) and np.all(b_high <= a_high) and _inside(b.reshape(-1, 3).mean(axis=0), a):
+        return True
+    low, high = np.maximum(a_low, b_low), np.minimum(a_high, b_high)
+    if np.any(high - low <= eps):
+        return False
+    return any(_strictly_inside(point, a, eps) and _strictly_inside(point, b, eps)
+               for point in _probes(low, high))
+
+
+def _probes(low, high):
+    'The centre of a box and the centres of its eight octants.'
+    fractions = np.array([(0.5, 0.5, 0.5)] + [(x, y, z) for x in (0.25, 0.75)
+                                               for y in (0.25, 0.75) for z in (0.25, 0.75)])
+    return low + fractions * (high - low)
+
+
+# A point and the points eps from it along each axis, as multiples of eps
+_NUDGES = np.vstack([np.zeros(3), np.eye(3), -np.eye(3)])
+
+
+def _strictly_inside(point, triangles, eps):
+    'Whether point is inside a closed mesh, and more than about eps from its surface.'
+    return all(_inside(nudged, triangles) for nudged in point + eps * _NUDGES)
+
+
+def _strictly_outside(point, triangles, eps):
+    return not any(_inside(nudged, triangles) for nudged in point + eps * _NUDGES)
+
+
+def _surfaces_cross(a, b):
+    boxes_a = np.stack([a.min(axis=1), a.max(axis=1)], axis=1)
+    boxes_b = np.stack([b.min(axis=1), b.max(axis=1)], axis=1)
+    for ia, ib in _candidate_pairs(boxes_a, boxes_b):
+        ta, tb = a[ia], b[ib]
+        for k in range(3):
+            if (_segment_hits(ta[:, k], ta[:, (k + 1) % 3], tb).any()
+                    or _segment_hits(tb[:, k], tb[:, (k + 1) % 3], ta).any()):
+                return True
+    return False
+
+
+def _candidate_pairs(boxes_a, boxes_b):
+    '''Yields chunks of index pairs of boxes that overlap, splitting space in
+    half along its longest side until few pairs are left.'''
+    stack = [(np.arange(len(boxes_a)), np.arange(len(boxes_b)), 0)]
+    while stack:
+        ia, ib, depth = stack.pop()
+        if not len(ia) or not len(ib):
+            continue
+        low = np.maximum(boxes_a[ia, 0].min(axis=0), boxes_b[ib, 0].min(axis=0))
+        high = np.minimum(boxes_a[ia, 1].max(axis=0), boxes_b[ib, 1].max(axis=0))
+        if np.any(low > high):
+            continue
+        if len(ia) * len(ib) > PAIR_CHUNK and depth < 32:
+            axis = int(np.argmax(high - low))
+            middle = (low[axis] + high[axis]) / 2
+            halves = [(ia[boxes_a[ia, 0, axis] <= middle], ib[boxes_b[ib, 0, axis] <= middle]),
+                      (ia[boxes_a[ia, 1, axis] >= middle], ib[boxes_b[ib, 1, axis] >= middle])]
+            if any(len(ja) < len(ia) or len(jb) < len(ib) for ja, jb in halves):
+                stack.extend((ja, jb, depth + 1) for ja, jb in halves)
+                continue
+        step = max(1, PAIR_CHUNK // len(ib))
+        for start in range(0, len(ia), step):
+            ja = ia[start:start + step]
+            hit = np.all((boxes_a[ja, None, 0] <= boxes_b[None, ib, 1])
+                         & (boxes_b[None, ib, 0] <= boxes_a[ja, None, 1]), axis=2)
+            rows, cols = np.nonzero(hit)
+            if len(rows):
+                yield ja[rows], ib[cols]
+
+
+def _segment_hits(p0, p1, triangles, eps=1e-9):
+    '''Moller-Trumbore test of segments p0-p1 against triangles, pairwise.
+    Only crossings strictly inside both count.'''
+    direction = p1 - p0
+    e1 = triangles[:, 1] - triangles[:, 0]
+    e2 = triangles[:, 2] - triangles[:, 0]
+    h = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, h)
+    scale = np.linalg.norm(direction, axis=1) * np.linalg.norm(e1, axis=1) * np.linalg.norm(e2, axis=1)
+    ok = np.abs(det) > 1e-12 * scale
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = np.where(ok, 1 / det, 0)
+        s = p0 - triangles[:, 0]
+        u = np.einsum('ij,ij->i', s, h) * inv
+        q = np.cross(s, e1)
+        v = np.einsum('ij,ij->i', direction, q) * inv
+        t = np.einsum('ij,ij->i', e2, q) * inv
+    return ok & (u > eps) & (v > eps) & (u + v < 1 - eps) & (t > eps) & (t < 1 - eps)
+
+
+def _inside(point, triangles):
+    'Whether point is inside a closed mesh, by the parity of a ray.'
+    direction = np.array([1, math.sqrt(2) * 1e-3, math.sqrt(3) * 1e-3])
+    e1 = triangles[:, 1] - triangles[:, 0]
+    e2 = triangles[:, 2] - triangles[:, 0]
+    h = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, h)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = np.where(det != 0, 1 / det, 0)
+        s = point - triangles[:, 0]
+        u = np.einsum('ij,ij->i', s, h) * inv
+        q = np.cross(s, e1)
+        v = np.dot(q, direction) * inv
+        t = np.einsum('ij,ij->i', e2, q) * inv
+    hits = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+    return bool(hits.sum() % 2)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+
+import numpy as np
+
+from .mesh import as_face_array, _triangulate, _unique_rows
+
+__all__ = ['Primitive', 'recognize', 'add_primitive']
+
+Primitive = namedtuple('Primitive', 'solid params position axes')
+Primitive.__doc__ = '''A solid recognised in a mesh: solid is box, tube or cone,
+params are the lengths for Solids.addBox, addTube or addCone, and the solid
+is placed at position with its x, y and z axes along the columns of axes.'''
+
+
+def recognize(verts, faces, tolerance=1e-5, min_sides=16):
+    '''Returns the Primitive a closed mesh is, or None. Vertices must lie on
+    the primitive within tolerance times the size of the mesh. Tubes and
+    cones are full, solid ones with at least min_sides sides; a cone may end
+    in a point.'''
+    verts = np.asarray(verts, dtype=np.double).reshape(-1, 3)
+    tris = _triangulate(as_face_array(faces))
+    if len(tris) < 4:
+        return None
+    points = verts[tris]
+    cross = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    volume = abs(np.einsum('ij,ij->i', points[:, 0], cross).sum()) / 6
+    area = np.linalg.norm(cross, axis=1) / 2
+    good = area > 0
+    normals, area = cross[good] / (2 * area[good, None]), area[good]
+    used = verts[np.unique(tris)]
+    tol = tolerance * np.ptp(used, axis=0).max()
+    if not len(area) or tol <= 0:
+        return None
+
+    first = _dominant(normals, area)
+    side = np.abs(np.dot(normals, first)) < tolerance
+    if side.any():
+        second = _dominant(normals[side], area[side])
+        second -= np.dot(second, first) * first
+        second /= np.linalg.norm(second)
+        # Right handed, with z along the first direction
+        axes = np.column_stack([second, np.cross(first, second), first])
+        box = _box(used, normals, axes, volume, tol, tolerance)
+        if box is not None:
+            return box
+    # Around the axis of a tube or cone, the normals spread evenly; the axis
+    # is the eigenvector of their scatter that is not one of an equal pair
+    spread, vectors = np.linalg.eigh(np.dot((normals * area[:, None]).T, normals))
+    alone = np.argmin([abs(spread[1] - spread[2]), abs(spread[0] - spread[2]), abs(spread[0] - spread[1])])
+    for axis in (first, vectors[:, alone]):
+        found = _round(used, axis, volume, tol, tolerance, min_sides)
+        if found is not None:
+            return found
+    return None
+
+
+def _dominant(normals, area):
+    'The direction, up to sign, that the largest area of faces faces.'
+    # Flip each normal so its largest component is positive
+    signs = np.sign(normals[np.arange(len(normals)), np.abs(normals).argmax(axis=1)])
+    normals = normals * signs[:, None]
+    _, group = _unique_rows(np.round(normals * 1e4).astype(np.int64))
+    best = np.argmax(np.bincount(group, area))
+    direction = (normals[group == best] * area[group == best, None]).sum(axis=0)
+    return direction / np.linalg.norm(direction)
+
+
+def _box(verts, normals, axes, volume, tol, tolerance):
+    if np.any(np.abs(np.dot(normals, axes)).max(axis=1) < 1 - tolerance):
+        return None
+    local = np.dot(verts, axes)
+    low, high = local.min(axis=0), local.max(axis=0)
+    if not np.all((np.abs(local - low) <= tol) | (np.abs(local - high) <= tol)):
+        return None
+    size = high - low
+    if abs(volume - np.prod(size)) > 3 * tolerance * np.prod(size):
+        return None
+    x, y, z = size.tolist()
+    return Primitive('box', dict(x=x, y=y, z=z), np.dot(axes, (low + high) / 2), axes)
+
+
+def _round(verts, axis, volume, tol, tolerance, min_sides):
+    'Checks for a tube or cone around axis.'
+    helper = np.eye(3)[np.argmin(np.abs(axis))]
+    x = np.cross(helper, axis)
+    x /= np.linalg.norm(x)
+    axes = np.column_stack([x, np.cross(axis, x), axis])
+    local = np.dot(verts, axes)
+    z_low, z_high = local[:, 2].min(), local[:, 2].max()
+    bottom = np.abs(local[:, 2] - z_low) <= tol
+    top = np.abs(local[:, 2] - z_high) <= tol
+    if not np.all(bottom | top) or np.any(bottom & top):
+        return None
+
+    caps = sorted((bottom, top), key=lambda cap: -cap.sum())
+    centre = local[caps[0], :2].mean(axis=0)
+    radii, areas = [], []
+    for cap in (bottom, top):
+        r = np.linalg.norm(local[cap, :2] - centre, axis=1)
+        rim = r > tol
+        if not rim.any():
+            radii.append(0.)
+            areas.append(0.)
+            continue
+        if rim.sum() < min_sides or np.ptp(r[rim]) > 2 * tol:
+            return None
+        radii.append(r[rim].mean())
+        # Area of the rim polygon, taken in order of angle
+        xy = local[cap][rim, :2] - centre
+        xy = xy[np.argsort(np.arctan2(xy[:, 1], xy[:, 0]))]
+        following = np.roll(xy, -1, axis=0)
+        areas.append(abs((xy[:, 0] * following[:, 1] - xy[:, 1] * following[:, 0]).sum()) / 2)
+
+    height = z_high - z_low
+    expected = height / 3 * (areas[0] + areas[1] + np.sqrt(areas[0] * areas[1]))
+    if abs(volume - expected) > 3 * tolerance * expected:
+        return None
+    position = np.dot(axes, [centre[0], centre[1], (z_low + z_high) / 2])
+    if abs(radii[0] - radii[1]) <= tol:
+        return Primitive('tube', dict(rmin=0, rmax=(radii[0] + radii[1]) / 2, z=height), position, axes)
+    return Primitive('cone', dict(rmin1=0, rmax1=radii[0], rmin2=0, rmax2=radii[1], z=height), position, axes)
+
+
+def add_primitive(mygdml, name, primitive, material, parent=None, lunit='m'):
+    '''Adds a recognised Primitive as a solid and a volume, placed by the
+    position name_pos and rotation name_rot.'''
+    adders = {'box': mygdml.solids.addBox, 'tube': mygdml.solids.addTube, 'cone': mygdml.solids.addCone}
+    adders[primitive.solid](name, lunit=lunit, **primitive.params)
+    x, y, z = primitive.position.tolist()
+    mygdml.define.addPosition(name + '_pos', x, y, z, unit=lunit)
+    # Geant4 turns daughters by the inverse of the rotation given
+    mygdml.define.addRotationMatrix(name + '_rot', *primitive.axes.ravel().tolist())
+    return mygdml.structure.addVolume(name, material, name + '_pos', name + '_rot', parent=parent)
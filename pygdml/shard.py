@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pathlib
+
+from .gdml import GDML, DAUGHTER_TAGS, _adopt, atomic_path
+
+__all__ = ['write_sharded']
+
+# Documents to write, inherited by forked worker processes
+_JOBS = []
+
+
+def write_sharded(mygdml, filename=None, threshold=10000, processes=None, pretty=False, threads=False):
+    '''Writes mygdml with every tessellated solid of more than threshold
+    facets moved into its own self-contained GDML file, next to filename.
+
+    Each shard holds the solid, its vertex defines, a copy of the materials
+    and its logical volume as the world; the master document places it with
+    a <file> physvol, as Structure.addVolumeFile does, naming the shard
+    relative to the directory of filename. Shards are written in
+    parallel by a pool of processes (None uses every core; with one, they are
+    written in this process). With threads=True, a pool of threads is used
+    instead, for callers such as Blender that must not fork or spawn
+    processes. mygdml is modified. Returns the shard file names.'''
+    if filename is None:
+        filename = mygdml._main_name + '.gdml'
+    path = pathlib.Path(filename)
+    mygdml._materialize()
+
+    jobs = [(shard, str(path.with_name('{0}.{1}.gdml'.format(path.stem, shard._main_name))), pretty)
+            for shard in split_shards(mygdml, threshold)]
+    placed = {shard._main_name: shard_file for shard, shard_file, _ in jobs}
+    for physvol in mygdml.structure.getElements().iter('physvol'):
+        ref = physvol.find('volumeref')
+        if ref is not None and ref.get('ref') in placed:
+            ref.tag = 'file'
+            # Shards are next to the master document
+            name = pathlib.Path(placed[ref.get('ref')]).name
+            ref.attrib.clear()
+            ref.set('name', name)
+
+    _write_all(jobs, processes, (mygdml, filename, pretty), threads)
+    return [shard_file for _, shard_file, _ in jobs]
+
+
+def split_shards(mygdml, threshold):
+    '''Moves each volume whose tessellated solid has more than threshold
+    facets, with the solid and its vertices, out of mygdml into a new GDML
+    named after the volume, and returns those. Volumes with daughters, the
+    world, and volumes a replicavol, paramvol or loop uses stay in mygdml,
+    as only a physvol can place a volume from a file.'''
+    define, solids, structure = mygdml.define, mygdml.solids, mygdml.structure
+    big = {el.get('name'): el for el in solids.getElements()
+           if el.tag == 'tessellated' and len(el) > threshold}
+    pinned = {ref.get('ref') for mother in structure.getElements() for daughter in mother
+              if daughter.tag in DAUGHTER_TAGS and daughter.tag != 'physvol'
+              for ref in daughter.iter('volumeref')}
+    volumes = {}
+    for volume in structure.getElements():
+        solid = volume.find('solidref')
+        if solid is not None and solid.get('ref') in big:
+            volumes.setdefault(solid.get('ref'), []).append(volume)
+    # Solids used by a volume that cannot be moved are left alone
+    for name, users in list(volumes.items()):
+        if any(vol is structure._world or vol.get('name') in pinned
+               or any(daughter.tag in DAUGHTER_TAGS for daughter in vol) for vol in users):
+            del volumes[name]
+
+    shards = {}
+    owners = {}
+    moved = set()
+    for name, users in volumes.items():
+        for volume in users:
+            shard = GDML(volume.get('name'))
+            shard.setup.getElements().find('world').set('ref', volume.get('name'))
+            shards[volume] = shard
+            moved.add(volume)
+        targets = [shards[volume] for volume in users]
+        for facet in big[name]:
+            for key, ref in facet.items():
+                if key != 'type':
+                    owners[ref] = targets
+        moved.add(big[name])
+
+    # One pass over the defines keeps the vertices in order
+    kept = []
+    for el in define.getElements():
+        targets = owners.get(el.get('name'))
+        if targets is None:
+            kept.append(el)
+            continue
+        for shard in targets:
+            shard.define._register(_append(shard.define, el))
+    define.getElements()[:] = kept
+    for name in owners:
+        define._names.pop(name, None)
+
+    for volume, shard in shards.items():
+        for material in mygdml.materials.getElements():
+            _append(shard.materials, material)
+        shard.solids._register(_append(shard.solids, big[volume.find('solidref').get('ref')]))
+        shard.structure._world = shard.structure._register(_append(shard.structure, volume))
+
+    for section in (solids, structure):
+        _remove(section, moved)
+    return list(shards.values())
+
+
+def _append(section, el):
+    return _adopt(section.getElements(), el)
+
+
+def _remove(section, elements):
+    'Removes elements from a section and its index in one pass.'
+    core = section.getElements()
+    core[:] = [el for el in core if el not in elements]
+    for el in elements:
+        name = el.get('name')
+        if section._names.get(name) is el:
+            del section._names[name]
+
+
+def _write(job):
+    mygdml, filename, pretty = job
+    with atomic_path(filename) as tmp:
+        mygdml.to_file(tmp, pretty)
+
+
+def _write_job(index):
+    _write(_JOBS[index])
+
+
+def _write_all(jobs, processes, master, threads=False):
+    'Writes the shards in a process pool while this process writes the master.'
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or not jobs:
+        for job in jobs + [master]:
+            _write(job)
+        return
+    if threads:
+        with ThreadPoolExecutor(processes) as pool:
+            results = pool.map(_write, jobs)
+            _write(master)
+            list(results)
+        return
+
+    global _JOBS
+    try:
+        # Forked workers inherit the documents instead of unpickling them
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = None
+    _JOBS = jobs
+    try:
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            if context is not None:
+                results = pool.map(_write_job, range(len(jobs)))
+            else:
+                results = pool.map(_write, jobs)
+            _write(master)
+            list(results)
+    finally:
+        _JOBS = []
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+import time
+import tracemalloc
+
+__all__ = ['Stats']
+
+
+class Stats(object):
+    '''Opt-in statistics of an export: the wall time of each phase, counts
+    such as vertices, facets and bytes written, and the number of elements
+    in each section of a document.
+
+    Time a phase with "with stats.phase('name'):"; a phase entered again adds
+    to its time. With memory=True, the peak memory allocated in each phase is
+    traced with tracemalloc, which slows Python down. progress is called as
+    progress(fraction, message) by exporters as they go. Each hook is called
+    with the name of a phase and must return a context manager to enter
+    around it, such as lambda name: profile for a cProfile.Profile.'''
+
+    def __init__(self, memory=False, progress=None, hooks=()):
+        self.memory = memory
+        self.hooks = list(hooks)
+        self._progress = progress
+        self.seconds = {}
+        self.peak_bytes = {}
+        self.counts = Counter()
+        self.elements = {}
+        self._stack = []
+        self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name):
+        with ExitStack() as hooks:
+            for hook in self.hooks:
+                hooks.enter_context(hook(name))
+            if self.memory:
+                self._enter_memory()
+            start = time.perf_counter()
+            try:
+                yield self
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0.) + time.perf_counter() - start
+                if self.memory:
+                    peak = self._exit_memory()
+                    self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak)
+
+    def _enter_memory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            # The peak is reset for this phase, keep what the outer one saw
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._stack.append([current, current])
+
+    def _exit_memory(self):
+        base, seen = self._stack.pop()
+        peak = max(seen, tracemalloc.get_traced_memory()[1])
+        if self._stack:
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+        elif self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return peak - base
+
+    def add(self, key, n=1):
+        'Adds n to a count, such as vertices, facets or bytes.'
+        self.counts[key] += n
+
+    def count_elements(self, mygdml):
+        'Records the number of elements in each section of a document.'
+        for section in mygdml.sections:
+            # Positions of a compact document, and volumes, may not be in place yet
+            pending = sum(len(block.coords) for block in getattr(section, '_pending', ()))
+            pending += len(getattr(section, '_volumes', ()))
+            self.elements[section._core.tag] = len(section._core) + pending
+
+    def progress(self, fraction, message=''):
+        if self._progress is not None:
+            self._progress(fraction, message)
+
+    def as_dict(self):
+        return {'seconds': dict(self.seconds), 'peak_bytes': dict(self.peak_bytes),
+                'counts': dict(self.counts), 'elements': dict(self.elements)}
+
+    def report(self):
+        'A table of the phases, counts and elements, as text.'
+        lines = []
+        for name, seconds in self.seconds.items():
+            line = '{0:>16} {1:10.3f} s'.format(name, seconds)
+            if name in self.peak_bytes:
+                line += ' {0:10.1f} MiB'.format(self.peak_bytes[name] / 2**20)
+            lines.append(line)
+        for name, n in sorted(self.counts.items()):
+            lines.append('{0:>16} {1:10d}'.format(name, n))
+        for tag, n in self.elements.items():
+            lines.append('{0:>16} {1:10d} elements'.format('<' + tag + '>', n))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
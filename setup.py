@@ -9,4 +9,6 @@ setup(name='PyGDML',
        description='Collection of tools for gdml conversion.',
        author='Henry Schreiner III',
        author_email='henryiii@physics.utexas.edu',
-       packages=['pygdml'])
+       packages=['pygdml'],
+       install_requires=['numpy'],
+       entry_points={'console_scripts': ['pygdml = pygdml.convert:main']})
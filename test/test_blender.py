@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import types
+import importlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+
+# The exporters only use bpy to read the scene, so stand-ins are enough to
+# import them for the parts that run on copied MeshData
+sys.modules.setdefault('bpy', types.ModuleType('bpy'))
+if 'bpy_types' not in sys.modules:
+    sys.modules['bpy_types'] = types.ModuleType('bpy_types')
+    sys.modules['bpy_types'].Mesh = type('Mesh', (), {})
+# Import them as make_blend_zip.py lays out the add-on, next to pygdml
+addon = types.ModuleType('blender_gdml')
+addon.__path__ = [str(DIR.parent / 'blender_scripts'), str(DIR.parent / 'pygdml')]
+sys.modules.setdefault('blender_gdml', addon)
+blendertoGDML = importlib.import_module('blender_gdml.blendertoGDML')
+blendertoCPP = importlib.import_module('blender_gdml.blendertoCPP')
+MeshData, Placement = blendertoGDML.MeshData, blendertoGDML.Placement
+
+# A box of 2 by 4 by 6, as quads
+CORNERS = np.array([(x, y, z) for x in (-1, 1) for y in (-2, 2) for z in (-3, 3)], dtype=float)
+QUADS = np.array([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]])
+# A tetrahedron, not a primitive
+TETRA = np.array([(0, 0, 0), (1, 0, 0), (0, 2, 0), (0, 0, 3)], dtype=float)
+TRIANGLES = np.array([[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]])
+TURNED = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+
+
+def placed(name, verts, faces, loc, axes, data):
+    return MeshData(name, 'G4_Pb', verts, faces, Placement(loc, axes, (1, 1, 1), (data, (1, 1, 1), 'G4_Pb')))
+
+
+def scene():
+    'Meshes as extract_meshes copies them with instances, and one without.'
+    return [
+        placed('Cube', CORNERS, QUADS, (10, 0, 0), np.eye(3), 'CubeMesh'),
+        # A linked duplicate, which arrives without vertices
+        placed('Cube_001', None, None, (-10, 0, 0), TURNED, 'CubeMesh'),
+        # Another mesh datablock with the same geometry
+        placed('Cube_002', CORNERS.copy(), QUADS.copy(), (0, 10, 0), np.eye(3), 'CubeCopy'),
+        placed('Tetra', TETRA, TRIANGLES, (0, -10, 0), np.eye(3), 'TetraMesh'),
+        placed('Tetra_001', None, None, (0, 0, 10), TURNED, 'TetraMesh'),
+        MeshData('Loose', 'G4_Si', TETRA + 5, TRIANGLES, None),
+    ]
+
+
+class TestBuildGDML(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build(self, name, **options):
+        filepath = self.tmp / name
+        stats = blendertoGDML.Stats()
+        converted = blendertoGDML.build_gdml(filepath, scene(), pretty=False, instances=True,
+                                             primitives=True, stats=stats, **options)
+        return filepath, converted, stats
+
+    def counts(self, filepath):
+        mygdml = gdml.GDML.from_file(filepath)
+        structure = mygdml.structure.getElements()
+        return (len(mygdml.solids.getElements()), len(structure.findall('volume')),
+                len(list(structure.iter('physvol'))))
+
+    def test_instances_and_primitives(self):
+        filepath, converted, stats = self.build('scene.gdml')
+        self.assertEqual(converted, {'Cube': 'box'})
+        # world, the box, the tetrahedron and Loose
+        self.assertEqual(self.counts(filepath), (4, 4, 6))
+        # Linked duplicates arrive without vertices and are not counted
+        self.assertEqual(stats.counts['objects'], 4)
+
+    def test_cache(self):
+        cache_dir = str(self.tmp / 'cache')
+        cold, converted, stats = self.build('cold.gdml', cache_dir=cache_dir)
+        self.assertEqual(converted, {'Cube': 'box'})
+        self.assertEqual(stats.counts['cached'], 0)
+        self.assertEqual(self.counts(cold), (4, 4, 6))
+
+        warm, converted, stats = self.build('warm.gdml', cache_dir=cache_dir)
+        # Primitives are recognised again, the tessellated solids come from the cache
+        self.assertEqual(converted, {'Cube': 'box'})
+        self.assertEqual(stats.counts['cached'], 2)
+        self.assertEqual(self.counts(warm), (4, 4, 6))
+        self.assertEqual(cold.read_text().replace('cold', 'warm'), warm.read_text())
+
+
+class TestBuildCPP(unittest.TestCase):
+
+    def test_cache(self):
+        meshes = [MeshData('Tetra', 'G4_Pb', TETRA, TRIANGLES, None),
+                  MeshData('Cube', 'G4_Pb', CORNERS, QUADS, None)]
+        with TemporaryDirectory() as tmp:
+            texts = []
+            for cached in (0, 2):
+                filepath = Path(tmp) / 'scene.cc'
+                stats = blendertoCPP.Stats()
+                blendertoCPP.build_cpp(filepath, meshes, cache_dir=str(Path(tmp) / 'cache'), stats=stats)
+                self.assertEqual(stats.counts['cached'], cached)
+                texts.append(filepath.read_text())
+        self.assertEqual(texts[0], texts[1])
+        self.assertEqual(texts[0].count('new G4TessellatedSolid'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.bounds import Bounds
+
+
+class TestBounds(unittest.TestCase):
+
+    def setUp(self):
+        mygdml = gdml.GDML('bounds')
+        mygdml.solids.addBox('world', 10, 10, 10)
+        mygdml.structure.addWorld()
+        mygdml.solids.addBox('box', 2, 4, 6)
+        mygdml.solids.addTube('tube', 0, 1, 2, startphi=0, deltaphi=90)
+        mygdml.solids.addCone('cone', 0, 1, 0, 2, 4, lunit='cm')
+        mygdml.solids.addTrapeziod('trd', 1, 3, 2, 1, 5)
+        mygdml.define.addVerts('mesh', [(0, 0, 0), (1, 0, 0), (0, 2, 0), (0, 0, 3)], unit='mm')
+        mygdml.solids.addTessallated('mesh', [[0, 1, 2], [0, 1, 3], [1, 2, 3], [0, 2, 3]])
+        self.mygdml = mygdml
+        self.bounds = Bounds(mygdml)
+
+    def assertBounds(self, bounds, low, high):
+        np.testing.assert_allclose(bounds[0], low, atol=1e-12)
+        np.testing.assert_allclose(bounds[1], high, atol=1e-12)
+
+    def test_primitives(self):
+        self.assertBounds(self.bounds.solid('box'), (-1, -2, -3), (1, 2, 3))
+        self.assertBounds(self.bounds.solid('tube'), (0, 0, -1), (1, 1, 1))
+        self.assertBounds(self.bounds.solid('cone'), (-.02, -.02, -.02), (.02, .02, .02))
+        self.assertBounds(self.bounds.solid('trd'), (-1.5, -1, -2.5), (1.5, 1, 2.5))
+        self.assertBounds(self.bounds.solid('mesh'), (0, 0, 0), (.001, .002, .003))
+
+    def test_expressions(self):
+        define, solids = self.mygdml.define, self.mygdml.solids
+        define.addQuantity('det_length', 3, 'length', 'm')
+        define.addConstant('half', '0.5')
+        define.addConstant('ratio', 'half*2^2')
+        solids.addBox('sized', 'det_length/m', '2*half', 'ratio+1', lunit='m')
+        solids.addTube('round', 0, 'det_length/mm', 4, startphi='-half', deltaphi='pi', aunit='rad', lunit='mm')
+        self.assertBounds(self.bounds.solid('sized'), (-1.5, -.5, -1.5), (1.5, .5, 1.5))
+        # 3000 mm from -0.5 to pi - 0.5 rad
+        self.assertBounds(self.bounds.solid('round'), (-3 * np.cos(.5), -3 * np.sin(.5), -.002),
+                          (3, 3, .002))
+
+        define.addConstant('loop', 'loop+1')
+        solids.addBox('unknown', 'width', 1, 1)
+        solids.addBox('looped', 'loop', 1, 1)
+        solids.addBox('indexed', 'sizes[1]', 1, 1)
+        for name, reason in (('unknown', 'unknown name width'), ('looped', 'loop is defined in terms of itself'),
+                             ('indexed', 'cannot evaluate Subscript')):
+            with self.assertRaises(ValueError) as raised:
+                self.bounds.solid(name)
+            self.assertIn('box ' + name + ': unsupported expression', str(raised.exception))
+            self.assertIn(reason, str(raised.exception))
+
+    def test_placement(self):
+        define, structure = self.mygdml.define, self.mygdml.structure
+        define.addPosition('shift', 100, 0, 0, unit='cm')
+        define.addRotation('quarter', z=90)
+        structure.addVolume('box', 'G4_Pb', 'shift', 'quarter')
+        structure.addVolume('tube', 'G4_Pb', parent='box', volume_rotation='quarter')
+        self.assertBounds(self.bounds.volume('tube'), (0, 0, -1), (1, 1, 1))
+        # Geant4 applies the inverse rotation, so the quarter tube turns by -90 degrees
+        self.assertBounds(self.bounds.contents('box'), (0, -1, -1), (1, 0, 1))
+        self.assertBounds(self.bounds.volume('box'), (-1, -2, -3), (1, 2, 3))
+        self.assertBounds(self.bounds.contents(), (-1, -1, -3), (3, 1, 3))
+
+    def test_add_points(self):
+        self.bounds.add_points('mesh', np.array([(-5, 0, 0), (5, 1, 2)]), unit='cm')
+        self.assertBounds(self.bounds.solid('mesh'), (-.05, 0, 0), (.05, .01, .02))
+        self.bounds.forget('mesh')
+        self.assertBounds(self.bounds.solid('mesh'), (0, 0, 0), (.001, .002, .003))
+
+    def test_unknown(self):
+        self.mygdml.solids.addGeneric('sphere', name='ball', rmax=1)
+        with self.assertRaises(ValueError):
+            self.bounds.solid('ball')
+
+
+if __name__ == '__main__':
+    unittest.main()
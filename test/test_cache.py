@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.cache import FragmentCache, recording, add_fragment
+
+VERTS = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+FACES = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = FragmentCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key(self):
+        key = FragmentCache.key('a', np.arange(3.), 1)
+        self.assertEqual(key, FragmentCache.key('a', np.arange(3.), 1))
+        self.assertNotEqual(key, FragmentCache.key('a', np.arange(3), 1))
+        self.assertNotEqual(key, FragmentCache.key('a', np.arange(3.), 2))
+        self.assertNotEqual(FragmentCache.key('ab', 'c'), FragmentCache.key('a', 'bc'))
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.cache.put('found', b'data')
+        self.assertEqual(self.cache.get('found'), b'data')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # A new cache sees the same directory
+        self.assertEqual(FragmentCache(self.tmp.name).get('found'), b'data')
+
+    def test_evict(self):
+        data = os.urandom(1000)
+        cache = FragmentCache(self.tmp.name, max_bytes=2500)
+        past = time.time() - 100
+        for n, key in enumerate(('first', 'second')):
+            cache.put(key, data)
+            os.utime(str(cache._path(key)), (past + n, past + n))
+        # Using the first makes the second the oldest
+        cache.get('first')
+        cache.put('third', data)
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(cache.get('first'), data)
+        self.assertEqual(cache.get('third'), data)
+
+    def test_fragment(self):
+        mygdml = gdml.GDML()
+        mygdml.define.addPosition('before')
+        with recording(mygdml) as fragment:
+            mygdml.define.addVerts('tet', VERTS)
+            mygdml.solids.addTessallated('tet', FACES)
+        self.assertEqual([len(part) for part in fragment], [4, 1])
+        self.cache.put_fragment('tet', fragment)
+
+        copy = gdml.GDML()
+        add_fragment(copy, self.cache.get_fragment('tet'))
+        self.assertIsNone(copy.define.find('before'))
+        self.assertIsNotNone(copy.define.find('tet_v3'))
+        self.assertEqual(copy.solids.to_string(), mygdml.solids.to_string())
+
+
+if __name__ == '__main__':
+    unittest.main()
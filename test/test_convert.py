@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml import meshio
+from pygdml.convert import main, convert_file, Options
+
+VERTS = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+FACES = [[0, 1, 2], [0, 1, 3], [1, 2, 3], [0, 2, 3]]
+
+
+class TestConvert(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        for name, material in (('tet', 'G4_Pb'), ('plain', None)):
+            meshio.write_dump(self.dir / (name + '.npz'), VERTS, FACES, material)
+
+    def run_main(self, *args):
+        with redirect_stdout(StringIO()) as out, redirect_stderr(StringIO()):
+            code = main([str(arg) for arg in args])
+        return code, out.getvalue()
+
+    def test_dump(self):
+        mesh = meshio.read_mesh(self.dir / 'tet.npz')
+        np.testing.assert_array_equal(mesh.verts, VERTS)
+        np.testing.assert_array_equal(mesh.faces, FACES)
+        self.assertEqual(mesh.material, 'G4_Pb')
+        self.assertIsNone(meshio.read_mesh(self.dir / 'plain.npz').material)
+        with self.assertRaises(ValueError):
+            meshio.read_mesh(self.dir / 'tet.xyz')
+
+    def test_gdml(self):
+        code, out = self.run_main(self.dir, '-o', self.dir / 'out', '-j', 1, '--unit', 'mm')
+        self.assertEqual(code, 0)
+        self.assertIn('Converted 2 files (0 failed, 0 up to date)', out)
+        loaded = gdml.GDML.from_file(self.dir / 'out' / 'tet.gdml')
+        self.assertEqual(len(loaded.solids.find('tet')), 4)
+        self.assertEqual(loaded.structure.find('tet').find('materialref').get('ref'), 'G4_Pb')
+        self.assertEqual(loaded.define.find('tet_v1').get('unit'), 'mm')
+        loaded = gdml.GDML.from_file(self.dir / 'out' / 'plain.gdml')
+        self.assertEqual(loaded.structure.find('plain').find('materialref').get('ref'), 'G4_AIR')
+
+        code, out = self.run_main(self.dir, '-o', self.dir / 'out')
+        self.assertIn('Converted 0 files (0 failed, 2 up to date)', out)
+        os.utime(str(self.dir / 'tet.npz'), (1e10, 1e10))
+        code, out = self.run_main(self.dir, '-o', self.dir / 'out', '-j', 2)
+        self.assertIn('Converted 1 files (0 failed, 1 up to date)', out)
+
+    def test_cpp(self):
+        result = convert_file(self.dir / 'tet.npz', self.dir / 'tet.cc', Options('cpp', unit='mm'))
+        self.assertIsNone(result.error)
+        self.assertEqual(result.facets, 4)
+        self.assertIn('G4ThreeVector(0.0010,0.0000,0.0000)*m', (self.dir / 'tet.cc').read_text())
+
+    def test_failure(self):
+        (self.dir / 'bad.npz').write_bytes(b'not a dump')
+        code, out = self.run_main(self.dir / 'bad.npz', self.dir / 'tet.npz', '-j', 1)
+        self.assertEqual(code, 1)
+        self.assertIn('(1 failed', out)
+        self.assertFalse((self.dir / 'bad.gdml').exists())
+        self.assertTrue((self.dir / 'tet.gdml').exists())
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
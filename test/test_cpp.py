@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+from io import StringIO
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+from pygdml.cpp import G4TessellatedSolid, CHUNK
+
+
+def legacy_str(solid):
+    'The text the original line by line G4TessellatedSolid.__str__ built.'
+    info = dict(name=solid._name, nfaces=len(solid.faces), nverts=len(solid._vertlist),
+                solid='solid' + solid._name, verts=solid._name + '_v', faces=solid._name + '_f')
+    init = ('// Solid {name} exported from Blender\n'
+            'G4TessellatedSolid* {solid} = new G4TessellatedSolid("{name}");\n'
+            'G4VFacet* {faces}[{nfaces}];\n').format(**info)
+    vertlist = 'G4ThreeVector {verts}[] = {{\n'.format(**info)
+    for vert in solid._vertlist:
+        vertlist += '    G4ThreeVector({0[0]:.4f},{0[1]:.4f},{0[2]:.4f})*m,\n'.format(vert)
+    vertlist += '};\n'
+    facelist = ''
+    for n, face in enumerate(solid.faces):
+        name = 'Triangular' if len(face) == 3 else 'Quadrangular'
+        facelist += '{faces}[{n}] = (G4VFacet*) new G4{type}Facet ( '.format(n=n, type=name, **info)
+        facelist += ', '.join('{verts}[{v}]'.format(v=vertex, **info) for vertex in face) + ', ABSOLUTE);\n'
+    finalize = ('for(int i_{name}=0; i_{name}<{nfaces}; i_{name}++)\n'
+                '    {solid}->AddFacet({faces}[i_{name}]);\n'
+                '{solid}->SetSolidClosed(true);\n').format(**info)
+    return '\n'.join([init, vertlist, facelist, finalize])
+
+
+class TestG4TessellatedSolid(unittest.TestCase):
+
+    def solid(self, n, arrays=False):
+        '''A flat strip of n quads, with a triangle between each two, so the
+        quads are kept and the faces are written in more than one chunk.'''
+        x = np.repeat(np.arange(n + 1), 2) * 1e-3
+        y = np.tile([0, 2e-3], n + 1)
+        verts = np.stack([x, y, np.full_like(x, 0.5)], axis=1)
+        faces = []
+        for i in range(n):
+            faces.append([2 * i, 2 * i + 2, 2 * i + 3, 2 * i + 1])
+            faces.append([2 * i, 2 * i + 2, 2 * i + 1, -1])
+        solid = G4TessellatedSolid('strip.1')
+        if arrays:
+            solid.add_verts(verts)
+            solid.add_faces(np.array(faces))
+        else:
+            for vert in verts.tolist():
+                solid.add_vert(vert)
+            for face in faces:
+                solid.add_face([v for v in face if v >= 0])
+        return solid
+
+    def test_legacy_text(self):
+        for n in (0, 3, CHUNK):
+            for arrays in (False, True):
+                solid = self.solid(n, arrays)
+                self.assertEqual(len(solid.faces), 2 * n)
+                expected = legacy_str(solid)
+                self.assertEqual(str(solid), expected)
+                with StringIO() as f:
+                    solid.write(f)
+                    self.assertEqual(f.getvalue(), expected)
+
+    def test_facet_types(self):
+        text = str(self.solid(1))
+        self.assertIn('strip_1_f[0] = (G4VFacet*) new G4QuadrangularFacet ( strip_1_v[1], strip_1_v[3], '
+                      'strip_1_v[2], strip_1_v[0], ABSOLUTE);', text)
+        self.assertIn('strip_1_f[1] = (G4VFacet*) new G4TriangularFacet ( strip_1_v[1], strip_1_v[2], '
+                      'strip_1_v[0], ABSOLUTE);', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
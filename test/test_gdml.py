@@ -2,8 +2,10 @@
 
 import unittest
 import sys
+import warnings
 from pathlib import Path
 from tempfile import TemporaryFile
+from io import StringIO
 
 # Add main directory to path, get DIR
 DIR = Path(__file__).absolute().parent
@@ -11,6 +13,11 @@ if str(DIR.parent) not in sys.path:
     sys.path.append(str(DIR.parent))
 import pygdml.gdml as gdml
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 REQUIRED_DETECTOR = ('det_rotation', 'det_location', 'Shell', 'Strips', 'Core')
 
 
@@ -133,5 +140,367 @@ class TestStandardDetector(unittest.TestCase):
             main_file.unlink()
 
 
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.mygdml = gdml.GDML('simple')
+        self.mygdml.solids.addBox('world', 4, 5, 6)
+        self.mygdml.structure.addWorld()
+
+    def test_find(self):
+        box = self.mygdml.solids.addBox('bigbox', 1, 2, 3)
+        self.assertIs(self.mygdml.solids.find('bigbox'), box)
+        self.assertIs(self.mygdml.find('bigbox'), box)
+        self.assertIs(gdml.find_element_with_name(self.mygdml, 'bigbox'), box)
+        self.assertIn('center', self.mygdml.define)
+        self.assertNotIn('bigbox', self.mygdml.define)
+        self.assertTrue(self.mygdml.validate(('center', 'world', 'World')))
+
+    def test_duplicate_warns(self):
+        self.mygdml.solids.addBox('bigbox', 1, 2, 3)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.mygdml.solids.addBox('bigbox', 1, 2, 3)
+        self.assertEqual(len(caught), 1)
+        self.assertIs(caught[0].category, gdml.DuplicateNameWarning)
+
+    def test_string_parent(self):
+        self.mygdml.solids.addBox('outer', 1, 2, 3)
+        outer = self.mygdml.structure.addVolume('outer', 'G4_AIR')
+        self.mygdml.solids.addBox('inner', 1, 1, 1)
+        self.mygdml.structure.addVolume('inner', 'G4_Pb', parent='outer')
+        self.mygdml.structure.addVolumeFile('other.gdml', parent='outer')
+        physvols = outer.findall('physvol')
+        self.assertEqual(physvols[0].find('volumeref').get('ref'), 'inner')
+        self.assertEqual(physvols[1].find('file').get('name'), 'other.gdml')
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addVolume('inner', 'G4_Pb', parent='missing')
+
+    def test_volume_order(self):
+        # Daughters come before their mothers, the world last
+        for name in ('outer', 'inner', 'core'):
+            self.mygdml.solids.addBox(name, 1, 1, 1)
+        self.mygdml.structure.addVolume('outer', 'G4_AIR')
+        self.mygdml.structure.addVolume('inner', 'G4_AIR', parent='outer')
+        self.assertEqual([el.get('name') for el in self.mygdml.structure.getElements()],
+                         ['inner', 'outer', 'World'])
+        self.mygdml.structure.addVolume('core', 'G4_Pb', parent='inner')
+        self.assertIn('<volume name="core">', self.mygdml.to_string(False))
+        self.assertEqual([el.get('name') for el in self.mygdml.structure.getElements()],
+                         ['core', 'inner', 'outer', 'World'])
+
+    def test_physvol_copies(self):
+        self.mygdml.solids.addBox('bolt', 1, 1, 1)
+        self.mygdml.define.addPosition('left', -1)
+        self.mygdml.structure.addVolume('bolt', 'G4_Fe')
+        physvol = self.mygdml.structure.addPhysvol('bolt', 'left', aux=('Color', 'red'))
+        world = self.mygdml.structure.find('World')
+        self.assertEqual([p.find('volumeref').get('ref') for p in world.findall('physvol')], ['bolt', 'bolt'])
+        self.assertEqual(physvol.find('positionref').get('ref'), 'left')
+        self.assertEqual(physvol.find('auxiliary').get('auxval'), 'red')
+        self.assertEqual(len(self.mygdml.structure.getElements().findall('volume')), 2)
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addPhysvol('nut')
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestPlacements(unittest.TestCase):
+
+    def setUp(self):
+        self.mygdml = gdml.GDML('array')
+        self.mygdml.solids.addBox('world', 4, 5, 6)
+        self.mygdml.structure.addWorld()
+        self.strip = self.mygdml.solids.addBox('strip', .1, 1, .01)
+        self.mygdml.structure.addVolume('strip', 'G4_Si')
+        self.world = self.mygdml.structure.find('World')
+
+    def test_physvols(self):
+        positions = np.arange(12.).reshape(4, 3)
+        matrices = np.tile(np.eye(3), (4, 1, 1))
+        matrices[1] = [[0, 1, 0], [-1, 0, 0], [0, 0, 1]]
+        physvols = self.mygdml.structure.addPhysvols('strip', positions, matrices, copynumbers=True)
+        self.assertEqual(len(self.world.findall('physvol')), 5)
+        self.assertEqual(physvols[3].get('copynumber'), '3')
+        self.assertEqual(physvols[2].find('position').attrib, {'x': '6.0', 'y': '7.0', 'z': '8.0', 'unit': 'm'})
+        self.mygdml.define.addRotationMatrix('turn', *matrices[1].ravel())
+        self.assertAlmostEqual(float(physvols[1].find('rotation').get('z')),
+                               float(self.mygdml.define.find('turn').get('z')))
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addPhysvols('strip', positions, np.zeros((2, 3)))
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addPhysvols('nut', positions)
+
+    def test_replica(self):
+        self.mygdml.solids.addBox('layer', 1, 1, .01)
+        self.mygdml.structure.addVolume('layer', 'G4_AIR')
+        replica = self.mygdml.structure.addReplica('strip', 10, .1, 'x', -.45, parent='layer')
+        self.assertEqual(replica.get('number'), '10')
+        self.assertEqual(replica.find('replicate_along_axis/direction').attrib, {'x': '1'})
+        self.assertEqual(replica.find('replicate_along_axis/width').get('value'), '0.1')
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addReplica('strip', 10, .1, parent='layer')
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addReplica('strip', 10, .1, 'w')
+
+    def test_paramvol(self):
+        positions = [[x, 0, 0] for x in (-1, 0, 1)]
+        paramvol = self.mygdml.structure.addParamvol('strip', self.strip, positions)
+        self.assertEqual(paramvol.get('ncopies'), '3')
+        copies = paramvol.findall('parameterised_position_size/parameters')
+        self.assertEqual([copy.get('number') for copy in copies], ['1', '2', '3'])
+        self.assertEqual(copies[0].find('box_dimensions').attrib, {'x': '0.1', 'y': '1', 'z': '0.01', 'lunit': 'm'})
+        with self.assertRaises(ValueError):
+            self.mygdml.structure.addParamvol('strip', self.mygdml.solids.addTube('rod', 0, 1, 1), positions)
+
+        from pygdml.bounds import Bounds
+        low, high = Bounds(self.mygdml).contents()
+        np.testing.assert_allclose(low, [-1.05, -.5, -.005])
+        np.testing.assert_allclose(high, [1.05, .5, .005])
+
+    def test_loop(self):
+        self.mygdml.define.addVariable('i', 0)
+        loop = self.mygdml.structure.addLoop('strip', 20, (.1, 0, 0), (-.95, 0, 0))
+        self.assertEqual(loop.attrib, {'for': 'i', 'from': '0', 'to': '19', 'step': '1'})
+        self.assertEqual(loop.find('physvol/position').get('x'), '-0.95+i*(0.1)')
+        self.assertIn('<loop for="i"', self.mygdml.to_string())
+
+class TestStreaming(unittest.TestCase):
+
+    @staticmethod
+    def build(mygdml):
+        mygdml.solids.addBox('world', 4, 5, 6)
+        mygdml.structure.addWorld()
+        for n in range(2):
+            name = 'mesh{0}'.format(n)
+            mygdml.define.addVerts(name, ((i, i / 2, -i) for i in range(10)))
+            faces = ([i, i + 1, i + 2] if i % 2 else [i, i + 1, i + 2, i + 3]
+                     for i in range(7))
+            mygdml.solids.addTessallated(name, faces)
+            mygdml.structure.addVolume(name, 'G4_Pb')
+        mygdml.define.addVerts('padded', ((i, 0, i * i) for i in range(10)))
+        mygdml.solids.addTessallated('padded', np.array(
+            [[i, i + 1, i + 2, -1 if i % 3 else i + 3] for i in range(7)]))
+        mygdml.materials.addElement('Hydrogen', 1, 'H', '1.01')
+
+    def test_matches_to_file(self):
+        expected = gdml.GDML('stream')
+        self.build(expected)
+        expected_file = StringIO()
+        expected.to_file(expected_file)
+
+        old_batch, old_cached = gdml.STREAM_BATCH, gdml.VERTEX_NAMES_CACHED
+        gdml.STREAM_BATCH, gdml.VERTEX_NAMES_CACHED = 3, 4
+        try:
+            mygdml = gdml.GDML('stream')
+            streamed_file = StringIO()
+            with mygdml.stream_to(streamed_file):
+                self.build(mygdml)
+        finally:
+            gdml.STREAM_BATCH, gdml.VERTEX_NAMES_CACHED = old_batch, old_cached
+
+        self.assertEqual(expected_file.getvalue(), streamed_file.getvalue())
+        self.assertLess(len(mygdml.define.getElements()), 3)
+
+
+@unittest.skipIf(gdml.lxml_etree is None, 'requires lxml')
+class TestBackends(unittest.TestCase):
+
+    def outputs(self, backend):
+        old = 'lxml' if gdml.etree is gdml.lxml_etree else 'etree'
+        gdml.use_backend(backend)
+        try:
+            mygdml = gdml.GDML('backend')
+            TestStreaming.build(mygdml)
+            mygdml.define.addRotation('turn', 10, 20, 30)
+            mygdml.structure.addVolume('mesh0', 'G4_Pb', 'center', 'turn', parent='mesh1',
+                                       logical_name='copy', aux=('color', '"<&>" \u00e9'))
+            plain, streamed = StringIO(), StringIO()
+            mygdml.to_file(plain)
+            with gdml.GDML('backend').stream_to(streamed) as stream:
+                TestStreaming.build(stream._gdml)
+            with TemporaryFile('w+b') as f:
+                f.write(plain.getvalue().encode())
+                f.seek(0)
+                loaded = gdml.GDML.from_file(f).to_string(False)
+            return [mygdml.to_string(True), mygdml.to_string(False), plain.getvalue(),
+                    streamed.getvalue(), loaded]
+        finally:
+            gdml.use_backend(old)
+
+    def test_same_output(self):
+        for etree_output, lxml_output in zip(self.outputs('etree'), self.outputs('lxml')):
+            self.assertEqual(etree_output, lxml_output)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            gdml.use_backend('minidom')
+
+
+class TestReader(unittest.TestCase):
+
+    def setUp(self):
+        self.mypath = Path('tmp_read_will_be_deleted.gdml')
+        mygdml = gdml.GDML('reader')
+        mygdml.solids.addBox('world', 4, 5, 6)
+        mygdml.structure.addWorld()
+        mygdml.define.addVerts('mesh', [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)])
+        mygdml.solids.addTessallated('mesh', [[0, 1, 2], [0, 1, 3], [1, 2, 3], [0, 2, 3]])
+        mygdml.structure.addVolume('mesh', 'G4_Pb')
+        mygdml.to_file(self.mypath)
+        self.mygdml = mygdml
+
+    def test_round_trip(self):
+        loaded = gdml.GDML.from_file(self.mypath)
+        self.assertEqual(loaded.to_string(False), self.mygdml.to_string(False))
+        self.assertIn('mesh_v3', loaded.define)
+        loaded.solids.addBox('inner', 0.1, 0.1, 0.1)
+        loaded.structure.addVolume('inner', 'G4_Al', parent='mesh')
+        self.assertEqual(len(loaded.structure.find('mesh').findall('physvol')), 1)
+
+    def test_lazy(self):
+        loaded = gdml.GDML.from_file(str(self.mypath), lazy=True)
+        self.assertEqual(len(loaded.solids.getElements()[1]), 4)
+        loaded = gdml.GDML.from_file(self.mypath, lazy=True)
+        self.assertEqual(len(loaded.solids.find('mesh')), 4)
+        self.assertEqual(loaded.to_string(False), self.mygdml.to_string(False))
+
+    def test_compressed(self):
+        suffixes = ['.gz', '.xz'] + (['.zst'] if gdml.zstd is not None else [])
+        plain = self.mypath.read_text()
+        for suffix in suffixes:
+            path = self.mypath.with_name(self.mypath.name + suffix)
+            try:
+                self.mygdml.to_file(path, level=1)
+                self.assertNotEqual(path.read_bytes()[:5], b'<?xml')
+                loaded = gdml.GDML.from_file(path, lazy=True)
+                self.assertEqual(loaded.to_string(False), self.mygdml.to_string(False))
+                with path.open('rb') as f:
+                    loaded = gdml.GDML.from_file(f)
+                self.assertEqual(loaded.to_string(False), self.mygdml.to_string(False))
+                with gdml.decompressed(path) as name:
+                    self.assertEqual(Path(name).read_text(), plain)
+                self.assertFalse(Path(name).exists())
+            finally:
+                if path.exists():
+                    path.unlink()
+        with gdml.decompressed(self.mypath) as name:
+            self.assertEqual(name, str(self.mypath))
+
+    def test_atomic_path(self):
+        before = self.mypath.read_text()
+        with self.assertRaises(KeyError):
+            with gdml.atomic_path(self.mypath) as tmp:
+                self.mygdml.to_file(tmp)
+                raise KeyError
+        self.assertEqual(self.mypath.read_text(), before)
+        self.assertFalse(Path(tmp).exists())
+        with gdml.atomic_path(self.mypath) as tmp:
+            self.mygdml.to_file(tmp, pretty=True)
+            self.assertEqual(self.mypath.read_text(), before)
+        self.assertEqual(self.mypath.read_text(), self.mygdml.to_string(pretty=True))
+        self.assertFalse(Path(tmp).exists())
+
+    def test_pretty_golden(self):
+        loaded = gdml.GDML.from_file(DIR / 'simple_objects.gdml')
+        with (DIR / 'simple_objects.gdml').open() as f:
+            self.assertEqual(str(loaded), f.read())
+
+    def tearDown(self):
+        if self.mypath.exists():
+            self.mypath.unlink()
+
+
+@unittest.skipUnless(np, 'requires numpy')
+class TestArrayInput(unittest.TestCase):
+
+    def test_same_as_lists(self):
+        verts = [(0.1, 0.0, 1e-5), (1.0, 2.5, 3.0), (-1.0, 1e16, 0.25), (4.0, 4.0, 4.0)]
+        triangles = [[1, 2, 3], [0, 3, 2]]
+        quads = [[0, 1, 2, 3]]
+
+        from_lists = gdml.GDML('arrays')
+        from_lists.define.addVerts('mesh', verts)
+        from_lists.solids.addTessallated('mesh', triangles)
+        from_lists.solids.addTessallated('quads', quads)
+
+        from_arrays = gdml.GDML('arrays')
+        from_arrays.define.addVerts('mesh', np.array(verts))
+        from_arrays.solids.addTessallated('mesh', np.array(triangles))
+        from_arrays.solids.addTessallated('quads', np.array(quads))
+
+        self.assertEqual(from_lists.to_string(False), from_arrays.to_string(False))
+
+
+class TestCompact(unittest.TestCase):
+
+    def build(self, compact):
+        mygdml = gdml.GDML('compact', compact=compact)
+        mygdml.solids.addBox('world', 10, 10, 10)
+        mygdml.structure.addWorld()
+        mygdml.define.addVerts('tet', [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)])
+        mygdml.define.addPosition('between')
+        mygdml.define.addVerts('sheet', np.arange(3 * 5000, dtype=np.float32).reshape(-1, 3) / 7)
+        mygdml.solids.addTessallated('tet', [[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+        mygdml.solids.addTessallated('sheet', np.array([[0, 1, 2, -1], [1, 2, 3, 4]] * 2500))
+        mygdml.structure.addVolume('tet', 'G4_Si')
+        return mygdml
+
+    def test_same_output(self):
+        for pretty in (False, True):
+            self.assertEqual(self.build(False).to_string(pretty), self.build(True).to_string(pretty))
+            eager, compact = StringIO(), StringIO()
+            self.build(False).to_file(eager, pretty)
+            self.build(True).to_file(compact, pretty)
+            self.assertEqual(eager.getvalue(), compact.getvalue())
+
+    def test_deferred(self):
+        mygdml = self.build(True)
+        self.assertEqual(len(mygdml.define._core), 3 + 1)
+        self.assertEqual(len(mygdml.solids.getElements()[1]), 4)
+        self.assertIn('tet_v3', mygdml.define)
+        self.assertNotIn('tet_v4', mygdml.define)
+        self.assertEqual(mygdml.define.find('sheet_v4999').get('x'), str(np.float32(4999 * 3 / 7)))
+        self.assertEqual(len(mygdml.define.getElements()), 3 + 1 + 4 + 5000)
+        self.assertEqual(mygdml.to_string(False), self.build(False).to_string(False))
+
+    def test_mixed_types(self):
+        verts = [(0, 0.5, 1), (1.25, 2, 3.0), (np.float32(0.1), 4, -0.0)]
+        texts = []
+        for compact in (False, True):
+            mygdml = gdml.GDML('mixed', compact=compact)
+            mygdml.define.addVerts('mesh', verts)
+            mygdml.define.addVerts('ints', [(1, 2, 3)])
+            mygdml.define.addVerts('floats', iter([(1., 2., 3.)]))
+            texts.append(mygdml.to_string(False))
+        self.assertEqual(texts[0], texts[1])
+        self.assertIn('name="mesh_v0" x="0" y="0.5" z="1" unit="m"', texts[0])
+        self.assertIn('name="ints_v0" x="1" y="2" z="3" unit="m"', texts[0])
+        self.assertIn('name="floats_v0" x="1.0" y="2.0" z="3.0" unit="m"', texts[0])
+
+    def test_empty(self):
+        texts = []
+        for compact in (False, True):
+            mygdml = gdml.GDML('empty', compact=compact)
+            mygdml.define.addVerts('mesh', np.empty((0, 3)))
+            mygdml.solids.addTessallated('mesh', np.empty((0, 3)))
+            texts.append(mygdml.to_string(False))
+        self.assertEqual(texts[0], texts[1])
+        self.assertIn('<tessellated name="mesh"', texts[0])
+
+    def test_ngons(self):
+        for compact in (False, True):
+            for faces in ([[0, 1, 2], [0, 1, 2, 3, 4]], np.array([[0, 1, 2, -1], [0, 1, -1, -1]])):
+                mygdml = gdml.GDML('ngons', compact=compact)
+                with self.assertRaisesRegex(ValueError, 'face of tessellated solid mesh has [25] vertices'):
+                    mygdml.solids.addTessallated('mesh', faces)
+                    mygdml.to_string(False)
+
+    def test_duplicate(self):
+        mygdml = gdml.GDML('compact', compact=True)
+        mygdml.define.addVerts('tet', [(0, 0, 0)])
+        with self.assertWarns(gdml.DuplicateNameWarning):
+            mygdml.define.addVerts('tet', [(0, 0, 0)])
+
+
 if __name__ == '__main__':
     unittest.main()
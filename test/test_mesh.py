@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.mesh as mesh
+
+
+class TestWeld(unittest.TestCase):
+
+    def test_weld_and_prune(self):
+        verts = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1e-9, 0), (5, 5, 5), (0, 1, 1e-9)]
+        faces = [[0, 1, 2], [3, 2, 5, 0], [0, 3, 5]]
+        newverts, newfaces, removed = mesh.weld_vertices(verts, faces, 1e-6)
+        self.assertEqual(removed, 3)
+        np.testing.assert_array_equal(newverts, [(0, 0, 0), (1, 0, 0), (0, 1, 0)])
+        # The quad loses its repeated vertex and becomes a triangle
+        self.assertEqual(newfaces, [[0, 1, 2], [1, 2, 0], [0, 1, 2]])
+
+    def test_collapsed_faces(self):
+        verts = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1e-9), (0, 1, 0)]
+        faces = np.array([[0, 1, 2, 3], [0, 1, 2, 4], [0, 1, 1, -1], [2, 3, 4, -1]])
+        newverts, newfaces, removed = mesh.weld_vertices(verts, faces)
+        self.assertEqual(removed, 1)
+        np.testing.assert_array_equal(newfaces, [[0, 1, 2, -1], [0, 1, 2, 3]])
+
+    def test_across_cells(self):
+        verts = [(0.49e-6, 0, 0), (0.51e-6, 0, 0), (3e-6, 0, 0), (1, 1, 1), (1 + 2e-7, 1 - 2e-7, 1)]
+        faces = [[0, 1, 2], [0, 2, 3], [3, 4, 2]]
+        newverts, newfaces, removed = mesh.weld_vertices(verts, faces, 1e-6)
+        self.assertEqual(removed, 2)
+        np.testing.assert_array_equal(newverts, [(0.49e-6, 0, 0), (3e-6, 0, 0), (1, 1, 1)])
+        self.assertEqual(newfaces, [[0, 1, 2]])
+
+    def test_chained(self):
+        # Each vertex is within tolerance of the next, so all of them merge
+        verts = [(i * 0.9e-6, 0, 0) for i in range(5)] + [(1, 0, 0), (0, 1, 0)]
+        newverts, newfaces, removed = mesh.weld_vertices(verts, [[4, 5, 6], [0, 2, 5]])
+        self.assertEqual(removed, 4)
+        self.assertEqual(newfaces, [[0, 1, 2]])
+
+    def test_array_faces(self):
+        verts = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1), (0, 0, 1)], dtype=float)
+        faces = np.array([[0, 1, 2], [0, 1, 3], [0, 4, 1]])
+        newverts, newfaces, removed = mesh.weld_vertices(verts, faces)
+        self.assertEqual(removed, 1)
+        self.assertIsInstance(newfaces, np.ndarray)
+        np.testing.assert_array_equal(newfaces, [[0, 1, 2], [0, 1, 3], [0, 3, 1]])
+
+    def test_no_tolerance_only_prunes(self):
+        verts = [(0, 0, 0), (0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        newverts, newfaces, removed = mesh.weld_vertices(verts, [[1, 2, 3]], 0)
+        self.assertEqual(removed, 1)
+        self.assertEqual(newfaces, [[0, 1, 2]])
+
+    def test_empty(self):
+        verts, faces = np.empty((0, 3)), np.empty((0, 3))
+        self.assertEqual(mesh.as_face_array(faces).shape, (0, 3))
+        self.assertEqual(mesh.split_faces(faces, verts).shape, (0, 3))
+        newverts, newfaces, removed = mesh.weld_vertices(verts, faces)
+        self.assertEqual((newverts.shape, newfaces.shape, removed), ((0, 3), (0, 3), 0))
+        self.assertEqual(mesh.mesh_hash(verts, faces), mesh.mesh_hash(verts, np.empty((0, 3), int)))
+
+
+class TestSplitFaces(unittest.TestCase):
+
+    verts = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0),
+             (1, 1, 1e-12), (1, 1, 0.5), (0.2, 0.2, 0), (0.5, 0.3, 0), (0.5, 1, 0)]
+
+    def test_quads(self):
+        faces = [[0, 1, 2], [0, 1, 4, 3], [0, 1, 5, 3], [0, 1, 6, 3], [0, 7, 1, 8]]
+        self.assertEqual(mesh.split_faces(faces, self.verts),
+                         [[0, 1, 2],
+                          [0, 1, 4, 3],
+                          [0, 1, 5], [0, 5, 3],
+                          [0, 1, 6], [0, 6, 3],
+                          [7, 1, 8], [7, 8, 0]])
+
+    def test_exact_tolerance(self):
+        self.assertEqual(mesh.split_faces([[0, 1, 4, 3]], self.verts, tolerance=0),
+                         [[0, 1, 4], [0, 4, 3]])
+
+    def test_array(self):
+        faces = np.array([[0, 1, 2, 3], [0, 1, 5, 3]])
+        np.testing.assert_array_equal(mesh.split_faces(faces, self.verts),
+                                      [[0, 1, 2, 3], [0, 1, 5, -1], [0, 5, 3, -1]])
+
+    def test_triangles_only(self):
+        faces = np.array([[0, 1, 2], [2, 3, 0]])
+        np.testing.assert_array_equal(mesh.split_faces(faces, self.verts), faces)
+        self.assertEqual(mesh.split_faces(faces.tolist(), self.verts), faces.tolist())
+        # Padded to a pentagon, but without quads
+        faces = np.array([[0, 1, 2, -1, -1], [0, 1, 2, 3, 6]])
+        np.testing.assert_array_equal(mesh.split_faces(faces, self.verts),
+                                      [[0, 1, 2], [0, 1, 2], [0, 2, 3], [0, 3, 6]])
+
+    def test_ngons(self):
+        # An L shaped hexagon, concave at vertex 4
+        verts = [(0, 0, 0), (2, 0, 0), (2, 1, 0), (1, 1, 0), (1, 2, 0), (0, 2, 0)]
+        face = [[0, 1, 2, 3, 4, 5]]
+        self.assertEqual(mesh.split_faces(face, verts),
+                         [[0, 1, 2], [0, 2, 3], [0, 3, 4], [0, 4, 5]])
+        triangles = mesh.split_faces(face, verts, ngons='ear')
+        self.assertEqual(len(triangles), 4)
+        points = np.array(verts, dtype=float)
+        for a, b, c in triangles:
+            normal = np.cross(points[b] - points[a], points[c] - points[a])
+            self.assertGreater(normal[2], 0)
+        area = sum(np.cross(points[b] - points[a], points[c] - points[a])[2] / 2
+                   for a, b, c in triangles)
+        self.assertAlmostEqual(area, 3)
+
+    def test_short_faces(self):
+        for faces in ([[0, 1]], [[0, 1, 2], [0, 1]], np.array([[0, 1, 2], [3, -1, -1]]), [[]]):
+            with self.assertRaisesRegex(ValueError, 'faces need at least 3'):
+                mesh.split_faces(faces, self.verts)
+
+
+class TestHash(unittest.TestCase):
+
+    def test_same_geometry(self):
+        verts = [(0, 0, 0), (1, 0, 0), (0, 1, -0.)]
+        self.assertEqual(mesh.mesh_hash(verts, [[0, 1, 2]]),
+                         mesh.mesh_hash(np.array([(0, 0, 0.), (1, 0, 0), (0, 1, 0)]), np.array([[0, 1, 2]])))
+        self.assertNotEqual(mesh.mesh_hash(verts, [[0, 1, 2]]), mesh.mesh_hash(verts, [[0, 2, 1]]))
+        moved = [(0, 0, 0), (1, 1e-9, 0), (0, 1, 0)]
+        self.assertNotEqual(mesh.mesh_hash(verts, [[0, 1, 2]]), mesh.mesh_hash(moved, [[0, 1, 2]]))
+        self.assertEqual(mesh.mesh_hash(verts, [[0, 1, 2]], 1e-6), mesh.mesh_hash(moved, [[0, 1, 2]], 1e-6))
+
+
+class TestDecimate(unittest.TestCase):
+
+    def setUp(self):
+        # A closed UV sphere of quads with triangle fans at the poles
+        rings, segments = 30, 60
+        theta, phi = np.meshgrid(np.linspace(0, np.pi, rings + 1)[1:-1],
+                                 np.linspace(0, 2 * np.pi, segments, endpoint=False), indexing='ij')
+        self.verts = np.vstack([np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi),
+                                          np.cos(theta)], axis=-1).reshape(-1, 3),
+                                [(0, 0, 1), (0, 0, -1)]])
+        top, bottom, last = len(self.verts) - 2, len(self.verts) - 1, (rings - 2) * segments
+        self.faces = ([[r * segments + j, (r + 1) * segments + j, (r + 1) * segments + (j + 1) % segments,
+                        r * segments + (j + 1) % segments]
+                       for r in range(rings - 2) for j in range(segments)]
+                      + [[top, (j + 1) % segments, j] for j in range(segments)]
+                      + [[bottom, last + j, last + (j + 1) % segments] for j in range(segments)])
+
+    def check_closed(self, verts, faces):
+        faces = np.asarray(faces)
+        edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        _, counts = np.unique(edges, axis=0, return_counts=True)
+        self.assertTrue(np.all(counts == 2))
+        np.testing.assert_allclose(np.linalg.norm(verts, axis=1), 1, atol=0.02)
+
+    def test_budget(self):
+        verts, faces = mesh.decimate(self.verts, self.faces, budget=500)
+        self.assertLessEqual(len(faces), 500)
+        self.assertGreater(len(faces), 250)
+        self.assertIsInstance(faces, list)
+        self.check_closed(verts, faces)
+
+    def test_tolerance(self):
+        verts, faces = mesh.decimate(self.verts, np.array(self.faces[:-120]), tolerance=0.2)
+        self.assertIsInstance(faces, np.ndarray)
+        self.assertLess(len(faces), len(self.faces))
+        np.testing.assert_allclose(np.linalg.norm(verts, axis=1), 1, atol=0.02)
+
+    def test_under_budget(self):
+        verts, faces = mesh.decimate(self.verts, self.faces, budget=10 ** 6)
+        self.assertEqual(len(verts), len(self.verts))
+        self.assertEqual(len(faces), 2 * len(self.faces) - 120)
+
+    def test_needs_target(self):
+        with self.assertRaises(ValueError):
+            mesh.decimate(self.verts, self.faces)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml import meshio
+
+# A unit cube, as quads and as triangles
+VERTS = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                  [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype=np.float32)
+QUADS = np.array([[0, 3, 2, 1], [4, 5, 6, 7], [0, 1, 5, 4], [1, 2, 6, 5], [2, 3, 7, 6], [3, 0, 4, 7]])
+TRIANGLES = np.concatenate([QUADS[:, [0, 1, 2]], QUADS[:, [0, 2, 3]]])
+# Two quads and two triangles
+MIXED = [QUADS[0], QUADS[1], TRIANGLES[8], TRIANGLES[9]]
+
+
+class TestMeshIO(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def write_ply(self, name, form, faces):
+        header = ('ply\nformat {0} 1.0\ncomment made by a test\nelement vertex {1}\n'
+                  'property float x\nproperty float y\nproperty float z\nproperty uchar red\n'
+                  'element face {2}\nproperty list uchar int vertex_indices\nend_header\n').format(
+                      form, len(VERTS), len(faces))
+        with (self.dir / name).open('wb') as f:
+            f.write(header.encode())
+            if form == 'ascii':
+                for vert in VERTS.tolist():
+                    f.write('{0} {1} {2} 255\n'.format(*vert).encode())
+                for face in faces:
+                    f.write(' '.join(map(str, [len(face)] + list(face))).encode() + b'\n')
+                return
+            order = '<' if form == 'binary_little_endian' else '>'
+            records = np.zeros(len(VERTS), [('x', order + 'f4'), ('y', order + 'f4'),
+                                            ('z', order + 'f4'), ('red', 'u1')])
+            records['x'], records['y'], records['z'] = VERTS.T
+            f.write(records.tobytes())
+            for face in faces:
+                f.write(bytes([len(face)]) + np.array(face, dtype=order + 'i4').tobytes())
+
+    def check(self, mesh, faces):
+        np.testing.assert_array_equal(mesh.verts, VERTS)
+        expected = np.full((len(faces), max(map(len, faces))), -1)
+        for row, face in zip(expected, faces):
+            row[:len(face)] = face
+        np.testing.assert_array_equal(mesh.faces, expected)
+
+    def test_binary_stl(self):
+        records = np.zeros(len(TRIANGLES), meshio.STL_RECORD)
+        records['corners'] = VERTS[TRIANGLES]
+        # -0.0 is the same vertex as 0.0
+        records['corners'][0, 0, 0] = -0.
+        with (self.dir / 'cube.stl').open('wb') as f:
+            f.write(b'solid but binary'.ljust(80) + len(records).to_bytes(4, 'little') + records.tobytes())
+        mesh = meshio.read_mesh(self.dir / 'cube.stl')
+        self.assertEqual(len(mesh.verts), 8)
+        np.testing.assert_array_equal(mesh.verts[mesh.faces], VERTS[TRIANGLES])
+        np.testing.assert_array_equal(mesh.faces[:2], [[0, 1, 2], [3, 4, 5]])
+
+    def test_ascii_stl(self):
+        with (self.dir / 'cube.stl').open('w') as f:
+            f.write('solid cube\n')
+            for triangle in VERTS[TRIANGLES].tolist():
+                f.write(' facet normal 0 0 0\n  outer loop\n')
+                for corner in triangle:
+                    f.write('   vertex {0} {1} {2}\n'.format(*corner))
+                f.write('  endloop\n endfacet\n')
+            f.write('endsolid cube\n')
+        mesh = meshio.read_mesh(self.dir / 'cube.stl')
+        self.assertEqual(len(mesh.verts), 8)
+        np.testing.assert_array_equal(mesh.verts[mesh.faces], VERTS[TRIANGLES])
+
+    def test_ply(self):
+        for form in ('binary_little_endian', 'binary_big_endian', 'ascii'):
+            for faces in (TRIANGLES.tolist(), MIXED):
+                self.write_ply('cube.ply', form, faces)
+                self.check(meshio.read_mesh(self.dir / 'cube.ply'), faces)
+
+    def test_obj(self):
+        with (self.dir / 'cube.obj').open('w') as f:
+            f.write('# cube\nmtllib cube.mtl\no cube\n')
+            for vert in VERTS[:4].tolist():
+                f.write('v {0} {1} {2} 1.0\n'.format(*vert))
+            f.write('vt 0 0\nvn 0 0 -1\nusemtl G4_Si\nf 1/1/1 4/1/1 3/1/1 2/1/1\n')
+            for vert in VERTS[4:].tolist():
+                f.write('v {0} {1} {2}\n'.format(*vert))
+            f.write('f -4//1 -3//1 -2//1 -1//1\nf 1 6 5\nf 2 7 6\n')
+        mesh = meshio.read_mesh(self.dir / 'cube.obj')
+        self.assertEqual(mesh.material, 'G4_Si')
+        self.check(mesh, MIXED)
+
+    def test_tessellated(self):
+        self.write_ply('cube.ply', 'binary_little_endian', MIXED)
+        mesh = meshio.read_mesh(self.dir / 'cube.ply')
+        mygdml = gdml.GDML('cube')
+        mygdml.define.addVerts('cube', mesh.verts)
+        mygdml.solids.addTessallated('cube', mesh.faces)
+        self.assertEqual(mygdml.define.find('cube_v6').get('x'), '1.0')
+        facets = mygdml.solids.find('cube')
+        self.assertEqual([facet.tag for facet in facets], ['quadrangular'] * 2 + ['triangular'] * 2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+
+
+class TestOverlaps(unittest.TestCase):
+
+    def setUp(self):
+        mygdml = gdml.GDML('overlaps')
+        mygdml.solids.addBox('world', 10, 10, 10)
+        mygdml.structure.addWorld()
+        mygdml.solids.addBox('box', 1, 1, 1)
+        mygdml.solids.addTube('tube', 0, 0.5, 1)
+        # A unit cube as a mesh of quads
+        corners = [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+        mygdml.define.addVerts('cube', corners)
+        mygdml.solids.addTessallated('cube', [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1],
+                                              [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]])
+        self.mygdml = mygdml
+
+    def place(self, solid, volume, x=0, y=0, z=0, parent=None, rotation='identity'):
+        self.mygdml.define.addPosition(volume + '_at', x, y, z)
+        self.mygdml.structure.addVolume(solid, 'G4_Pb', volume + '_at', rotation,
+                                        parent=parent, logical_name=volume)
+
+    def overlaps(self, processes=1):
+        return sorted(tuple(overlap) for overlap in self.mygdml.check_overlaps(processes))
+
+    def test_separate_and_touching(self):
+        self.place('box', 'left', x=-1)
+        self.place('box', 'middle')
+        self.place('cube', 'right', 0.5, -0.5, -0.5)
+        self.place('tube', 'far', y=3)
+        self.assertEqual(self.overlaps(), [])
+
+    def test_crossing(self):
+        self.place('box', 'first')
+        self.place('cube', 'second', 0.2, 0.2, 0.2)
+        self.place('tube', 'third', y=3)
+        self.place('tube', 'fourth', y=3.9)
+        self.assertEqual(self.overlaps(2), [('World', 'first', 'second'), ('World', 'third', 'fourth')])
+
+    def test_contained_and_protruding(self):
+        self.mygdml.solids.addBox('small', 0.2, 0.2, 0.2)
+        self.place('box', 'outer')
+        self.place('small', 'inner', 0.1, 0.1, 0.1)
+        self.place('small', 'daughter', 0.45, parent='outer')
+        self.place('small', 'escaped', 6)
+        self.assertEqual(self.overlaps(), [('World', 'escaped', None), ('World', 'outer', 'inner'),
+                                           ('outer', 'daughter', None)])
+
+    def test_coplanar_faces(self):
+        self.place('box', 'first')
+        self.place('box', 'shifted', x=0.3)
+        self.place('box', 'second', y=3)
+        self.place('box', 'corner', 0.5, 3.5)
+        self.place('box', 'third', y=-3)
+        self.place('box', 'beside', y=-3, z=1)
+        self.mygdml.solids.addBox('half', 1, 1, 1)
+        self.place('box', 'mother', x=3)
+        self.place('half', 'sticking', x=0.6, parent='mother')
+        self.assertEqual(self.overlaps(), [('World', 'first', 'shifted'), ('World', 'second', 'corner'),
+                                           ('mother', 'sticking', None)])
+
+    def test_rotation(self):
+        self.mygdml.solids.addBox('plank', 4, 0.2, 0.2)
+        self.mygdml.define.addRotation('turned', z=90)
+        self.place('plank', 'across', y=1.5, rotation='turned')
+        self.place('box', 'block')
+        self.assertEqual(self.overlaps(), [('World', 'across', 'block')])
+
+    def test_expressions(self):
+        self.mygdml.define.addQuantity('side', 1.5, 'length', 'm')
+        self.mygdml.solids.addBox('sized', 'side/m', 1, 1)
+        self.mygdml.solids.addTube('round', 0, 'side/m/3', '2*0.5')
+        self.place('sized', 'wide')
+        self.place('round', 'near', x=1.2)
+        self.place('box', 'far', x=3)
+        self.assertEqual(self.overlaps(), [('World', 'wide', 'near')])
+
+        self.mygdml.solids.addBox('unknown', 'width/m', 1, 1)
+        self.place('unknown', 'broken', x=-3)
+        with self.assertRaisesRegex(ValueError, "box unknown: unsupported expression 'width/m'"):
+            self.overlaps()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import math
+from pathlib import Path
+
+import numpy as np
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.bounds import _rotation
+from pygdml.primitives import recognize, add_primitive
+
+TURN = _rotation(0.3, -0.5, 1.2).T
+
+
+def prism(bottom, top, height):
+    'A closed mesh between two polygons of radius bottom and top, with n-gon caps.'
+    n = 24
+    phi = 2 * np.pi * np.arange(n) / n
+    ring = np.stack([np.cos(phi), np.sin(phi)], axis=1)
+    verts = np.vstack([np.column_stack([ring * bottom, np.full(n, -height / 2)]),
+                       np.column_stack([ring * top, np.full(n, height / 2)])])
+    faces = [[i, (i + 1) % n, n + (i + 1) % n, n + i] for i in range(n)]
+    faces += [list(range(n))[::-1], list(range(n, 2 * n))]
+    if top == 0:
+        verts = np.vstack([verts[:n], [(0, 0, height / 2)]])
+        faces = [[i, (i + 1) % n, n] for i in range(n)] + [list(range(n))[::-1]]
+    return verts, faces
+
+
+class TestRecognize(unittest.TestCase):
+
+    def place(self, verts, shift=(1, 2, 3)):
+        return verts @ TURN.T + shift
+
+    def test_box(self):
+        corners = np.array([(x, y, z) for x in (-1, 1) for y in (-2, 2) for z in (-.5, .5)])
+        faces = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]
+        found = recognize(self.place(corners), faces)
+        self.assertEqual(found.solid, 'box')
+        self.assertEqual(sorted(round(v, 9) for v in found.params.values()), [1, 2, 4])
+        np.testing.assert_allclose(found.position, (1, 2, 3))
+        sizes = np.array([found.params[axis] for axis in 'xyz'])
+        local = (self.place(corners) - found.position) @ found.axes
+        np.testing.assert_allclose(np.abs(local), np.broadcast_to(sizes / 2, local.shape), atol=1e-12)
+
+    def test_tube_and_cone(self):
+        found = recognize(self.place(prism(1, 1, 40)[0]), prism(1, 1, 40)[1])
+        self.assertEqual(found.solid, 'tube')
+        self.assertAlmostEqual(found.params['rmax'], 1)
+        self.assertAlmostEqual(found.params['z'], 40)
+        np.testing.assert_allclose(found.position, (1, 2, 3))
+        np.testing.assert_allclose(np.abs(found.axes[:, 2]), np.abs(TURN[:, 2]))
+
+        found = recognize(*prism(2, 1, 3))
+        self.assertEqual(found.solid, 'cone')
+        self.assertAlmostEqual(abs(found.params['rmax1'] - found.params['rmax2']), 1)
+
+        found = recognize(*prism(2, 0, 3))
+        self.assertEqual(found.solid, 'cone')
+        self.assertEqual(min(found.params['rmax1'], found.params['rmax2']), 0)
+
+    def test_not_primitives(self):
+        # An L shaped prism, a hexagonal prism and a tube with a dent
+        verts = [(0, 0, 0), (2, 0, 0), (2, 1, 0), (1, 1, 0), (1, 2, 0), (0, 2, 0)]
+        verts = np.vstack([verts, np.array(verts) + (0, 0, 1)])
+        faces = [[5, 4, 3, 2, 1, 0], [6, 7, 8, 9, 10, 11]] + [[i, (i + 1) % 6, 6 + (i + 1) % 6, 6 + i]
+                                                              for i in range(6)]
+        self.assertIsNone(recognize(verts, faces))
+        self.assertIsNone(recognize(*prism(1, 1, 2), min_sides=32))
+        verts, faces = prism(1, 1, 2)
+        verts[3, :2] *= 0.9
+        self.assertIsNone(recognize(verts, faces))
+
+    def test_add_primitive(self):
+        mygdml = gdml.GDML('primitives')
+        mygdml.structure.addWorld()
+        found = recognize(self.place(prism(1, 1, 4)[0]), prism(1, 1, 4)[1])
+        add_primitive(mygdml, 'rod', found, 'G4_Fe')
+        self.assertEqual(mygdml.solids.find('rod').tag, 'tube')
+        rotation = mygdml.define.find('rod_rot')
+        angles = [math.radians(float(rotation.get(axis, 0))) for axis in 'xyz']
+        # Geant4 places the solid with the inverse of this rotation
+        np.testing.assert_allclose(_rotation(*angles).T, found.axes, atol=1e-12)
+        self.assertEqual(mygdml.structure.find('World').find('physvol').find('positionref').get('ref'),
+                         'rod_pos')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.shard import write_sharded
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.mypath = Path(self.tmpdir.name) / 'sharded.gdml'
+        mygdml = gdml.GDML('sharded')
+        mygdml.solids.addBox('world', 4, 5, 6)
+        mygdml.structure.addWorld()
+        mygdml.materials.addElement('Hydrogen', 1, 'H', '1.01')
+        for name, size in (('big', 8), ('large', 6), ('small', 2)):
+            mygdml.define.addVerts(name, ((i, i / 2, -i) for i in range(size + 2)))
+            mygdml.solids.addTessallated(name, ([i, i + 1, i + 2] for i in range(size)))
+            mygdml.structure.addVolume(name, 'G4_Pb')
+        self.mygdml = mygdml
+
+    def check(self, processes, threads=False):
+        shards = write_sharded(self.mygdml, self.mypath, threshold=4, processes=processes, threads=threads)
+        self.assertEqual(sorted(Path(s).name for s in shards), ['sharded.big.gdml', 'sharded.large.gdml'])
+
+        master = gdml.GDML.from_file(self.mypath)
+        self.assertIn('small', master)
+        self.assertIn('small_v0', master)
+        self.assertNotIn('big', master)
+        self.assertNotIn('big_v0', master)
+        files = [el.get('name') for el in master.structure.getElements().iter('file')]
+        self.assertEqual(sorted(files), ['sharded.big.gdml', 'sharded.large.gdml'])
+
+        shard = gdml.GDML.from_file(self.mypath.with_name('sharded.big.gdml'))
+        self.assertEqual(len(shard.solids.find('big')), 8)
+        self.assertIn('big_v9', shard.define)
+        self.assertIn('Hydrogen', shard.materials)
+        self.assertIs(shard.structure._world, shard.structure.find('big'))
+
+    def test_in_process(self):
+        self.check(1)
+
+    def test_pool(self):
+        self.check(2)
+
+    def test_threads(self):
+        self.check(2, threads=True)
+
+    def test_replica_not_sharded(self):
+        self.mygdml.solids.addBox('holder', 1, 1, 1)
+        self.mygdml.structure.addVolume('holder', 'G4_AIR')
+        self.mygdml.structure.addReplica('big', 4, 0.1, parent='holder')
+        shards = write_sharded(self.mygdml, self.mypath, threshold=4, processes=1)
+        self.assertEqual([Path(s).name for s in shards], ['sharded.large.gdml'])
+        master = gdml.GDML.from_file(self.mypath)
+        self.assertIsNotNone(master.structure.find('big'))
+        self.assertEqual(master.structure.find('holder').find('replicavol/volumeref').get('ref'), 'big')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
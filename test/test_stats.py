@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add main directory to path, get DIR
+DIR = Path(__file__).absolute().parent
+if str(DIR.parent) not in sys.path:
+    sys.path.append(str(DIR.parent))
+import pygdml.gdml as gdml
+from pygdml.stats import Stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_phases(self):
+        stats = Stats()
+        for _ in range(2):
+            with stats.phase('build'):
+                pass
+        with stats.phase('write'):
+            pass
+        self.assertEqual(list(stats.seconds), ['build', 'write'])
+        self.assertEqual(stats.peak_bytes, {})
+        stats.add('facets', 12)
+        stats.add('facets', 3)
+        self.assertEqual(stats.as_dict()['counts'], {'facets': 15})
+        self.assertIn('facets', stats.report())
+
+    def test_memory(self):
+        stats = Stats(memory=True)
+        with stats.phase('outer'):
+            big = bytearray(4 * 2**20)
+            del big
+            with stats.phase('inner'):
+                small = bytearray(2**20)
+                del small
+        self.assertGreaterEqual(stats.peak_bytes['inner'], 2**20)
+        self.assertLess(stats.peak_bytes['inner'], 2 * 2**20)
+        self.assertGreaterEqual(stats.peak_bytes['outer'], 4 * 2**20)
+
+    def test_hooks_and_progress(self):
+        seen = []
+
+        @contextmanager
+        def hook(name):
+            seen.append('enter ' + name)
+            yield
+            seen.append('exit ' + name)
+
+        stats = Stats(progress=lambda fraction, message: seen.append((fraction, message)), hooks=[hook])
+        with stats.phase('build'):
+            stats.progress(.5, 'half')
+        self.assertEqual(seen, ['enter build', (.5, 'half'), 'exit build'])
+
+    def test_gdml_to_file(self):
+        mygdml = gdml.GDML()
+        mygdml.stats = Stats()
+        mygdml.solids.addBox('world', 1, 1, 1)
+        mygdml.structure.addWorld()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = Path(tmp) / 'stats.gdml'
+            mygdml.to_file(filename)
+            self.assertEqual(mygdml.stats.counts['bytes'], filename.stat().st_size)
+        self.assertIn('write', mygdml.stats.seconds)
+        self.assertEqual(mygdml.stats.elements['solids'], 1)
+        self.assertEqual(mygdml.stats.elements['define'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()